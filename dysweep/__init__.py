@@ -1,5 +1,11 @@
-from .parallel import dysweep_run_resume, ResumableSweepConfig
+from .parallel import dysweep_run_resume, dysweep_create_batch, ResumableSweepConfig
 from .wandbX import hierarchical_config
 from .helper import parse_dictionary_onto_dataclass
+from .worker import shared_state, run_worker
+from .datacache import shared_dataset
+from .reporting import report, should_stop, budget
+from .space import ParameterSpace
+from .grid import GridIndex
+from .preemption import preemption_requested, preemption_event, on_preemption, atomic_write, Preempted
 
 __version__ = "0.1.6"
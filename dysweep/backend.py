@@ -0,0 +1,539 @@
+"""
+Backends are what dysweep uses to create sweeps, store their metadata, hand out
+configurations to agents, and keep track of the runs. The default backend is
+Weights and Biases; the local backend is a stand-in that keeps everything in a
+SQLite database on the filesystem, so that sweeps can run without any network
+access (e.g. for benchmarks, tests, or clusters without outbound internet).
+
+The backend is chosen using the `backend` (and `backend_dir`) fields of
+`ResumableSweepConfig`.
+"""
+import typing as th
+import contextlib
+import math
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+import wandb
+from .metadata import (encode_metadata, decode_metadata, metadata_digest, MetadataCache,
+                       FORMAT_VERSION, METADATA_FILE_NAME, METADATA_ARTIFACT_TYPE)
+from .space import infer_distribution
+from .grid import GridIndex
+from . import serialization
+
+METADATA_RUN_NAME_PREFIX = "HIERARCHICAL_SWEEP_"
+
+
+@dataclass
+class RunHandle:
+    """The run that is currently active in a backend."""
+    id: str
+    name: str
+    # the (standard, compressed) configuration of the run
+    config: th.Any
+
+
+class SweepBackend:
+    """
+    The interface that every backend implements. All the methods take the
+    `entity` and `project` arguments for compatibility with W&B even if a
+    backend does not use them.
+    """
+    # whether the backend can hand out configurations without running an
+    # agent, i.e. whether `claim_configs` is implemented.
+    supports_claims: bool = False
+
+    def create_sweep(self, sweep_standard: dict, sweep_metadata: dict,
+                     entity: th.Optional[str] = None, project: th.Optional[str] = None) -> str:
+        """Register a standardized sweep with its metadata and return the sweep identifier."""
+        raise NotImplementedError()
+
+    def load_metadata(self, sweep_id: str, entity: th.Optional[str] = None,
+                      project: th.Optional[str] = None) -> dict:
+        """Return the metadata (base_config and compression) stored for the sweep."""
+        raise NotImplementedError()
+
+    def load_sweep_config(self, sweep_id: str, entity: th.Optional[str] = None,
+                          project: th.Optional[str] = None) -> dict:
+        """Return the standardized sweep configuration (with its method and parameters)."""
+        raise NotImplementedError()
+
+    def agent(self, sweep_id: str, function: th.Callable, entity: th.Optional[str] = None,
+              project: th.Optional[str] = None, count: th.Optional[int] = None):
+        """Call `function` (without arguments) once for every configuration handed out by the sweep."""
+        raise NotImplementedError()
+
+    def claim_configs(self, sweep_id: str, n: int = 1) -> th.List[dict]:
+        """Claim the next `n` configurations of the sweep (fewer if the sweep runs out)."""
+        raise NotImplementedError()
+
+    def init_run(self, entity: th.Optional[str] = None, project: th.Optional[str] = None,
+                 name: th.Optional[str] = None, run_id: th.Optional[str] = None,
+                 from_sweep: bool = False, config: th.Optional[dict] = None,
+                 sweep_id: th.Optional[str] = None) -> RunHandle:
+        """
+        Start a run. When `run_id` is given, that run is resumed; when `from_sweep`
+        is set, the run gets the configuration that the agent has handed out.
+        When `config` is given, a new run is created with that (claimed) configuration
+        of the sweep `sweep_id`, and with `run_id` as its identifier.
+        """
+        raise NotImplementedError()
+
+    def generate_run_id(self) -> str:
+        return _random_id()
+
+    def register_run(self, sweep_id: str, run_id: str, name: str, config: dict,
+                     entity: th.Optional[str] = None, project: th.Optional[str] = None):
+        """
+        Record a run whose configuration has been claimed but that has not been started
+        yet, so that it can still be resumed (by its identifier) if it never gets to start.
+        """
+        pass
+
+    def rename_run(self, name: str):
+        """Change the name of the active run."""
+        raise NotImplementedError()
+
+    def update_config(self, values: dict):
+        raise NotImplementedError()
+
+    def mark_preempting(self):
+        raise NotImplementedError()
+
+    def run_summary(self) -> dict:
+        """The summary (i.e. the last logged values) of the active run."""
+        return {}
+
+    def update_summary(self, values: dict):
+        """Add `values` to the summary of the active run, if the backend keeps one."""
+        pass
+
+    def finish_run(self, exit_code: int = 0):
+        """Finish the active run; a non-zero `exit_code` marks the run as failed."""
+        raise NotImplementedError()
+
+    def log_runs(self, sweep_id: str, runs: th.List[dict], entity: th.Optional[str] = None,
+                 project: th.Optional[str] = None):
+        """
+        Record many runs of the sweep at once, without starting them one by one. Every
+        run is a dictionary with its `id`, `name`, (standard) `config`, `summary` and
+        `state` (either 'finished' or 'failed').
+        """
+        raise NotImplementedError()
+
+
+class WandbBackend(SweepBackend):
+    """The default backend that uses the Weights and Biases servers."""
+
+    def create_sweep(self, sweep_standard, sweep_metadata, entity=None, project=None):
+        sweep_id = wandb.sweep(sweep_standard, entity=entity, project=project)
+
+        # serialize the metadata once into a compact file; only a small
+        # pointer to that file is stored in the config of the metadata run.
+        data = encode_metadata(sweep_metadata)
+        digest = MetadataCache().put(data)
+        MetadataCache().remember_sweep(_sweep_key(sweep_id, entity, project), digest)
+
+        # create a run and save the metadata file as an artifact
+        run = wandb.init(entity=entity, project=project,
+                         name=f"{METADATA_RUN_NAME_PREFIX}{sweep_id}",
+                         config={'dysweep_metadata': {
+                             'format_version': FORMAT_VERSION,
+                             'digest': digest,
+                         }},
+                         notes="This run contains the metadata for the sweep."
+                         "\nDrawn from the hierarchical sweep package, at:"
+                         "\n\thttps://github.com/HamidrezaKmK/hierarchical-sweep",
+                         tags=["hierarchical_sweep"])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, METADATA_FILE_NAME), "wb") as f:
+                f.write(data)
+            artifact = wandb.Artifact(f"dysweep-metadata-{sweep_id}", type=METADATA_ARTIFACT_TYPE)
+            artifact.add_file(os.path.join(tmp_dir, METADATA_FILE_NAME), name=METADATA_FILE_NAME)
+            run.log_artifact(artifact)
+            wandb.finish()
+
+        return sweep_id
+
+    def load_metadata(self, sweep_id, entity=None, project=None):
+        """
+        The metadata is first looked up in the node-local cache; if this node has not
+        seen the sweep before, the metadata run is found and its metadata file is
+        downloaded once and put in the cache. Sweeps that were created by older versions
+        of dysweep store the metadata directly in the config of the metadata run.
+        """
+        cache = MetadataCache()
+        sweep_key = _sweep_key(sweep_id, entity, project)
+        sweep_metadata = cache.lookup_sweep(sweep_key)
+        if sweep_metadata is not None:
+            return sweep_metadata
+
+        # get the run_path from entity and project
+        run_path = ""
+        if entity is not None:
+            run_path = os.path.join(run_path, entity)
+        if project is not None:
+            run_path = os.path.join(run_path, project)
+
+        # only list the runs in the project that carry the metadata name
+        metadata_run_name = f"{METADATA_RUN_NAME_PREFIX}{sweep_id}"
+        all_runs = wandb.Api().runs(path=run_path, filters={"display_name": metadata_run_name})
+
+        # find the run with the metadata for the sweep we are looking for
+        sweep_run = None
+        for run in all_runs:
+            if run.name == metadata_run_name:
+                sweep_run = run
+                break
+
+        if sweep_run is None:
+            raise ValueError(
+                f"Could not find the run with artifacts associated with: {sweep_id}\n"
+                "Make sure you have the id correct!")
+
+        if 'dysweep_metadata' not in sweep_run.config:
+            # legacy sweeps: the metadata is the config of the run itself
+            return {
+                'base_config': sweep_run.config['base_config'],
+                'compression': sweep_run.config['compression'],
+            }
+
+        digest = sweep_run.config['dysweep_metadata']['digest']
+        sweep_metadata = cache.get(digest)
+        if sweep_metadata is None:
+            artifact = None
+            for logged_artifact in sweep_run.logged_artifacts():
+                if logged_artifact.type == METADATA_ARTIFACT_TYPE:
+                    artifact = logged_artifact
+                    break
+            if artifact is None:
+                raise ValueError(f"The metadata run of sweep {sweep_id} has no metadata artifact.")
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                artifact.download(root=tmp_dir)
+                with open(os.path.join(tmp_dir, METADATA_FILE_NAME), "rb") as f:
+                    data = f.read()
+            if metadata_digest(data) != digest:
+                raise ValueError(f"The metadata file of sweep {sweep_id} is corrupted.")
+            cache.put(data)
+            sweep_metadata = decode_metadata(data)
+        cache.remember_sweep(sweep_key, digest)
+        return sweep_metadata
+
+    def load_sweep_config(self, sweep_id, entity=None, project=None):
+        path = '/'.join(p for p in [entity, project, sweep_id] if p is not None)
+        return dict(wandb.Api().sweep(path).config)
+
+    def agent(self, sweep_id, function, entity=None, project=None, count=None):
+        return wandb.agent(sweep_id, function=function,
+                           entity=entity, project=project, count=count)
+
+    def init_run(self, entity=None, project=None, name=None, run_id=None, from_sweep=False,
+                 config=None, sweep_id=None):
+        init_args = {}
+        if name is not None:
+            init_args['name'] = name
+        if run_id is not None:
+            init_args['id'] = run_id
+        if config is not None:
+            init_args['config'] = config
+        if not from_sweep:
+            init_args['project'] = project
+            init_args['entity'] = entity
+        run = wandb.init(**init_args)
+        return RunHandle(id=run.id, name=run.name, config=wandb.config)
+
+    def rename_run(self, name):
+        wandb.run.name = name
+
+    def update_config(self, values):
+        wandb.config.update(values)
+
+    def mark_preempting(self):
+        wandb.mark_preempting()
+
+    def run_summary(self):
+        if wandb.run is None:
+            return {}
+        return dict(wandb.run.summary)
+
+    def update_summary(self, values):
+        if wandb.run is not None:
+            wandb.run.summary.update(values)
+
+    def finish_run(self, exit_code=0):
+        wandb.finish(exit_code=exit_code)
+
+
+def _sweep_key(sweep_id, entity=None, project=None) -> str:
+    return f"{entity}/{project}/{sweep_id}"
+
+
+def _random_id(length: int = 8) -> str:
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=length))
+
+
+def _to_builtin(value):
+    # numpy scalars and arrays in the results of a batch
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def _sample_parameter(spec: dict, rng: random.Random):
+    if 'values' in spec:
+        return rng.choice(spec['values'])
+    if 'value' in spec:
+        return spec['value']
+    distribution = infer_distribution(spec)
+    if distribution == 'uniform':
+        return rng.uniform(spec['min'], spec['max'])
+    if distribution == 'int_uniform':
+        return rng.randint(spec['min'], spec['max'])
+    if distribution == 'q_uniform':
+        q = spec.get('q', 1)
+        return round(rng.uniform(spec['min'], spec['max']) / q) * q
+    if distribution == 'log_uniform':
+        return math.exp(rng.uniform(spec['min'], spec['max']))
+    if distribution == 'log_uniform_values':
+        return math.exp(rng.uniform(math.log(spec['min']), math.log(spec['max'])))
+    if distribution == 'normal':
+        return rng.gauss(spec.get('mu', 0.0), spec.get('sigma', 1.0))
+    raise ValueError(f"The distribution {distribution} is not supported by the local backend.")
+
+
+class LocalBackend(SweepBackend):
+    """
+    A backend that keeps the sweeps, their metadata and the runs in a SQLite
+    database under `root`. Grid sweeps hand out every configuration exactly once
+    (even with many agents running concurrently on the same filesystem), computed
+    from its index so that the grid is never enumerated; random sweeps draw
+    configurations from a seeded random number generator.
+
+    A disabled W&B run is started for every run, so that `wandb.log` and
+    `wandb.config` in user code keep working (as no-ops).
+    """
+    supports_claims = True
+
+    def __init__(self, root: th.Union[Path, str]):
+        self.root = Path(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.db_path = self.root / "dysweep.sqlite"
+        self._assignment: th.Optional[th.Tuple[str, dict]] = None
+        self._run: th.Optional[RunHandle] = None
+        # the grids of the sweeps that this process has claimed from
+        self._grids: th.Dict[str, GridIndex] = {}
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS sweeps (
+                    id TEXT PRIMARY KEY, entity TEXT, project TEXT, config TEXT,
+                    metadata BLOB, seed INTEGER, cursor INTEGER DEFAULT 0, created REAL
+                );
+                CREATE TABLE IF NOT EXISTS runs (
+                    id TEXT PRIMARY KEY, sweep_id TEXT, entity TEXT, project TEXT, name TEXT,
+                    config TEXT, state TEXT, created REAL, finished REAL
+                );
+            """)
+            # the summary of the runs, added after the first release of the local backend
+            columns = [row[1] for row in db.execute("PRAGMA table_info(runs)")]
+            if 'summary' not in columns:
+                try:
+                    db.execute("ALTER TABLE runs ADD COLUMN summary TEXT")
+                except sqlite3.OperationalError:
+                    # another agent has just added it
+                    pass
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # a new connection per operation, so that the backend can be used from
+        # forked processes and threads.
+        db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def create_sweep(self, sweep_standard, sweep_metadata, entity=None, project=None):
+        sweep_id = _random_id()
+        method = sweep_standard.get('method') or 'grid'
+        if method not in ['grid', 'random']:
+            raise ValueError(f"The local backend only supports grid and random sweeps, got {method}.")
+        if method == 'grid':
+            # the configurations are computed from their index when they are claimed,
+            # this only checks that the grid is well-formed
+            GridIndex(sweep_standard.get('parameters', {}))
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT INTO sweeps (id, entity, project, config, metadata, seed, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sweep_id, entity, project, serialization.dumps(sweep_standard).decode('utf-8'),
+                 encode_metadata(sweep_metadata), random.randrange(2 ** 31), time.time()))
+            db.execute("COMMIT")
+        return sweep_id
+
+    def _sweep_row(self, db, sweep_id):
+        row = db.execute(
+            "SELECT config, metadata, seed, cursor FROM sweeps WHERE id = ?", (sweep_id,)).fetchone()
+        if row is None:
+            raise ValueError(
+                f"Could not find the sweep {sweep_id} in the local backend at {self.root}\n"
+                "Make sure you have the id correct!")
+        return row
+
+    def load_metadata(self, sweep_id, entity=None, project=None):
+        with self._connect() as db:
+            _, metadata, _, _ = self._sweep_row(db, sweep_id)
+        return decode_metadata(metadata)
+
+    def load_sweep_config(self, sweep_id, entity=None, project=None):
+        with self._connect() as db:
+            config, _, _, _ = self._sweep_row(db, sweep_id)
+        return serialization.loads(config)
+
+    def claim_configs(self, sweep_id: str, n: int = 1) -> th.List[dict]:
+        """
+        Atomically claim the next `n` configurations of the sweep. Fewer configurations
+        are returned when a grid sweep runs out of configurations.
+        """
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            config, _, seed, cursor = self._sweep_row(db, sweep_id)
+            sweep_standard = serialization.loads(config)
+            if (sweep_standard.get('method') or 'grid') == 'grid':
+                grid = self._grids.get(sweep_id)
+                if grid is None:
+                    grid = self._grids[sweep_id] = GridIndex(sweep_standard.get('parameters', {}))
+                configs = list(grid.configs(cursor, cursor + n))
+            else:
+                parameters = sweep_standard.get('parameters', {})
+                configs = []
+                for i in range(cursor, cursor + n):
+                    rng = random.Random(f"{seed}-{i}")
+                    configs.append({key: _sample_parameter(spec, rng)
+                                    for key, spec in sorted(parameters.items())})
+            db.execute("UPDATE sweeps SET cursor = ? WHERE id = ?",
+                       (cursor + len(configs), sweep_id))
+            db.execute("COMMIT")
+        return configs
+
+    def agent(self, sweep_id, function, entity=None, project=None, count=None):
+        ran = 0
+        while count is None or ran < count:
+            configs = self.claim_configs(sweep_id)
+            if len(configs) == 0:
+                break
+            self._assignment = (sweep_id, configs[0])
+            try:
+                function()
+            except Exception:
+                # same as the W&B agent: report the failure and go on with the next run
+                print(traceback.format_exc())
+                self.finish_run(exit_code=1)
+            finally:
+                self._assignment = None
+            ran += 1
+
+    def init_run(self, entity=None, project=None, name=None, run_id=None, from_sweep=False,
+                 config=None, sweep_id=None):
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            if run_id is not None and config is None:
+                row = db.execute("SELECT name, config FROM runs WHERE id = ?", (run_id,)).fetchone()
+                if row is None:
+                    raise ValueError(f"Could not find the run {run_id} in the local backend at {self.root}")
+                name = name or row[0]
+                config = serialization.loads(row[1])
+                db.execute("UPDATE runs SET state = 'running', name = ? WHERE id = ?", (name, run_id))
+            else:
+                if from_sweep:
+                    if self._assignment is None:
+                        raise ValueError("No configuration has been handed out by the local agent.")
+                    sweep_id, config = self._assignment
+                elif config is None:
+                    config = {}
+                run_id = run_id or _random_id()
+                name = name or run_id
+                db.execute(
+                    "INSERT OR REPLACE INTO runs (id, sweep_id, entity, project, name, config, state, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 'running', ?)",
+                    (run_id, sweep_id, entity, project, name,
+                     serialization.dumps(config).decode('utf-8'), time.time()))
+            db.execute("COMMIT")
+        self._run = RunHandle(id=run_id, name=name, config=config)
+        # a disabled W&B run so that user code can call wandb.log without a server
+        wandb.init(mode="disabled", id=run_id, name=name, config=config)
+        return self._run
+
+    def register_run(self, sweep_id, run_id, name, config, entity=None, project=None):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO runs (id, sweep_id, entity, project, name, config, state, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)",
+                (run_id, sweep_id, entity, project, name,
+                 serialization.dumps(config).decode('utf-8'), time.time()))
+
+    def _set_state(self, run_id: str, state: str):
+        with self._connect() as db:
+            db.execute("UPDATE runs SET state = ? WHERE id = ?", (state, run_id))
+
+    def rename_run(self, name):
+        if self._run is None:
+            raise ValueError("There is no active run to rename.")
+        self._run.name = name
+        with self._connect() as db:
+            db.execute("UPDATE runs SET name = ? WHERE id = ?", (name, self._run.id))
+
+    def update_config(self, values):
+        if self._run is None:
+            raise ValueError("There is no active run to update.")
+        config = dict(self._run.config)
+        config.update(values)
+        with self._connect() as db:
+            db.execute("UPDATE runs SET config = ? WHERE id = ?",
+                       (serialization.dumps(config, default=str).decode('utf-8'), self._run.id))
+
+    def mark_preempting(self):
+        if self._run is not None:
+            self._set_state(self._run.id, 'preempting')
+
+    def finish_run(self, exit_code=0):
+        if self._run is not None:
+            with self._connect() as db:
+                db.execute("UPDATE runs SET state = ?, finished = ? WHERE id = ?",
+                           ('finished' if exit_code == 0 else 'failed', time.time(), self._run.id))
+            self._run = None
+        wandb.finish()
+
+    def log_runs(self, sweep_id, runs, entity=None, project=None):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT OR REPLACE INTO runs (id, sweep_id, entity, project, name, config, state, "
+                "created, finished, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((run['id'], sweep_id, entity, project, run['name'],
+                  serialization.dumps(run['config'], default=str).decode('utf-8'), run['state'], now, now,
+                  serialization.dumps(run['summary'], default=_to_builtin).decode('utf-8'))
+                 for run in runs))
+            db.execute("COMMIT")
+
+
+def get_backend(name: th.Optional[str] = None,
+                root: th.Optional[th.Union[Path, str]] = None) -> SweepBackend:
+    """
+    Returns the backend with the given name, i.e. either `wandb` (the default)
+    or `local`, in which case `root` is the directory of the local database.
+    """
+    if name is None or name == 'wandb':
+        return WandbBackend()
+    if name == 'local':
+        if root is None:
+            raise ValueError("The local backend needs a directory to store the sweeps in.")
+        return LocalBackend(root)
+    raise ValueError(f"Unknown backend {name}, it should be either `wandb` or `local`.")
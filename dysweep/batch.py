@@ -0,0 +1,149 @@
+"""
+Batched evaluation for cheap objectives (analytic functions, small sklearn models,
+simulations, ...), where starting a run, creating its checkpoint directory and
+redirecting its output costs far more than the function itself. With `batch_size`,
+the agent claims that many configurations at once and calls the function once for
+the whole batch:
+
+```python
+def objective(configs):
+    # one hierarchical configuration per run
+    return [{'loss': c['x'] * c['y']} for c in configs]
+```
+
+With `batch_arrays`, the function gets the swept values as NumPy arrays instead,
+one per parameter (by its name in the sweep), so that it can be vectorized:
+
+```python
+def objective(configs):
+    return {'loss': configs['x'] * configs['y']}
+```
+
+The results are either a list with one dictionary (or number) per configuration,
+or a dictionary of arrays; they are recorded for all the runs of the batch at once.
+The runs of a batch do not get a checkpoint directory; if the function takes a
+`checkpoint_dir` argument, it gets the checkpoint directory of the sweep.
+"""
+import typing as th
+import inspect
+import traceback
+from pathlib import Path
+from . import wandbX
+from .backend import SweepBackend
+from .profiling import RunTimer
+
+# the key of a result that is given as a number, the same as the default metric
+DEFAULT_RESULT_KEY = 'dysweep_default'
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy should be installed for batch_arrays: pip install dysweep[space]")
+    return numpy
+
+
+def batch_arrays(raw_configs: th.List[dict]) -> th.Dict[str, th.Any]:
+    """The swept values of the (standard) configurations, as one array per parameter."""
+    np = _numpy()
+    aliases = (wandbX.compression or {}).get('values', {})
+    columns: th.Dict[str, list] = {}
+    for config in raw_configs:
+        for key, value in config.items():
+            columns.setdefault(key, []).append(value)
+    arrays = {}
+    for key, values in sorted(columns.items()):
+        if len(values) != len(raw_configs):
+            raise ValueError(f"The parameter {key} is missing from some configurations of the batch.")
+        values = [aliases[v] if isinstance(v, str) and v in aliases else v for v in values]
+        if any(isinstance(v, (list, dict)) for v in values):
+            # nested values (e.g. of aliases) are kept as they are
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+        else:
+            array = np.asarray(values)
+        arrays[key] = array
+    return arrays
+
+
+def result_rows(results, n: int) -> th.List[dict]:
+    """One summary dictionary per configuration from what the function has returned."""
+    if isinstance(results, dict):
+        rows = [{} for _ in range(n)]
+        for key, values in results.items():
+            values = list(values)
+            if len(values) != n:
+                raise ValueError(f"The result {key} has {len(values)} values for a batch of {n} configurations.")
+            for row, value in zip(rows, values):
+                row[key] = value
+        return rows
+    rows = [r if isinstance(r, dict) else {DEFAULT_RESULT_KEY: r} for r in results]
+    if len(rows) != n:
+        raise ValueError(f"The function has returned {len(rows)} results for a batch of {n} configurations.")
+    return rows
+
+
+def run_batches(
+    backend: SweepBackend,
+    sweep_id: str,
+    function: th.Callable,
+    batch_size: int,
+    count: th.Optional[int] = None,
+    arrays: bool = False,
+    checkpoint_dir: th.Optional[Path] = None,
+    entity: th.Optional[str] = None,
+    project: th.Optional[str] = None,
+    record_timings: th.Optional[th.Callable[..., None]] = None,
+) -> int:
+    """
+    Evaluate at most `count` configurations of the sweep (or all of them) in batches
+    of `batch_size`. Returns the number of configurations that have been evaluated.
+    """
+    params = inspect.signature(function).parameters
+    if "configs" not in params:
+        raise ValueError(
+            "with batch_size, the function passed to `dysweep_run_resume` should take the "
+            "following parameters: (configs) or (configs, checkpoint_dir)")
+    wandbX.load_hierarchical_metadata(sweep_id, entity=entity, project=project, backend=backend)
+
+    done = 0
+    while count is None or done < count:
+        timer = RunTimer()
+        n = batch_size if count is None else min(batch_size, count - done)
+        raw_configs = backend.claim_configs(sweep_id, n)
+        if len(raw_configs) == 0:
+            break
+        timer.lap('claim')
+        if arrays:
+            configs = batch_arrays(raw_configs)
+        else:
+            configs = [wandbX.hierarchical_config(config) for config in raw_configs]
+        timer.lap('decode')
+
+        run_ids = [backend.generate_run_id() for _ in raw_configs]
+        status = 'failed'
+        try:
+            with timer.phase('function'):
+                if "checkpoint_dir" in params:
+                    results = function(configs=configs, checkpoint_dir=checkpoint_dir)
+                else:
+                    results = function(configs=configs)
+            rows = result_rows(results, len(raw_configs))
+            status = 'finished'
+        except Exception:
+            # same as the agent: report the failure and go on with the next batch
+            print(traceback.format_exc())
+            rows = [{} for _ in raw_configs]
+        backend.log_runs(sweep_id, [
+            {'id': run_id, 'name': run_id, 'config': config, 'summary': row, 'state': status}
+            for run_id, config, row in zip(run_ids, raw_configs, rows)
+        ], entity=entity, project=project)
+        timer.lap('log')
+        done += len(raw_configs)
+        if record_timings is not None:
+            record_timings(timer, f"batch-{run_ids[0]}", None, status, batch=len(raw_configs))
+        if len(raw_configs) < n:
+            # the sweep has run out of configurations
+            break
+    return done
@@ -0,0 +1,162 @@
+"""
+The configuration of every run is stored in its checkpoint directory (`run_config.json`)
+and next to it once the run is finished (`<run_id>-config.json`). Most of it is the base
+configuration of the sweep, which is the same for all of the runs, so instead of the
+full configuration, these files only hold the difference with the base:
+
+```json
+{"dysweep_diff": {"base": "<sha256 of the base>", "set": [[["model", "lr"], 0.01]], "unset": []}}
+```
+
+The base itself is written once, content-addressed, into a `.dysweep-bases` directory
+next to the files that refer to it. Run directories get a hard link to it, so that they
+can be moved to the final directory or pulled from a store on another node and still be
+read on their own, without writing the base again. Files with a full configuration
+(written by older versions, or with `store_config_diffs` turned off) are read as they are.
+"""
+import typing as th
+import copy
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from .preemption import atomic_write
+from . import serialization
+
+DIFF_KEY = 'dysweep_diff'
+BASES_DIR = '.dysweep-bases'
+
+# the last base that has been serialized, by identity, since it is the same for every run
+_last_base: th.Optional[th.Tuple[th.Any, str, dict]] = None
+
+
+def _same(a, b) -> bool:
+    # True == 1 in Python, but not once they are written to the file
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def config_diff(base: dict, config: dict) -> dict:
+    """
+    The difference between two (JSON) configurations: the values to `set` and the keys to
+    `unset`, by their path of keys. Lists are replaced as a whole.
+    """
+    sets, unsets = [], []
+
+    def walk(b: dict, c: dict, path: list):
+        for key, value in c.items():
+            if key not in b:
+                sets.append([path + [key], value])
+            elif isinstance(value, dict) and isinstance(b[key], dict):
+                walk(b[key], value, path + [key])
+            elif not _same(b[key], value):
+                sets.append([path + [key], value])
+        for key in b:
+            if key not in c:
+                unsets.append(path + [key])
+
+    walk(base, config, [])
+    return {'set': sets, 'unset': unsets}
+
+
+def apply_config_diff(base: dict, diff: dict) -> dict:
+    """The configuration that `config_diff` was computed from, the base is not modified."""
+    config = copy.deepcopy(base)
+    for path in diff['unset']:
+        parent = config
+        for key in path[:-1]:
+            parent = parent[key]
+        del parent[path[-1]]
+    for path, value in diff['set']:
+        parent = config
+        for key in path[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[path[-1]] = value
+    return config
+
+
+def _serialize_base(base: dict) -> th.Tuple[str, dict]:
+    """The digest of the base and the base as it is read back from the file."""
+    global _last_base
+    if _last_base is None or _last_base[0] is not base:
+        data = serialization.dumps(base, sort_keys=True)
+        digest = hashlib.sha256(data).hexdigest()
+        _last_base = (base, digest, serialization.loads(data))
+    return _last_base[1], _last_base[2]
+
+
+def _base_path(directory: Path, digest: str) -> Path:
+    return directory / BASES_DIR / f"{digest}.json"
+
+
+def _store_base(directory: Path, digest: str, base: dict):
+    path = _base_path(directory, digest)
+    if path.exists():
+        return
+    os.makedirs(path.parent, exist_ok=True)
+    with atomic_write(path) as f:
+        f.write(serialization.dumps(base, pretty=True, sort_keys=True))
+
+
+def _link_base(source_dir: Path, target_dir: Path, digest: str):
+    """Make the base of `source_dir` available in `target_dir`, with a hard link when possible."""
+    source, target = _base_path(source_dir, digest), _base_path(target_dir, digest)
+    if target.exists() or source == target:
+        return
+    os.makedirs(target.parent, exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        # e.g. on another filesystem
+        shutil.copyfile(source, target)
+
+
+def write_run_config(path: th.Union[Path, str], config: dict, base: th.Optional[dict] = None,
+                     bases_dir: th.Optional[th.Union[Path, str]] = None):
+    """
+    Write the configuration of a run into `path`, as a difference with `base` if it is given.
+    The base is stored once in `bases_dir` (e.g. the checkpoint directory of the sweep) and
+    linked next to `path`.
+    """
+    path = Path(path)
+    if base is None:
+        serialization.dump(config, path, pretty=True, sort_keys=True)
+        return
+    digest, base_doc = _serialize_base(base)
+    bases_dir = Path(bases_dir) if bases_dir is not None else path.parent
+    _store_base(bases_dir, digest, base_doc)
+    _link_base(bases_dir, path.parent, digest)
+    # the configuration as it would be read back from a full file
+    config = serialization.loads(serialization.dumps(config))
+    serialization.dump({DIFF_KEY: {'base': digest, **config_diff(base_doc, config)}}, path,
+                       pretty=True, sort_keys=True)
+
+
+def read_run_config(path: th.Union[Path, str]) -> dict:
+    """Read the configuration of a run that has been written with `write_run_config`."""
+    path = Path(path)
+    stored = serialization.load(path)
+    if not isinstance(stored, dict) or DIFF_KEY not in stored:
+        return stored
+    diff = stored[DIFF_KEY]
+    base_path = _base_path(path.parent, diff['base'])
+    if not base_path.exists():
+        raise FileNotFoundError(
+            f"The base configuration {diff['base']} that {path} refers to is not in {base_path.parent}.")
+    return apply_config_diff(serialization.load(base_path), diff)
+
+
+def copy_run_config(source: th.Union[Path, str], target: th.Union[Path, str]):
+    """Copy the configuration file of a run, together with its base."""
+    source, target = Path(source), Path(target)
+    shutil.copyfile(source, target)
+    stored = serialization.load(source)
+    if isinstance(stored, dict) and DIFF_KEY in stored:
+        _link_base(source.parent, target.parent, stored[DIFF_KEY]['base'])
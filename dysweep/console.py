@@ -1,17 +1,28 @@
 """
 This script contains all the scripts that are accessible in the command-line for the package. Namely,
 
-1. Creating a sweep using a yaml configuration file directly.
+1. Creating a sweep using a yaml configuration file directly (or many sweeps at once
+    using a directory or a multi-document yaml file).
 
 2. Running configurations on specific machines or resuming using the command line directly.
+
+3. Running a long-lived worker that keeps the user function and its shared state in memory.
+
+4. Reporting the throughput of the sweeps under a checkpoint root.
 """
 from jsonargparse import ArgumentParser, ActionConfigFile
 from jsonargparse.actions import ActionConfigFile
 from jsonargparse.actions import Action
-from dysweep import dysweep_run_resume, ResumableSweepConfig
+from dysweep import dysweep_run_resume, dysweep_create_batch, ResumableSweepConfig
+from dysweep.worker import run_worker
+from dysweep.throughput import sweep_report, to_csv
+from dataclasses import fields
+from pathlib import Path
 import importlib
 import sys
 import functools
+import yaml
+import json
 
 class CustomAction(Action):
     def __call__(self, parser, namespace, values, option_string=None):
@@ -48,6 +59,15 @@ def create_sweep():
     
     After running the function, the sweep identifier would be displayed which can be used across 
     multiple machines to run the sweep configurations.
+    
+    To create many sweeps at once, pass a directory of configuration files, or a yaml file with
+    multiple documents separated by `---`, to `--batch`. The arguments given in the command-line
+    are used as defaults for every document, and the created sweep identifiers are written to the
+    json file given by `--manifest`:
+    
+    ```bash
+    dysweep_create --batch sweeps/ --project <my_project> --manifest sweeps.json
+    ```
     """
     
     parser = ArgumentParser()
@@ -59,11 +79,68 @@ def create_sweep():
     parser.add_argument(
         "-c", "--config", action=ActionConfigFile, help="Path to a configuration file in json or yaml format."
     )
+    parser.add_argument(
+        "--batch", type=str, default=None,
+        help="Path to a directory of configuration files or to a multi-document yaml file; "
+        "a sweep is created for every document."
+    )
+    parser.add_argument(
+        "--manifest", type=str, default="sweeps.json",
+        help="Path to the json file listing the sweeps created in batch mode."
+    )
+    parser.add_argument(
+        "--max_workers", type=int, default=None,
+        help="Number of processes used for standardizing the sweeps in batch mode."
+    )
     args = parser.parse_args()
     
     sys.path.append('.')
     
-    dysweep_run_resume(args)
+    if args.batch is None:
+        dysweep_run_resume(args)
+        return
+    
+    # the values given in the command line (or in --config) are used as defaults
+    # for every document in the batch.
+    defaults = {f.name: getattr(args, f.name) for f in fields(ResumableSweepConfig) if hasattr(args, f.name)}
+    names, confs = [], []
+    for name, document in load_batch_documents(args.batch):
+        unknown_keys = [key for key in document.keys() if key not in defaults]
+        if len(unknown_keys) > 0:
+            raise ValueError(f"Unknown keys {unknown_keys} in the batch document {name}.")
+        names.append(name)
+        confs.append(ResumableSweepConfig(**{**defaults, **document}))
+    
+    sweep_ids = dysweep_create_batch(confs, names=names, manifest_path=args.manifest,
+                                     max_workers=args.max_workers)
+    for name, sweep_id in zip(names, sweep_ids):
+        print(f"{name}: {sweep_id}")
+    print(f"Sweep identifiers written to {args.manifest}")
+
+
+def load_batch_documents(path: str):
+    """
+    Yields (name, document) pairs from either a directory containing yaml/json
+    files or from a single (possibly multi-document) yaml file. The name of a
+    document is its `sweep_name` if it has one, otherwise it is derived from
+    the file name and the position of the document in the file.
+    """
+    path = Path(path)
+    if path.is_dir():
+        files = sorted(p for p in path.iterdir() if p.suffix in ['.yaml', '.yml', '.json'])
+    else:
+        files = [path]
+    for file in files:
+        with open(file, "r") as f:
+            documents = [d for d in yaml.safe_load_all(f) if d is not None]
+        for idx, document in enumerate(documents):
+            if not isinstance(document, dict):
+                raise ValueError(f"Every document in {file} should be a dictionary.")
+            if 'sweep_name' in document:
+                name = document['sweep_name']
+            else:
+                name = file.stem if len(documents) == 1 else f"{file.stem}-{idx}"
+            yield name, document
 
 
 def parse_dict(value):
@@ -86,21 +163,7 @@ def parse_dict(value):
     else:
         raise ValueError("invalid type of parseable object:", type(value))
 
-def run_resume_sweep():
-    """
-    Using this function, you can run or resume a sweep run using the command line.
-    You have to simply define your configuration in a yaml file and use the `--config` argument to
-    load the configuration using `jsonargparse`.
-    
-    After obtaining a specific configuration and a checkpoing directory, these will be called on a
-    particular function you have implemented. If for example, you have a function `main` in a file
-    denoted by `path.to.my.package`, then you can run the following command:
-    
-    ```bash
-    dysweep_run_resume --config config.yaml --package path.to.my.package --function main
-    ```
-    
-    """
+def _build_run_parser() -> ArgumentParser:
     parser = ArgumentParser()
     parser.add_class_arguments(
         ResumableSweepConfig,
@@ -120,8 +183,14 @@ def run_resume_sweep():
     
 
     parser.add_argument('--run_additional_args', action=CustomAction, type=parse_dict, nargs='+')
+    return parser
 
-    args = parser.parse_args()
+
+def _load_function(args):
+    """
+    Imports the function given by `--package` and `--function`, binds the
+    `--run_additional_args` to it, and removes these arguments from `args`.
+    """
     run_args = {}
     if hasattr(args, 'run_additional_args') and args.run_additional_args:
         for run_arg_ in args.run_additional_args:
@@ -141,7 +210,102 @@ def run_resume_sweep():
     # Remove args.package and args.function from args
     delattr(args, "package")
     delattr(args, "function")
+    return module, func
+
+
+def run_resume_sweep():
+    """
+    Using this function, you can run or resume a sweep run using the command line.
+    You have to simply define your configuration in a yaml file and use the `--config` argument to
+    load the configuration using `jsonargparse`.
+    
+    After obtaining a specific configuration and a checkpoing directory, these will be called on a
+    particular function you have implemented. If for example, you have a function `main` in a file
+    denoted by `path.to.my.package`, then you can run the following command:
+    
+    ```bash
+    dysweep_run_resume --config config.yaml --package path.to.my.package --function main
+    ```
+    
+    """
+    parser = _build_run_parser()
+    args = parser.parse_args()
+    _, func = _load_function(args)
     
     # Run and resume using the arguments and function
     dysweep_run_resume(args, func)
-   
+
+
+def worker():
+    """
+    Starts a long-lived worker that imports the function once and keeps pulling
+    configurations from the sweep, so that the startup of Python, of the imports, and of
+    anything cached through `dysweep.shared_state` (datasets, tokenizers, ...) is paid once
+    for hundreds of short runs instead of once per run.
+    
+    ```bash
+    dysweep_worker --config config.yaml --package path.to.my.package --function main --sweep_id <sweep_id>
+    ```
+    
+    Optionally, `--setup` names a function in the same package that is called once when
+    the worker starts (e.g. to warm up the shared state), `--max_runs` bounds the number of
+    runs, and `--idle_timeout` keeps the worker polling an exhausted sweep for that many
+    seconds before exiting.
+    """
+    parser = _build_run_parser()
+    parser.add_argument(
+        "--setup", type=str, default=None,
+        help="Name of a function in the package that is called once when the worker starts."
+    )
+    parser.add_argument(
+        "--max_runs", type=int, default=None, help="The worker stops after this many runs."
+    )
+    parser.add_argument(
+        "--idle_timeout", type=float, default=None,
+        help="Seconds to keep polling the sweep for new configurations before stopping."
+    )
+    parser.add_argument(
+        "--poll_interval", type=float, default=30.0,
+        help="Seconds between two polls of an idle sweep."
+    )
+    args = parser.parse_args()
+    setup_name = args.setup
+    max_runs, idle_timeout, poll_interval = args.max_runs, args.idle_timeout, args.poll_interval
+    for name in ["setup", "max_runs", "idle_timeout", "poll_interval"]:
+        delattr(args, name)
+    module, func = _load_function(args)
+    setup = getattr(module, setup_name) if setup_name is not None else None
+    
+    ran = run_worker(args, func, setup=setup, max_runs=max_runs,
+                     idle_timeout=idle_timeout, poll_interval=poll_interval)
+    print(f"Worker finished after {ran} runs.")
+
+
+def report():
+    """
+    Aggregates the timings of the runs (the `<run_id>-timings.jsonl` files) under a
+    checkpoint root and prints the throughput of every sweep: runs per hour, the median
+    setup overhead of a run, the failure, preemption and resume rates, the compute wasted
+    on attempts that did not finish, and the idle time of the agents between runs.
+    
+    ```bash
+    dysweep_report <default_root_dir> --format csv --output report.csv
+    ```
+    
+    The lines that have been read are cached in the root, so running the report again on
+    a growing sweep only reads what is new.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("root", type=str, help="The checkpoint root (or a single checkpoint directory).")
+    parser.add_argument("--format", type=str, default="json", choices=["json", "csv"])
+    parser.add_argument("--output", type=str, default=None, help="Write the report to this file.")
+    parser.add_argument("--no_cache", action="store_true", help="Read all the timings files again.")
+    args = parser.parse_args()
+    
+    stats = sweep_report(args.root, use_cache=not args.no_cache)
+    text = json.dumps(stats, indent=4) if args.format == "json" else to_csv(stats)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
@@ -0,0 +1,244 @@
+"""
+A node-wide cache of datasets in shared memory. When many runs on the same node
+(e.g. several `dysweep_run_resume` processes, or the runs of a worker) load the same
+dataset, the first one decodes it and stores its arrays as `.npy` files on a tmpfs
+(`/dev/shm` by default); the others memory-map these files, so all the runs share a
+single, read-only copy of the data in RAM.
+
+Entries are keyed by a dataset spec that is pulled from the (upserted) configuration
+of the run, e.g. `data.dataset_class` and the arguments of the dataset:
+
+```python
+arrays = dysweep.shared_dataset(
+    config, ['data.dataset_class'],
+    lambda: {'x': train_set.data, 'y': np.array(train_set.targets)},
+)
+```
+
+Every process that attaches to an entry holds a reference to it (a file named after
+its pid), which is dropped when the process releases the entry or exits. When the
+cache grows beyond `max_bytes`, the least recently used entries that no live process
+references are evicted, together with the entries left half-built by processes that
+have died while building them.
+"""
+import typing as th
+import atexit
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+
+def default_shm_dir() -> Path:
+    if 'DYSWEEP_SHM_DIR' in os.environ:
+        return Path(os.environ['DYSWEEP_SHM_DIR'])
+    if os.path.isdir('/dev/shm'):
+        return Path('/dev/shm') / 'dysweep'
+    return Path(tempfile.gettempdir()) / 'dysweep-shm'
+
+
+def dataset_spec(config: dict, paths: th.List[str]) -> dict:
+    """
+    Pull the values at the given dot-separated `paths` (e.g. `data.dataset_class`)
+    out of a hierarchical configuration. Missing paths map to None.
+    """
+    spec = {}
+    for path in paths:
+        node = config
+        for part in path.split('.'):
+            if isinstance(node, dict) and part in node:
+                node = node[part]
+            elif isinstance(node, list) and part.isdigit() and int(part) < len(node):
+                node = node[int(part)]
+            else:
+                node = None
+                break
+        spec[path] = node
+    return spec
+
+
+def spec_key(spec: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextlib.contextmanager
+def _locked(path: Path):
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedDatasetCache:
+    """
+    The cache lives in `root`; every entry is a directory `<root>/<key>` that holds
+    one `.npy` file per array, a `meta.json` file, and a `refs` directory with one
+    file per process that currently uses the entry.
+    """
+
+    def __init__(self, root: th.Optional[th.Union[Path, str]] = None,
+                 max_bytes: th.Optional[int] = None):
+        self.root = Path(root) if root is not None else default_shm_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._attached: th.Dict[str, th.Dict[str, th.Any]] = {}
+        self.remove_stale_builds()
+        atexit.register(self.release_all)
+
+    def _entry(self, key: str) -> Path:
+        return self.root / key
+
+    def get(self, spec: dict, loader: th.Callable[[], th.Any]) -> th.Any:
+        """
+        Returns the arrays of the dataset described by `spec` as read-only memory-mapped
+        numpy arrays. `loader` is only called if no process on this node has stored the
+        dataset yet; it should return either a numpy array or a dictionary of numpy arrays
+        (the same structure is returned).
+        """
+        import numpy as np
+
+        key = spec_key(spec)
+        if key in self._attached:
+            self._touch(key)
+            return self._unwrap(self._attached[key])
+
+        entry = self._entry(key)
+        # only one process builds an entry, the others wait for it and attach
+        with _locked(self.root / f"{key}.lock"):
+            if not (entry / 'meta.json').exists():
+                data = loader()
+                arrays = data if isinstance(data, dict) else {'__array__': data}
+                tmp_entry = self.root / f".{key}.tmp-{os.getpid()}"
+                if tmp_entry.exists():
+                    shutil.rmtree(tmp_entry)
+                os.makedirs(tmp_entry / 'refs')
+                nbytes = 0
+                for name, array in arrays.items():
+                    array = np.ascontiguousarray(array)
+                    np.save(tmp_entry / f"{name}.npy", array, allow_pickle=False)
+                    nbytes += array.nbytes
+                with open(tmp_entry / 'meta.json', 'w') as f:
+                    json.dump({'spec': spec, 'arrays': list(arrays.keys()), 'nbytes': nbytes},
+                              f, default=str)
+                os.replace(tmp_entry, entry)
+            self._add_ref(key)
+
+        with open(entry / 'meta.json') as f:
+            meta = json.load(f)
+        self._attached[key] = {
+            name: np.load(entry / f"{name}.npy", mmap_mode='r', allow_pickle=False)
+            for name in meta['arrays']
+        }
+        self._touch(key)
+        self.evict()
+        return self._unwrap(self._attached[key])
+
+    @staticmethod
+    def _unwrap(arrays: dict):
+        if list(arrays.keys()) == ['__array__']:
+            return arrays['__array__']
+        return arrays
+
+    def _add_ref(self, key: str):
+        (self._entry(key) / 'refs' / str(os.getpid())).touch()
+
+    def _touch(self, key: str):
+        # the modification time of the meta file is the last access of the entry
+        meta = self._entry(key) / 'meta.json'
+        if meta.exists():
+            os.utime(meta)
+
+    def _live_refs(self, key: str) -> int:
+        refs = 0
+        refs_dir = self._entry(key) / 'refs'
+        if not refs_dir.exists():
+            return 0
+        for ref in refs_dir.iterdir():
+            if _pid_alive(int(ref.name)):
+                refs += 1
+            else:
+                # the process died without releasing the entry
+                ref.unlink(missing_ok=True)
+        return refs
+
+    def release(self, spec: dict):
+        """Drop the reference of this process to the dataset described by `spec`."""
+        key = spec_key(spec)
+        self._attached.pop(key, None)
+        (self._entry(key) / 'refs' / str(os.getpid())).unlink(missing_ok=True)
+
+    def release_all(self):
+        for key in list(self._attached.keys()):
+            self._attached.pop(key)
+            (self._entry(key) / 'refs' / str(os.getpid())).unlink(missing_ok=True)
+
+    def remove_stale_builds(self):
+        """Remove the entries that were being built by processes that have died before finishing them."""
+        for tmp_entry in self.root.glob('.*.tmp-*'):
+            key, _, pid = tmp_entry.name[1:].rpartition('.tmp-')
+            if not tmp_entry.is_dir() or not pid.isdigit() or _pid_alive(int(pid)):
+                continue
+            with _locked(self.root / f"{key}.lock"):
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def evict(self):
+        """Evict the least recently used, unreferenced entries until the cache fits in `max_bytes`."""
+        self.remove_stale_builds()
+        if self.max_bytes is None:
+            return
+        with _locked(self.root / '.evict.lock'):
+            entries = []
+            for entry in self.root.iterdir():
+                meta = entry / 'meta.json'
+                if entry.is_dir() and not entry.name.startswith('.') and meta.exists():
+                    with open(meta) as f:
+                        nbytes = json.load(f)['nbytes']
+                    entries.append((meta.stat().st_mtime, entry.name, nbytes))
+            total = sum(nbytes for _, _, nbytes in entries)
+            for _, key, nbytes in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with _locked(self.root / f"{key}.lock"):
+                    if self._live_refs(key) > 0:
+                        continue
+                    shutil.rmtree(self._entry(key), ignore_errors=True)
+                total -= nbytes
+
+
+_default_cache: th.Optional[SharedDatasetCache] = None
+
+
+def shared_dataset(
+    config: dict,
+    paths: th.List[str],
+    loader: th.Callable[[], th.Any],
+    max_bytes: th.Optional[int] = None,
+) -> th.Any:
+    """
+    Returns the arrays of the dataset that is described by the values at `paths` in
+    `config`, loading them with `loader` only if no other process on this node has
+    done so already. Check `SharedDatasetCache.get`.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SharedDatasetCache(max_bytes=max_bytes)
+    elif max_bytes is not None:
+        _default_cache.max_bytes = max_bytes
+    return _default_cache.get(dataset_spec(config, paths), loader)
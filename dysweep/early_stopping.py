@@ -0,0 +1,120 @@
+"""
+Early stopping of the runs of a sweep with asynchronous successive halving (ASHA),
+and Hyperband on top of it. The function reports its metric together with the budget
+that it has used so far (epochs, steps, samples, ...) and checks whether it should go on:
+
+```python
+for epoch in range(num_epochs):
+    ...
+    dysweep.report(metric=val_loss, budget=epoch + 1)
+    if dysweep.should_stop():
+        break
+```
+
+The budgets `min_budget * reduction_factor ** k` are the rungs. When a run reaches a
+rung, its metric is recorded in the checkpoint index, and the run only goes on if it
+is among the best `1 / reduction_factor` of all the runs that have reached that rung
+so far (with fewer than `reduction_factor` runs at a rung, every run goes on). As the
+decision only looks at the runs that have reached the rung before, no run ever waits
+for the others. A report that jumps past several rungs at once is recorded at each
+of them in turn, up to the first one where the run falls behind.
+
+With `brackets > 1` (Hyperband), every run is assigned to one of the brackets by its
+identifier, and the first rung of bracket `s` is `min_budget * reduction_factor ** s`,
+so some runs are compared early and aggressively, and others only after a while.
+
+With `pause`, the runs are paused and promoted instead of stopped. The function trains
+up to `dysweep.budget()`, saves its state in its checkpoint directory and returns:
+
+```python
+state = load_state(checkpoint_dir)      # None for a new run
+for epoch in range(state.epoch if state else 0, int(dysweep.budget())):
+    ...
+    dysweep.report(metric=val_loss)
+save_state(checkpoint_dir)
+```
+
+If the run is among the best at its rung, it is promoted right away: the function is
+called again with the budget of the next rung, in the same process, directory and run.
+Otherwise the run is paused; it stays in the checkpoint directory, marked as paused at
+its rung in the index, and is promoted (by whichever agent first notices) as soon as
+enough runs have reached the rung behind it.
+"""
+import typing as th
+import zlib
+from dataclasses import dataclass
+from .index import CheckpointIndex
+
+
+@dataclass
+class EarlyStoppingPolicy:
+    # the budget of the first rung
+    min_budget: float = 1.0
+    # no decisions are made at or after this budget, e.g. the total number of epochs
+    max_budget: th.Optional[float] = None
+    # only the best 1 / reduction_factor of the runs at a rung go on
+    reduction_factor: float = 3.0
+    # the number of Hyperband brackets; 1 is plain ASHA
+    brackets: int = 1
+    goal: th.Optional[str] = None
+    # pause the runs at their rung and promote them later, instead of stopping them
+    pause: bool = False
+
+
+def bracket_of(run_id: str, policy: EarlyStoppingPolicy) -> int:
+    """The bracket of a run, the same for every attempt of the run."""
+    return zlib.crc32(run_id.encode('utf-8')) % max(1, policy.brackets)
+
+
+def rung_of(budget: float, policy: EarlyStoppingPolicy, bracket: int) -> th.Optional[int]:
+    """The highest rung that `budget` has reached in the bracket, None if it has not reached any."""
+    rung, rung_budget = None, policy.min_budget * policy.reduction_factor ** bracket
+    while rung_budget <= budget and (policy.max_budget is None or rung_budget < policy.max_budget):
+        rung = 0 if rung is None else rung + 1
+        rung_budget *= policy.reduction_factor
+    return rung
+
+
+def rung_budget(policy: EarlyStoppingPolicy, bracket: int, rung: int) -> float:
+    """The budget of a rung of the bracket, the last rung being `max_budget`."""
+    budget = policy.min_budget * policy.reduction_factor ** (bracket + rung)
+    return budget if policy.max_budget is None else min(budget, policy.max_budget)
+
+
+def is_last_rung(policy: EarlyStoppingPolicy, bracket: int, rung: int) -> bool:
+    return policy.max_budget is not None and rung_budget(policy, bracket, rung) >= policy.max_budget
+
+
+def in_top(metric: float, metrics: th.List[float], policy: EarlyStoppingPolicy) -> bool:
+    """Whether `metric` is among the best 1 / reduction_factor of `metrics` (which include it)."""
+    top = int(len(metrics) / policy.reduction_factor)
+    if top == 0:
+        return False
+    metrics = sorted(metrics, reverse=policy.goal == 'maximize')
+    cutoff = metrics[top - 1]
+    return metric >= cutoff if policy.goal == 'maximize' else metric <= cutoff
+
+
+def should_continue(index: CheckpointIndex, policy: EarlyStoppingPolicy, run_id: str,
+                    bracket: int, rung: int, metric: float) -> bool:
+    """Record the metric of the run at the rung, and decide whether the run goes on."""
+    metrics = index.record_rung(run_id, bracket, rung, metric)
+    if int(len(metrics) / policy.reduction_factor) == 0:
+        # not enough runs have reached this rung to tell
+        return True
+    return in_top(metric, metrics, policy)
+
+
+def next_promotion(index: CheckpointIndex, policy: EarlyStoppingPolicy) -> th.Optional[dict]:
+    """
+    Claim a paused run that is now among the best at its rung, the ones at the highest
+    rungs first, and return it (with its `id`, `path` and the `rung` that it is promoted
+    to); None if there is none.
+    """
+    for run in index.paused_runs():
+        metrics = index.rung_metrics(bracket_of(run['id'], policy), run['rung'])
+        if run['id'] in metrics and in_top(metrics[run['id']], list(metrics.values()), policy):
+            rung = index.claim_promotion(run['id'])
+            if rung is not None:
+                return {**run, 'rung': rung}
+    return None
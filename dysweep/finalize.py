@@ -0,0 +1,265 @@
+"""
+Finalization of the checkpoint directory of a run once the run is over. The run
+directory is either moved to its final location or deleted. Whenever this is not a
+simple rename (e.g. the final directory is on another filesystem, or the directory
+has to be deleted), the run directory is first renamed to a staging name, which is
+instant, and the copy or deletion is done by a background worker so that the agent
+can start the next configuration right away.
+
+Every background operation is recorded in a journal (`.finalize-journal.jsonl`
+in the checkpoint directory) before it starts and after it is done, so that an
+operation that was interrupted by a crash is finished the next time a `Finalizer`
+is created on the same checkpoint directory.
+"""
+import typing as th
+import concurrent.futures
+import errno
+import fcntl
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import weakref
+from pathlib import Path
+from .index import tree_size
+
+JOURNAL_NAME = ".finalize-journal.jsonl"
+STAGING_PREFIX = ".finalizing-"
+
+# the finalizers of this process; their background threads do not survive a fork
+_instances: "weakref.WeakSet[Finalizer]" = weakref.WeakSet()
+
+# the ioctl that creates a reflink (copy-on-write clone) of a file on Linux
+FICLONE = 0x40049409
+
+
+def _clone_file(src: str, dst: str):
+    """
+    Copy a file using the cheapest mechanism that the filesystems support: a hard
+    link on the same filesystem, a reflink (copy-on-write) where supported, an
+    in-kernel copy_file_range, and a plain copy otherwise.
+    """
+    if os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            pass
+        if hasattr(os, 'copy_file_range'):
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                if copied == size:
+                    shutil.copystat(src, dst)
+                    return
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 16 * 1024 * 1024)
+    shutil.copystat(src, dst)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Finalizer:
+    """
+    Moves or deletes finished run directories of `checkpoint_dir` in the background.
+
+    Args:
+        checkpoint_dir:
+            The checkpoint directory of the sweep, where the journal is kept.
+        max_workers:
+            The number of background threads doing the copies and deletions.
+    """
+
+    def __init__(self, checkpoint_dir: th.Union[Path, str], max_workers: int = 1):
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.journal = self.checkpoint_dir / JOURNAL_NAME
+        self.max_workers = max_workers
+        self._reset()
+        _instances.add(self)
+        self.recover()
+
+    def _reset(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="dysweep-finalize")
+        self._futures: th.List[concurrent.futures.Future] = []
+        # the background moves of this process, by destination
+        self._moves: th.Dict[str, concurrent.futures.Future] = {}
+        self._progress: th.Dict[str, th.List[int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _write(f, entry: dict):
+        f.write(json.dumps({**entry, 'time': time.time()}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _log(self, entry: dict):
+        with open(self.journal, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._write(f, entry)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def recover(self):
+        """
+        Finish the operations that were interrupted, i.e. the ones that were started
+        by a process on this host that is not alive anymore.
+        """
+        if not self.journal.exists():
+            return
+        to_resume = []
+        with open(self.journal, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                started = {}
+                line = ''
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a line that was cut by a crash
+                        continue
+                    if entry['state'] == 'started':
+                        started[entry['staging']] = entry
+                    else:
+                        started.pop(entry['staging'], None)
+                if line and not line.endswith('\n'):
+                    # terminate the line that was cut, so that new entries stay readable
+                    f.write('\n')
+                for entry in started.values():
+                    if entry['host'] != socket.gethostname() or _pid_alive(entry['pid']):
+                        # the operation is still in progress in another agent
+                        continue
+                    entry = {**entry, 'pid': os.getpid()}
+                    if not os.path.exists(entry['staging']):
+                        self._write(f, {**entry, 'state': 'done'})
+                        continue
+                    # the staging directory is still there, so the operation has not been
+                    # completed; this process takes it over
+                    self._write(f, {**entry, 'state': 'started'})
+                    to_resume.append(entry)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        for entry in to_resume:
+            self._submit(entry, log_start=False)
+
+    def finalize(self, run_dir: th.Union[Path, str], destination: th.Optional[th.Union[Path, str]] = None):
+        """
+        Move `run_dir` to `destination`, or delete it if `destination` is None. Returns
+        as soon as `run_dir` is gone from its original location.
+        """
+        run_dir = Path(run_dir)
+        with self._lock:
+            move = self._moves.get(str(run_dir))
+        if move is not None:
+            # the directory is itself still being moved in the background
+            move.result()
+        if destination is not None:
+            destination = Path(destination)
+            try:
+                # the common case: a rename on the same filesystem is instant
+                os.rename(run_dir, destination)
+                return
+            except OSError as e:
+                if e.errno not in [errno.EXDEV, errno.ENOTEMPTY, errno.EEXIST]:
+                    raise e
+        # the staging name does not look like a run directory, so that it is
+        # never picked up for resuming
+        staging = run_dir.parent / f"{STAGING_PREFIX}{os.getpid()}-{time.time_ns()}"
+        entry = {
+            'op': 'delete' if destination is None else 'move',
+            'staging': str(staging),
+            'destination': None if destination is None else str(destination),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+        }
+        # journal first: if we crash right after, the recovery finds no staging
+        # directory and the run directory is simply left where it was.
+        self._log({**entry, 'state': 'started'})
+        os.rename(run_dir, staging)
+        self._submit(entry, log_start=False)
+
+    def _submit(self, entry: dict, log_start: bool = True):
+        if log_start:
+            self._log({**entry, 'state': 'started'})
+        future = self._executor.submit(self._run, entry)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+            self._moves = {k: f for k, f in self._moves.items() if not f.done()}
+            if entry['op'] == 'move':
+                self._moves[entry['destination']] = future
+
+    def _run(self, entry: dict):
+        staging = Path(entry['staging'])
+        if entry['op'] == 'move':
+            destination = Path(entry['destination'])
+            progress = [0, tree_size(staging)]
+            with self._lock:
+                self._progress[str(destination)] = progress
+            for root, _, files in os.walk(staging):
+                target_root = destination / os.path.relpath(root, staging)
+                os.makedirs(target_root, exist_ok=True)
+                for name in files:
+                    src, dst = os.path.join(root, name), os.path.join(target_root, name)
+                    if os.path.lexists(dst):
+                        # left over from an interrupted copy
+                        os.remove(dst)
+                    if os.path.islink(src):
+                        os.symlink(os.readlink(src), dst)
+                    else:
+                        _clone_file(src, dst)
+                    progress[0] += os.lstat(src).st_size
+            with self._lock:
+                self._progress.pop(str(destination), None)
+        shutil.rmtree(staging)
+        self._log({**entry, 'state': 'done'})
+
+    def progress(self) -> th.Dict[str, th.Tuple[int, int]]:
+        """The (copied bytes, total bytes) of every move that is in progress, by destination."""
+        with self._lock:
+            return {k: (v[0], v[1]) for k, v in self._progress.items()}
+
+    def wait(self):
+        """Wait for all the background operations to finish, and raise the first error if any."""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.result()
+
+
+def _reset_after_fork():
+    # the operations in progress belong to the parent, the child starts with new workers
+    for finalizer in list(_instances):
+        finalizer._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,159 @@
+"""
+Isolation of every run in its own process. Forking the agent itself for every run
+(`post_run_cleanup: subprocess`) carries over whatever the agent has accumulated,
+and starting a fresh interpreter pays for all the imports again. Instead, a template
+process is forked from the agent once, before any run, and imports the heavy modules
+(`forkserver_preload`, e.g. torch); every run is then forked from that template,
+runs in a clean copy of it, and sends its result back over a pipe. A run that leaks
+memory, fragments the allocators or segfaults only takes its own process down.
+
+The targets are registered by name before the template is started, so closures work
+as targets and nothing but their (picklable) arguments and results crosses a pipe.
+"""
+import typing as th
+import importlib
+import os
+import pickle
+import signal
+import sys
+import traceback
+import warnings
+from multiprocessing.connection import Connection, Pipe
+
+
+def _exit_code(status: int) -> int:
+    """The exit code of a waited process, minus the signal number if it was killed by one."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _run_child(target: th.Callable, args: tuple, writer: Connection) -> int:
+    code, result = 1, None
+    try:
+        result = target(*args)
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        print(traceback.format_exc(), file=sys.stderr)
+    try:
+        writer.send(result)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        warnings.warn("The result of the run can not be pickled, None is returned instead.")
+        writer.send(None)
+    # os._exit does not flush
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
+
+
+class ForkServer:
+    """
+    A template process that forks a fresh process for every call of `run`. The template
+    is forked from the current process by `start`, so it should be started before the
+    process does anything that does not survive a fork (e.g. initializing CUDA).
+
+    Args:
+        targets:
+            The functions that can be run, by name.
+        preload:
+            Modules that the template imports once, so that the runs do not import them.
+    """
+
+    def __init__(self, targets: th.Dict[str, th.Callable], preload: th.Optional[th.List[str]] = None):
+        self.targets = targets
+        self.preload = list(preload or [])
+        self._conn: th.Optional[Connection] = None
+        self._pid: th.Optional[int] = None
+        self._busy = False
+
+    def start(self):
+        conn, template_conn = Pipe()
+        # flush before forking, otherwise the buffered output is printed twice
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            code = 1
+            try:
+                self._serve(template_conn)
+                code = 0
+            except BaseException:
+                print(traceback.format_exc(), file=sys.stderr)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        template_conn.close()
+        self._conn, self._pid = conn, pid
+
+    def _serve(self, conn: Connection):
+        for name in self.preload:
+            importlib.import_module(name)
+        # the handler of the runs (e.g. the preemption handler), the template itself
+        # only passes the signal on to the run in progress
+        run_handler = signal.getsignal(signal.SIGTERM)
+        child = None
+
+        def forward(signum, frame):
+            if child is not None:
+                os.kill(child, signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, forward)
+        while True:
+            try:
+                name, args = conn.recv()
+            except EOFError:
+                # the agent is gone
+                return
+            reader, writer = Pipe(duplex=False)
+            child = os.fork()
+            if child == 0:
+                reader.close()
+                conn.close()
+                signal.signal(signal.SIGTERM, run_handler)
+                os._exit(_run_child(self.targets[name], args, writer))
+            writer.close()
+            try:
+                result = reader.recv()
+            except EOFError:
+                # the run died without reporting, e.g. by a segfault
+                result = None
+            reader.close()
+            _, status = os.waitpid(child, 0)
+            child = None
+            try:
+                conn.send((_exit_code(status), result))
+            except OSError:
+                # the agent has left in the middle of the run
+                return
+
+    def run(self, name: str, *args) -> th.Tuple[int, th.Any]:
+        """
+        Run the target `name` with `args` in a new process forked from the template, and
+        wait for it. Returns the exit code of the process (negative if it was killed by a
+        signal) and the return value of the target (None if it has failed).
+        """
+        if self._conn is None:
+            raise RuntimeError("The fork server has not been started.")
+        self._busy = True
+        self._conn.send((name, args))
+        ret = self._conn.recv()
+        self._busy = False
+        return ret
+
+    def close(self):
+        """Stop the template, and the run in progress if the agent is leaving in the middle of it."""
+        if self._conn is None:
+            return
+        if self._busy:
+            # e.g. the agent has been preempted while waiting for the run
+            try:
+                os.kill(self._pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self._conn.close()
+        os.waitpid(self._pid, 0)
+        self._conn, self._pid = None, None
@@ -0,0 +1,83 @@
+"""
+Random access into the grid of a grid sweep. The grid is the product of the values
+of the (compressed) parameters, with the keys in sorted order and the last key
+varying the fastest, i.e. the order in which a grid sweep hands the configurations
+out. Configuration #i is the mixed-radix representation of i, whose digits are the
+positions of the values of every parameter; the inverse maps a configuration back to
+its index. Both take O(#parameters) time and memory, so a grid of a billion points
+never has to be enumerated, e.g. for splitting it into ranges of indices:
+
+```python
+grid = GridIndex(sweep_standard['parameters'])
+for i in range(start, stop):
+    config = grid.config(i)
+```
+"""
+import typing as th
+import json
+import math
+
+
+def _value_key(value) -> str:
+    # values can be lists or dictionaries, which are not hashable
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class GridIndex:
+    """
+    The grid over `parameters`, the parameters of a standardized sweep configuration
+    where every parameter either has `values` or a single `value`.
+    """
+
+    def __init__(self, parameters: dict):
+        self.names: th.List[str] = sorted(parameters.keys())
+        self.values: th.List[list] = []
+        for name in self.names:
+            spec = parameters[name]
+            if 'values' in spec:
+                self.values.append(list(spec['values']))
+            elif 'value' in spec:
+                self.values.append([spec['value']])
+            else:
+                raise ValueError(
+                    f"Parameter {name} should either have `value` or `values` to be used in a grid sweep.")
+        self.radices = [len(values) for values in self.values]
+        self.size = math.prod(self.radices)
+        # the positions of the values, for the inverse
+        self._positions: th.Optional[th.List[th.Dict[str, int]]] = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def config(self, i: int) -> dict:
+        """The configuration with index `i` (negative indices count from the end)."""
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(f"The grid has {self.size} configurations, {i} is out of range.")
+        config = {}
+        for name, values, radix in zip(reversed(self.names), reversed(self.values), reversed(self.radices)):
+            i, digit = divmod(i, radix)
+            config[name] = values[digit]
+        return {name: config[name] for name in self.names}
+
+    def configs(self, start: int = 0, stop: th.Optional[int] = None) -> th.Iterator[dict]:
+        """The configurations with indices in [start, stop)."""
+        stop = self.size if stop is None else min(stop, self.size)
+        for i in range(start, stop):
+            yield self.config(i)
+
+    def index(self, config: dict) -> int:
+        """The index of `config` in the grid, the inverse of `config`."""
+        if self._positions is None:
+            self._positions = [{_value_key(v): position for position, v in reversed(list(enumerate(values)))}
+                               for values in self.values]
+        i = 0
+        for name, positions, radix in zip(self.names, self._positions, self.radices):
+            if name not in config:
+                raise KeyError(f"The configuration has no value for the parameter {name}.")
+            position = positions.get(_value_key(config[name]))
+            if position is None:
+                raise ValueError(f"{config[name]} is not one of the values of the parameter {name}.")
+            i = i * radix + position
+        return i
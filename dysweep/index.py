@@ -0,0 +1,315 @@
+"""
+An index of the runs of a checkpoint directory, kept in a SQLite database
+(`.dysweep-index.sqlite`) next to the run directories. Agents record every run
+that they start and finish, so that policies such as retention can look at the
+runs of a sweep without walking the (possibly huge) checkpoint directory every time.
+
+The index is shared by all the agents that use the same checkpoint directory; a
+new connection is opened for every operation (the same way as the local backend),
+so that it can be used from threads and forked processes.
+"""
+import typing as th
+import contextlib
+import os
+import re
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+INDEX_NAME = ".dysweep-index.sqlite"
+
+# the columns that have been added to the runs table after its first version, with their types
+_ADDED_COLUMNS = {
+    'host': 'TEXT', 'pid': 'INTEGER', 'retries': 'INTEGER DEFAULT 0',
+    'progress': 'REAL', 'last_failure': 'REAL', 'rung': 'INTEGER',
+}
+
+# the names of the checkpoint directories and config files of finished runs
+_FINAL_DIR = re.compile(r"^(?P<name>.*)_(?P<id>[^_]+)_final$")
+_CONFIG_FILE = re.compile(r"^(?P<id>.+)-config\.json$")
+
+
+def tree_size(path: th.Union[Path, str]) -> int:
+    """The total size in bytes of the files under `path`."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class CheckpointIndex:
+    """
+    The runs of the checkpoint directory `checkpoint_dir`, with their state
+    ('running', 'preempted', 'failed', 'finished' or 'deleted'), the location and size
+    of their checkpoints, when they started and finished, and their metric. For runs
+    that have not finished, the index also keeps the agent that runs them (host and
+    pid), how many times they have failed, and the last progress that they reported.
+    """
+
+    def __init__(self, checkpoint_dir: th.Union[Path, str]):
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.db_path = self.checkpoint_dir / INDEX_NAME
+        # an index that did not exist before has to be filled in from the
+        # directories that are already there (check `rebuild`)
+        self.created = not self.db_path.exists()
+        with self.connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    id TEXT PRIMARY KEY, name TEXT, path TEXT, state TEXT,
+                    bytes INTEGER DEFAULT 0, started REAL, finished REAL, metric REAL
+                );
+                CREATE INDEX IF NOT EXISTS runs_state ON runs (state, finished);
+                CREATE TABLE IF NOT EXISTS shards (
+                    shard INTEGER, num_shards INTEGER, position INTEGER DEFAULT 0,
+                    finished INTEGER DEFAULT 0, PRIMARY KEY (shard, num_shards)
+                );
+                CREATE TABLE IF NOT EXISTS rungs (
+                    run_id TEXT, bracket INTEGER, rung INTEGER, metric REAL, time REAL,
+                    PRIMARY KEY (run_id, bracket, rung)
+                );
+                CREATE INDEX IF NOT EXISTS rungs_rung ON rungs (bracket, rung);
+            """)
+            columns = [row[1] for row in db.execute("PRAGMA table_info(runs)")]
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in columns:
+                    try:
+                        db.execute(f"ALTER TABLE runs ADD COLUMN {column} {column_type}")
+                    except sqlite3.OperationalError:
+                        # another agent has just added it
+                        pass
+
+    @contextlib.contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def run_started(self, run_id: str, name: th.Optional[str], path: th.Union[Path, str]):
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO runs (id, name, path, state, started, host, pid) "
+                "VALUES (?, ?, ?, 'running', ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET name = excluded.name, path = excluded.path, "
+                "state = 'running', started = excluded.started, host = excluded.host, pid = excluded.pid",
+                (run_id, name, str(path), time.time(), socket.gethostname(), os.getpid()))
+
+    def run_failed(self, run_id: str):
+        """Record that the function of the run has raised an exception."""
+        with self.connect() as db:
+            db.execute(
+                "UPDATE runs SET state = 'failed', retries = COALESCE(retries, 0) + 1, last_failure = ? "
+                "WHERE id = ?", (time.time(), run_id))
+
+    def run_reported(self, run_id: str, metric: th.Optional[float] = None,
+                     progress: th.Optional[float] = None):
+        """Record the last metric and progress (a fraction in [0, 1]) that the run has reported."""
+        with self.connect() as db:
+            db.execute(
+                "UPDATE runs SET metric = COALESCE(?, metric), progress = COALESCE(?, progress) WHERE id = ?",
+                (metric, progress, run_id))
+
+    def unfinished_runs(self, run_ids: th.List[str]) -> th.Dict[str, dict]:
+        """The rows of the given runs that are in the index, by identifier."""
+        keys = ['id', 'name', 'path', 'state', 'started', 'metric', 'host', 'pid',
+                'retries', 'progress', 'last_failure', 'rung']
+        runs = {}
+        with self.connect() as db:
+            # query in batches to stay under the limit of SQLite on the number of parameters
+            for i in range(0, len(run_ids), 500):
+                batch = run_ids[i:i + 500]
+                rows = db.execute(
+                    f"SELECT {', '.join(keys)} FROM runs WHERE id IN ({', '.join('?' * len(batch))})",
+                    batch).fetchall()
+                for row in rows:
+                    runs[row[0]] = dict(zip(keys, row))
+        return runs
+
+    def claim_resume(self, run_id: str, started: th.Optional[float], path: th.Union[Path, str]) -> bool:
+        """
+        Atomically take over the run for resuming it, as long as nobody else has taken
+        it over since its row was read (i.e. its `started` time is still `started`).
+        """
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT started FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if row is not None and row[0] != started:
+                db.execute("ROLLBACK")
+                return False
+            db.execute(
+                "INSERT INTO runs (id, path, state, started, host, pid) VALUES (?, ?, 'running', ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET path = excluded.path, state = 'running', "
+                "started = excluded.started, host = excluded.host, pid = excluded.pid",
+                (run_id, str(path), time.time(), socket.gethostname(), os.getpid()))
+            db.execute("COMMIT")
+        return True
+
+    def run_preempted(self, run_id: str):
+        """Record that the run has been stopped by a preemption, so it should be resumed."""
+        with self.connect() as db:
+            db.execute("UPDATE runs SET state = 'preempted' WHERE id = ?", (run_id,))
+
+    def run_finished(self, run_id: str, name: th.Optional[str], path: th.Optional[th.Union[Path, str]],
+                     nbytes: int = 0, metric: th.Optional[float] = None):
+        """Record a finished run whose checkpoints are at `path` (None if they have been deleted)."""
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO runs (id, name, path, state, bytes, finished, metric) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET name = excluded.name, path = excluded.path, "
+                "state = excluded.state, bytes = excluded.bytes, finished = excluded.finished, "
+                "metric = COALESCE(excluded.metric, runs.metric)",
+                (run_id, name, None if path is None else str(path),
+                 'finished' if path is not None else 'deleted', nbytes, time.time(), metric))
+
+    def finished_runs(self) -> th.List[dict]:
+        """The finished runs whose checkpoints are still around, oldest first."""
+        with self.connect() as db:
+            rows = db.execute(
+                "SELECT id, name, path, bytes, finished, metric FROM runs "
+                "WHERE state = 'finished' ORDER BY finished, id").fetchall()
+        return [dict(zip(['id', 'name', 'path', 'bytes', 'finished', 'metric'], row)) for row in rows]
+
+    def claim_deletion(self, run_ids: th.List[str]) -> th.List[dict]:
+        """
+        Mark the given finished runs as deleted and return the ones that this call
+        has marked, so that concurrent agents never delete the same run twice.
+        """
+        claimed = []
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for run_id in run_ids:
+                row = db.execute(
+                    "SELECT id, name, path, bytes FROM runs WHERE id = ? AND state = 'finished'",
+                    (run_id,)).fetchone()
+                if row is None:
+                    continue
+                db.execute("UPDATE runs SET state = 'deleted', bytes = 0 WHERE id = ?", (run_id,))
+                claimed.append(dict(zip(['id', 'name', 'path', 'bytes'], row)))
+            db.execute("COMMIT")
+        return claimed
+
+    def claim_shard_position(self, shard: int, num_shards: int, size: th.Optional[int] = None) -> th.Optional[int]:
+        """
+        Atomically take the next position of the shard (check `sharding`) and return it,
+        or None if all the `size` positions of the shard have been taken.
+        """
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR IGNORE INTO shards (shard, num_shards) VALUES (?, ?)", (shard, num_shards))
+            position = db.execute("SELECT position FROM shards WHERE shard = ? AND num_shards = ?",
+                                  (shard, num_shards)).fetchone()[0]
+            if size is not None and position >= size:
+                db.execute("ROLLBACK")
+                return None
+            db.execute("UPDATE shards SET position = position + 1 WHERE shard = ? AND num_shards = ?",
+                       (shard, num_shards))
+            db.execute("COMMIT")
+        return position
+
+    def shard_run_finished(self, shard: int, num_shards: int):
+        with self.connect() as db:
+            db.execute("UPDATE shards SET finished = finished + 1 WHERE shard = ? AND num_shards = ?",
+                       (shard, num_shards))
+
+    def shard_progress(self, num_shards: int) -> th.Dict[int, th.Tuple[int, int]]:
+        """The (claimed positions, finished runs) of every shard that has started, by shard index."""
+        with self.connect() as db:
+            rows = db.execute("SELECT shard, position, finished FROM shards WHERE num_shards = ?",
+                              (num_shards,)).fetchall()
+        return {shard: (position, finished) for shard, position, finished in rows}
+
+    def record_rung(self, run_id: str, bracket: int, rung: int, metric: float) -> th.List[float]:
+        """
+        Record the metric of the run at a rung of the early stopping (check `early_stopping`),
+        unless an earlier attempt of the run has already reached it, and return the metrics
+        of all the runs at that rung.
+        """
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR IGNORE INTO rungs (run_id, bracket, rung, metric, time) VALUES (?, ?, ?, ?, ?)",
+                       (run_id, bracket, rung, metric, time.time()))
+            rows = db.execute("SELECT metric FROM rungs WHERE bracket = ? AND rung = ?", (bracket, rung)).fetchall()
+            db.execute("COMMIT")
+        return [row[0] for row in rows]
+
+    def rung_metrics(self, bracket: int, rung: int) -> th.Dict[str, float]:
+        """The metrics of all the runs at a rung, by run."""
+        with self.connect() as db:
+            rows = db.execute("SELECT run_id, metric FROM rungs WHERE bracket = ? AND rung = ?",
+                              (bracket, rung)).fetchall()
+        return dict(rows)
+
+    def run_paused(self, run_id: str, rung: int):
+        """Record that the run has been paused at a rung, to be promoted to the next one later."""
+        with self.connect() as db:
+            db.execute("UPDATE runs SET state = 'paused', rung = ? WHERE id = ?", (rung, run_id))
+
+    def run_promoted(self, run_id: str, rung: int):
+        """Record the rung that a running run has been promoted to, which it goes on from if it fails."""
+        with self.connect() as db:
+            db.execute("UPDATE runs SET rung = ? WHERE id = ?", (rung, run_id))
+
+    def run_rung(self, run_id: str) -> th.Optional[int]:
+        """The rung that the run is at (or has been promoted to), None if it has not reached any."""
+        with self.connect() as db:
+            row = db.execute("SELECT rung FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def paused_runs(self) -> th.List[dict]:
+        """The paused runs, the ones at the highest rungs first."""
+        with self.connect() as db:
+            rows = db.execute("SELECT id, path, rung FROM runs WHERE state = 'paused' "
+                              "ORDER BY rung DESC, started").fetchall()
+        return [dict(zip(['id', 'path', 'rung'], row)) for row in rows]
+
+    def claim_promotion(self, run_id: str) -> th.Optional[int]:
+        """
+        Atomically take over a paused run for promoting it to its next rung, and return that
+        rung; None if another agent was faster.
+        """
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            cursor = db.execute(
+                "UPDATE runs SET state = 'running', rung = rung + 1, started = ?, host = ?, pid = ? "
+                "WHERE id = ? AND state = 'paused'",
+                (time.time(), socket.gethostname(), os.getpid(), run_id))
+            rung = None
+            if cursor.rowcount == 1:
+                rung = db.execute("SELECT rung FROM runs WHERE id = ?", (run_id,)).fetchone()[0]
+            db.execute("COMMIT")
+        return rung
+
+    def rebuild(self, final_dirs: th.List[th.Union[Path, str]]):
+        """
+        Fill in the index from the directories of the runs that have finished before the
+        index existed. This walks the directories once; afterwards the index is kept up
+        to date by the agents.
+        """
+        finished = {}
+        for config_file in self.checkpoint_dir.iterdir():
+            match = _CONFIG_FILE.match(config_file.name)
+            if match is not None and config_file.is_file():
+                finished[match.group('id')] = config_file.stat().st_mtime
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for final_dir in dict.fromkeys(Path(d) for d in final_dirs):
+                if not final_dir.is_dir():
+                    continue
+                for run_dir in final_dir.iterdir():
+                    match = _FINAL_DIR.match(run_dir.name)
+                    if match is None or not run_dir.is_dir():
+                        continue
+                    run_id = match.group('id')
+                    db.execute(
+                        "INSERT OR IGNORE INTO runs (id, name, path, state, bytes, finished) "
+                        "VALUES (?, ?, ?, 'finished', ?, ?)",
+                        (run_id, match.group('name'), str(run_dir), tree_size(run_dir),
+                         finished.get(run_id, run_dir.stat().st_mtime)))
+            db.execute("COMMIT")
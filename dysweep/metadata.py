@@ -0,0 +1,169 @@
+"""
+The metadata of a hierarchical sweep (the base configuration and the compression
+maps) is needed by every single agent. Instead of storing it in the config of the
+metadata run, it is serialized once into a compact, versioned file that is attached
+to the metadata run as an artifact. Every node keeps a content-addressed cache of
+these files, so that an agent only downloads the metadata of a sweep once per node.
+
+The file layout is:
+
+    MAGIC (7 bytes) | format version (1 byte) | codec (1 byte) | payload
+
+where the codec is json + zlib by default. Setting `DYSWEEP_METADATA_CODEC=msgpack-zstd`
+on the node that creates the sweep gives smaller files, but then every agent of the sweep
+needs zstandard and msgspec (or msgpack) to read them: `pip install dysweep[compact]`.
+"""
+import typing as th
+import hashlib
+import mmap
+import os
+import tempfile
+import zlib
+from pathlib import Path
+from . import serialization
+
+MAGIC = b"DYSWEEP"
+FORMAT_VERSION = 1
+METADATA_FILE_NAME = "dysweep-metadata.bin"
+METADATA_ARTIFACT_TYPE = "dysweep-metadata"
+
+CODEC_JSON_ZLIB = 0
+CODEC_MSGPACK_ZSTD = 1
+CODECS = {'json-zlib': CODEC_JSON_ZLIB, 'msgpack-zstd': CODEC_MSGPACK_ZSTD}
+
+_HEADER_SIZE = len(MAGIC) + 2
+
+
+def _msgpack_zstd():
+    """Returns the zstandard module if it is installed together with a MessagePack library, otherwise None."""
+    if not serialization.has_msgpack():
+        return None
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def default_codec() -> int:
+    """The codec that is asked for with `DYSWEEP_METADATA_CODEC`, json + zlib otherwise."""
+    name = os.environ.get('DYSWEEP_METADATA_CODEC', 'json-zlib')
+    if name not in CODECS:
+        raise ValueError(f"Unknown DYSWEEP_METADATA_CODEC {name}, it should be one of {list(CODECS)}.")
+    return CODECS[name]
+
+
+def encode_metadata(metadata: dict, codec: th.Optional[int] = None) -> bytes:
+    """Serialize the metadata dictionary into the versioned binary format."""
+    if codec is None:
+        codec = default_codec()
+
+    if codec == CODEC_MSGPACK_ZSTD:
+        zstandard = _msgpack_zstd()
+        if zstandard is None:
+            raise ImportError("msgpack (or msgspec) and zstandard should be installed for this codec: "
+                              "pip install dysweep[compact]")
+        payload = zstandard.ZstdCompressor(level=10).compress(serialization.packb(metadata))
+    elif codec == CODEC_JSON_ZLIB:
+        payload = zlib.compress(serialization.dumps(metadata), 9)
+    else:
+        raise ValueError(f"Unknown metadata codec: {codec}")
+
+    return MAGIC + bytes([FORMAT_VERSION, codec]) + payload
+
+
+def decode_metadata(data: th.Union[bytes, memoryview, mmap.mmap]) -> dict:
+    """Deserialize the metadata from the bytes produced by `encode_metadata`."""
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError("The given data is not a dysweep metadata file.")
+    version = data[len(MAGIC)]
+    codec = data[len(MAGIC) + 1]
+    if version > FORMAT_VERSION:
+        raise ValueError(
+            f"The metadata file has format version {version} but this version of dysweep "
+            f"only supports up to {FORMAT_VERSION}; upgrade dysweep.")
+    payload = memoryview(data)[_HEADER_SIZE:]
+
+    if codec == CODEC_MSGPACK_ZSTD:
+        zstandard = _msgpack_zstd()
+        if zstandard is None:
+            raise ImportError(
+                "The sweep metadata is compressed with msgpack + zstd; "
+                "install msgpack (or msgspec) and zstandard to read it: pip install dysweep[compact]")
+        return serialization.unpackb(zstandard.ZstdDecompressor().decompressobj().decompress(payload))
+    elif codec == CODEC_JSON_ZLIB:
+        return serialization.loads(zlib.decompress(payload))
+    else:
+        raise ValueError(f"Unknown metadata codec: {codec}")
+
+
+def metadata_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def default_cache_dir() -> Path:
+    if 'DYSWEEP_CACHE_DIR' in os.environ:
+        return Path(os.environ['DYSWEEP_CACHE_DIR'])
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'dysweep'
+
+
+def _atomic_write_bytes(path: Path, data: bytes):
+    # write into a temporary file in the same directory and rename it, so that
+    # concurrent agents on the same node never see a half-written file.
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class MetadataCache:
+    """
+    A node-local, content-addressed cache of metadata files.
+
+    The blobs are stored under `<root>/metadata/<digest>` and a small pointer file
+    under `<root>/sweeps/` maps each sweep to the digest of its metadata, so that
+    agents on a node that has already seen a sweep do not need to query the server.
+    """
+
+    def __init__(self, root: th.Optional[th.Union[Path, str]] = None):
+        self.root = Path(root) if root is not None else default_cache_dir()
+        self.blob_dir = self.root / 'metadata'
+        self.sweep_dir = self.root / 'sweeps'
+
+    def _sweep_pointer(self, sweep_key: str) -> Path:
+        return self.sweep_dir / hashlib.sha256(sweep_key.encode('utf-8')).hexdigest()
+
+    def get(self, digest: str) -> th.Optional[dict]:
+        path = self.blob_dir / digest
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if metadata_digest(data) != digest:
+                    # corrupted cache entry, it will be downloaded again
+                    return None
+                return decode_metadata(data)
+
+    def put(self, data: bytes) -> str:
+        digest = metadata_digest(data)
+        path = self.blob_dir / digest
+        if not path.exists():
+            os.makedirs(self.blob_dir, exist_ok=True)
+            _atomic_write_bytes(path, data)
+        return digest
+
+    def lookup_sweep(self, sweep_key: str) -> th.Optional[dict]:
+        """Returns the cached metadata of a sweep, or None if this node has not seen it."""
+        pointer = self._sweep_pointer(sweep_key)
+        if not pointer.exists():
+            return None
+        return self.get(pointer.read_text().strip())
+
+    def remember_sweep(self, sweep_key: str, digest: str):
+        os.makedirs(self.sweep_dir, exist_ok=True)
+        _atomic_write_bytes(self._sweep_pointer(sweep_key), digest.encode('utf-8'))
@@ -1,22 +1,38 @@
 from dataclasses import dataclass
 import typing as th
 from pathlib import Path
-from .wandbX import sweep, agent, hierarchical_config
+from .wandbX import sweep, sweep_batch, agent, hierarchical_config, load_hierarchical_metadata
+from . import wandbX
 import functools
 from random_word import RandomWords
-import json
 import shutil
 import os
 import traceback
 import inspect
-import threading
-from pprint import pprint
 import dypy as dy
-import time
 import sys
 from .utils import Tee
+from .backend import SweepBackend, WandbBackend, get_backend
+from .prefetch import PreparedRun, run_prefetching_agent
+from .finalize import Finalizer
+from .index import CheckpointIndex, tree_size
+from .retention import RetentionPolicy, apply_retention, run_metric
+from .sync import CheckpointStore
+from . import preemption
+from . import reporting
+from .resume import ResumePolicy, pick_resumable
+from .early_stopping import EarlyStoppingPolicy, bracket_of, rung_budget, is_last_rung, in_top, next_promotion
+from . import profiling
+from .profiling import RunTimer, write_timings
+from .scheduler import NodeScheduler, reserve_resources, release_resources, run_single_configuration, \
+    EXIT_NO_CONFIGURATION
+from .forkserver import ForkServer
+from .batch import run_batches
+from .sharding import Shard
+from .configdiff import write_run_config, read_run_config, copy_run_config
+from . import serialization
+import warnings
 import gc
-import torch
 
 SPLIT = '_-_-_-_'
 
@@ -50,6 +66,56 @@ class ResumableSweepConfig:
     sweep_name: th.Optional[str] = 'dysweep'
     
     mark_preempting: bool = False
+    # where the sweeps, the metadata and the runs are stored: either
+    # 'wandb' (the default) or 'local' for an offline SQLite-backed stand-in
+    backend: th.Optional[str] = 'wandb'
+    backend_dir: th.Optional[th.Union[Path, str]] = None
+    # prepare the next run in the background while the current one is running
+    prefetch: bool = False
+    # run up to this many configurations at the same time on this node,
+    # as long as the node has the resources that they need
+    max_parallel_runs: th.Optional[int] = None
+    resources: th.Optional[th.Dict[str, float]] = None
+    # a dypy callable that takes the configuration of a run and returns
+    # the resources that it needs, e.g. {'cpus': 4, 'memory': 16}
+    run_cost: th.Optional[th.Union[str, th.Dict[str, str]]] = None
+    # where the directories of finished runs are moved to (defaults to the
+    # checkpoint directory); moves across filesystems happen in the background
+    final_checkpoint_dir: th.Optional[th.Union[Path, str]] = None
+    finalize_workers: int = 1
+    # which checkpoints of finished runs to keep, check `retention.RetentionPolicy`
+    retention: th.Optional[th.Dict[str, th.Any]] = None
+    # a directory shared by the nodes, where the run directories are synchronized
+    # to, so that runs can be resumed on any node
+    sync_store: th.Optional[th.Union[Path, str]] = None
+    # when set, SIGTERM is handled as a preemption and the run gets this many
+    # seconds to save its state (check `preemption`)
+    preemption_timeout: th.Optional[float] = None
+    # the priority of the runs when resuming, check `resume.ResumePolicy`
+    resume_policy: th.Optional[th.Dict[str, th.Any]] = None
+    # record how long every phase of a run takes (check `profiling`)
+    record_timings: bool = True
+    log_timings: bool = False
+    # either 'cprofile' or 'pyinstrument' to profile the function of every run
+    profile_function: th.Optional[str] = None
+    # what to clean up after every run: 'full', 'gen0', 'gen1', 'gen2', 'none', or
+    # 'subprocess' to run every configuration in its own process
+    post_run_cleanup: th.Optional[str] = 'full'
+    # 'forkserver' to run every configuration in a process forked from a template process
+    isolation: th.Optional[str] = None
+    # the modules that the template process imports once for all the runs
+    forkserver_preload: th.Optional[th.List[str]] = None
+    # claim this many configurations at once and evaluate them with a single call of the function
+    batch_size: th.Optional[int] = None
+    # pass the swept values of a batch as numpy arrays instead of hierarchical configs
+    batch_arrays: th.Optional[bool] = False
+    # run the slice shard_index (out of num_shards) of the sweep, without the sweep server
+    shard_index: th.Optional[int] = None
+    num_shards: th.Optional[int] = None
+    # stop the runs that are behind the others early, check `early_stopping`
+    early_stopping: th.Optional[dict] = None
+    # only store the difference of every run configuration with the base configuration
+    store_config_diffs: th.Optional[bool] = True
 
 def check_non_empty(checkpoint_dir):
     all_subdirs = [d for d in checkpoint_dir.iterdir() if d.is_dir() and SPLIT in d.name]
@@ -61,6 +127,133 @@ def get_max(all_subdirs):
     identifiers = [int(d.name.split(SPLIT)[0]) for d in all_subdirs]
     return max(identifiers)
 
+def cleanup_after_run(policy: th.Optional[str] = 'full'):
+    """
+    Free the memory that a finished run has left behind, according to `policy`:
+    'full' empties the CUDA cache (only if the run has used torch) and runs a full
+    garbage collection, 'gen0', 'gen1' and 'gen2' only collect up to that generation,
+    and 'none' (as well as 'subprocess', where the process of the run exits) does nothing.
+    """
+    if policy is None:
+        policy = 'full'
+    if policy in ['none', 'subprocess']:
+        return
+    if policy == 'full':
+        # only if the run has imported torch, importing it here would take seconds
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.empty_cache()
+        gc.collect()
+    elif policy in ['gen0', 'gen1', 'gen2']:
+        gc.collect(int(policy[-1]))
+    else:
+        raise ValueError(
+            f"Unknown post_run_cleanup {policy}, it should be one of full, gen0, gen1, gen2, none or subprocess.")
+
+
+def resolve_backend(conf: ResumableSweepConfig) -> SweepBackend:
+    """Returns the backend that `conf` asks for."""
+    backend_dir = conf.backend_dir
+    if backend_dir is None:
+        backend_dir = Path(conf.default_root_dir or './dysweep_logs') / 'local_backend'
+    return get_backend(conf.backend, backend_dir)
+
+
+def complete_sweep_configuration(conf: ResumableSweepConfig) -> dict:
+    """
+    Check if conf.sweep_configuration complies to the standard sweep format
+    (with `name`, `method`, `metric` and `parameters` keys) and if not, wrap it
+    with the defaults that are given in `conf`.
+    """
+    all_keys = list(conf.sweep_configuration.keys())
+    if 'method' not in all_keys or 'metric' not in all_keys or 'parameters' not in all_keys or 'name' not in all_keys:
+        # enter defaults
+        return {
+            'name': conf.sweep_name,
+            'method': conf.method,
+            'metric': {
+                'name': conf.metric,
+                'goal': conf.goal,
+            },
+            'parameters': conf.sweep_configuration
+        }
+    return conf.sweep_configuration
+
+
+def dysweep_create_batch(
+    confs: th.List[ResumableSweepConfig],
+    names: th.Optional[th.List[str]] = None,
+    manifest_path: th.Optional[th.Union[Path, str]] = None,
+    max_workers: th.Optional[int] = None,
+) -> th.List[str]:
+    """
+    Create a sweep for every configuration in `confs` in a single call.
+    
+    The sweep configurations are standardized in parallel and then registered
+    from this process (check `wandbX.sweep_batch`). This is much faster than
+    calling `dysweep_create` once per sweep when a study consists of hundreds
+    of sweeps.
+
+    Args:
+        confs:
+            The sweep configurations; each one should have `sweep_configuration`,
+            `base_config` and `project` set, and no `sweep_id`. All the sweeps are
+            created on the backend of the first configuration.
+        names: optional(list of str)
+            A name for each sweep that is written in the manifest. Defaults to
+            the `sweep_name` of each configuration.
+        manifest_path: optional(Path or str)
+            If given, a json file is written at this path that lists all the created
+            sweeps with their name, identifier, entity, and project.
+        max_workers: optional(int)
+            The number of processes used for standardizing the sweeps.
+    Returns:
+        The list of sweep identifiers, in the same order as `confs`.
+    """
+    if names is None:
+        names = [conf.sweep_name for conf in confs]
+    if len(names) != len(confs):
+        raise ValueError("names should have the same length as confs.")
+
+    items = []
+    for name, conf in zip(names, confs):
+        if conf.project is None:
+            raise ValueError(f"project should be given for the sweep {name}.")
+        if conf.sweep_configuration is None:
+            raise ValueError(f"sweep_configuration should be given for the sweep {name}.")
+        items.append({
+            'base_config': conf.base_config,
+            'sweep_config': complete_sweep_configuration(conf),
+            'entity': conf.entity,
+            'project': conf.project,
+        })
+
+    try:
+        sweep_ids = sweep_batch(items, max_workers=max_workers,
+                                backend=resolve_backend(confs[0]) if len(confs) > 0 else None)
+    except Exception as e:
+        print("Exception at creation of sweeps:")
+        print(traceback.format_exc())
+        raise e
+    finally:
+        import wandb
+        wandb.finish()
+
+    if manifest_path is not None:
+        manifest = [
+            {
+                'name': name,
+                'sweep_id': sweep_id,
+                'entity': item['entity'],
+                'project': item['project'],
+            }
+            for name, sweep_id, item in zip(names, sweep_ids, items)
+        ]
+        serialization.dump(manifest, manifest_path, pretty=True)
+
+    return sweep_ids
+
+
 def dysweep_run_resume(
     conf: th.Optional[ResumableSweepConfig] = None,
     function: th.Optional[th.Callable] = None,
@@ -82,7 +275,31 @@ def dysweep_run_resume(
     metric: th.Optional[str] = None,
     goal: th.Optional[str] = None,
     sweep_name: th.Optional[str] = None,
-    mark_preempting: th.Optional[bool] = None
+    mark_preempting: th.Optional[bool] = None,
+    backend: th.Optional[str] = None,
+    backend_dir: th.Optional[th.Union[Path, str]] = None,
+    prefetch: th.Optional[bool] = None,
+    max_parallel_runs: th.Optional[int] = None,
+    resources: th.Optional[th.Dict[str, float]] = None,
+    run_cost: th.Optional[th.Union[str, th.Dict[str, str]]] = None,
+    final_checkpoint_dir: th.Optional[th.Union[Path, str]] = None,
+    finalize_workers: th.Optional[int] = None,
+    retention: th.Optional[th.Dict[str, th.Any]] = None,
+    sync_store: th.Optional[th.Union[Path, str]] = None,
+    preemption_timeout: th.Optional[float] = None,
+    resume_policy: th.Optional[th.Dict[str, th.Any]] = None,
+    record_timings: th.Optional[bool] = None,
+    log_timings: th.Optional[bool] = None,
+    profile_function: th.Optional[str] = None,
+    post_run_cleanup: th.Optional[str] = None,
+    isolation: th.Optional[str] = None,
+    forkserver_preload: th.Optional[th.List[str]] = None,
+    batch_size: th.Optional[int] = None,
+    batch_arrays: th.Optional[bool] = None,
+    shard_index: th.Optional[int] = None,
+    num_shards: th.Optional[int] = None,
+    early_stopping: th.Optional[dict] = None,
+    store_config_diffs: th.Optional[bool] = None,
 ):
     """
     This is a multi-purpose function that does either one of the following functionalities:
@@ -183,6 +400,119 @@ def dysweep_run_resume(
             purposes.
         mark_preempting: 
             If set to true, then wandb.mark_preempting() would be called!
+        backend: optional(str) = 'wandb'
+            Either 'wandb' to use the Weights and Biases servers, or 'local' to keep the sweeps,
+            their metadata and the runs in a SQLite database on the filesystem. The local backend
+            does not need any network access, which is useful for benchmarks and for clusters without
+            outbound internet. Note that the sweep has to be created with the same backend.
+        backend_dir: optional(Path or str)
+            The directory of the local backend. Defaults to `<default_root_dir>/local_backend`.
+        prefetch: optional(bool) = False
+            When set to True, the agent claims and prepares the next configuration (decoding it,
+            naming the run, creating its checkpoint directory) in the background while the current
+            run is executing. This only works with backends that can hand out configurations
+            themselves (e.g. the local backend); the W&B agent pulls one configuration at a time.
+        max_parallel_runs: optional(int)
+            When set to more than one, the agent packs up to this many runs onto the machine at the
+            same time, each in its own process. A run waits for the resources it needs once it has
+            received its configuration, and new runs are started as resources free up.
+        resources: optional(dict)
+            The resources of the machine that the runs are packed into, e.g. `{'cpus': 32, 'memory': 128}`.
+            Defaults to all the CPU cores and all the RAM (in GB) of the machine.
+        run_cost: union(str, function)
+            This function takes in the configuration hierarchy `conf` of a run and returns the resources
+            that it needs as a dictionary (or a number of CPU cores). Defaults to one CPU core per run.
+        final_checkpoint_dir: optional(Path or str)
+            The directory where the checkpoint directories of finished runs are moved to (e.g. a shared
+            storage when the checkpoint directory is on node-local scratch). Defaults to the checkpoint
+            directory itself. Moves that are not a simple rename, as well as the deletions due to
+            `delete_checkpoints`, are done in the background (with hard links or reflinks where the
+            filesystem supports them) so that the next configuration can start right away.
+        finalize_workers: optional(int) = 1
+            The number of background threads that move or delete finished checkpoint directories.
+        retention: optional(dict)
+            A retention policy for the checkpoints of finished runs, with any of the keys `keep_top_k`,
+            `keep_last_n`, `max_total_bytes` and `max_age` (in seconds); `metric` and `goal` default to
+            the ones of the sweep. The policy is applied every time a run finishes, using an index of the
+            runs that is kept in the checkpoint directory. Check `retention.RetentionPolicy`.
+        sync_store: optional(Path or str)
+            A directory that all the nodes can access (e.g. on a shared filesystem). The checkpoint directory
+            of every run that can be resumed (failed, preempted or paused) is pushed to it when the function
+            returns, and re-running a run that is not in the local checkpoint directory pulls it from there.
+            Runs are removed from the store once they finish, together with the chunks that nothing else uses.
+            Files are transferred in content-addressed chunks, so only the chunks that changed are copied.
+            Check `sync.CheckpointStore`.
+        preemption_timeout: optional(float)
+            When set, SIGTERM is treated as a preemption: `dysweep.preemption_requested()` becomes True and
+            the callbacks registered with `dysweep.on_preemption` are called, with this many seconds to save
+            the state of the run (use `dysweep.atomic_write` so that a checkpoint is never half-written).
+            The run is then stopped, marked as preempted, and left in the checkpoint directory to be resumed.
+        resume_policy: optional(dict)
+            How the runs of the checkpoint directory are prioritized when resuming with `resume=True`, with any
+            of the keys `progress_weight`, `metric_weight`, `retry_penalty`, `backoff_base`, `backoff_max` and
+            `max_retries`, or a dypy callable under `priority` that takes a run and returns its priority. By
+            default, runs that have made progress (check `dysweep.report`) come first, and runs that keep
+            failing are held back with an exponential backoff. Check `resume.ResumePolicy`.
+        record_timings: optional(bool) = True
+            When set, the time spent in every phase of a run (initializing it, decoding its configuration,
+            setting up its directory, the function, finalization, cleanup, ...) and the peak memory of the
+            run are appended to `<checkpoint_dir>/<run_id>-timings.jsonl`. Check `profiling`.
+        log_timings: optional(bool) = False
+            When set, the timings of every run are also logged to the summary of the run under `dysweep/`.
+        profile_function: optional(str)
+            Either 'cprofile' or 'pyinstrument' (which has to be installed) to profile the function of every
+            run; the profile is saved in the checkpoint directory of the run.
+        post_run_cleanup: optional(str) = 'full'
+            What is done between two runs to free their memory: 'full' empties the CUDA cache (if the run
+            has used torch) and runs a full garbage collection, 'gen0', 'gen1' or 'gen2' only collect the
+            younger generations (much faster with large object graphs), and 'none' skips the cleanup.
+            With 'subprocess', every configuration runs in its own forked process, which frees
+            everything when it exits; resumed runs and reruns still run in the agent, and fall back
+            to 'full'. The time of the cleanup is part of the timings of the run.
+        isolation: optional(str)
+            With 'forkserver', a template process is forked from the agent before the first run, and
+            every configuration runs in a fresh process forked from that template; its result comes back
+            over a pipe. Memory leaks, fragmentation and crashes (even segfaults) of a run stay in its own
+            process, without paying for the interpreter and the imports of every run. This applies to the
+            agent and to resuming with count > 1; the runs are not prefetched in this mode. The template is
+            forked from the agent, so do not initialize CUDA before calling `dysweep_run_resume`.
+        forkserver_preload: optional(list of str)
+            The modules (e.g. ['torch', 'lightning']) that the template process imports once, so that
+            the runs do not import them again.
+        batch_size: optional(int)
+            For cheap functions: claim this many configurations at once and call `function(configs)` (or
+            `function(configs, checkpoint_dir)`) once for all of them, with the list of their hierarchical
+            configurations. The function returns one result (a dictionary or a number) per configuration,
+            and they are recorded all at once; the runs of a batch get no W&B run nor checkpoint directory.
+            Only backends that hand out configurations without an agent (the local backend) support it.
+        batch_arrays: optional(bool) = False
+            With batch_size, pass the swept values of the batch as a dictionary of NumPy arrays (one per
+            parameter) instead of the hierarchical configurations; the function may then return a
+            dictionary of arrays.
+        shard_index: optional(int)
+        num_shards: optional(int)
+            Split the sweep into `num_shards` deterministic and disjoint shards and only run the shard
+            `shard_index` (e.g. the index of the task in a job array), without asking the sweep server for
+            configurations. Grid sweeps are split into contiguous ranges of the grid, random sweeps into
+            interleaved streams of seeded samples. The position of every shard is kept in the checkpoint
+            index, so a shard that is started again continues where it stopped; keep num_shards the same
+            for the whole sweep, and do not mix shards with normal agents on the same sweep. Sharding can
+            not be combined with `batch_size` or the forkserver `isolation`.
+        early_stopping: optional(dict)
+            Asynchronous successive halving (or Hyperband with `brackets` > 1) over the metric and
+            budget that `function` reports with `dysweep.report(metric=..., budget=...)`, e.g.
+            {'min_budget': 1, 'max_budget': 81, 'reduction_factor': 3}. At every rung, a run that is
+            not among the best 1 / reduction_factor of the runs that have reached it is asked to stop,
+            which `function` checks with `dysweep.should_stop()`. The goal defaults to `goal`.
+            With `pause: True`, the runs are paused at their rungs instead: `function` trains up to
+            `dysweep.budget()` and returns, and is called again with a larger budget (in the same
+            process, directory and run) when the run is promoted, either right away or once enough
+            runs have fallen behind it.
+        store_config_diffs: optional(bool) = True
+            Store the configuration of every run (`run_config.json` and `<run_id>-config.json`) as its
+            difference with the base configuration of the sweep, which is stored only once in the
+            checkpoint directory (and hard linked into the run directories). Turn it off for full
+            configuration files.
         use_lightning_logger: optional(bool) = False
             When set to True, it will pass an additional argument `logger` to `function` that contains the
             lightning logger wrapper.
@@ -219,6 +549,30 @@ def dysweep_run_resume(
             sweep_name=sweep_name,
             goal=goal,
             mark_preempting=mark_preempting,
+            backend=backend,
+            backend_dir=backend_dir,
+            prefetch=prefetch,
+            max_parallel_runs=max_parallel_runs,
+            resources=resources,
+            run_cost=run_cost,
+            final_checkpoint_dir=final_checkpoint_dir,
+            finalize_workers=finalize_workers,
+            retention=retention,
+            sync_store=sync_store,
+            preemption_timeout=preemption_timeout,
+            resume_policy=resume_policy,
+            record_timings=record_timings,
+            log_timings=log_timings,
+            profile_function=profile_function,
+            post_run_cleanup=post_run_cleanup,
+            isolation=isolation,
+            forkserver_preload=forkserver_preload,
+            batch_size=batch_size,
+            batch_arrays=batch_arrays,
+            shard_index=shard_index,
+            num_shards=num_shards,
+            early_stopping=early_stopping,
+            store_config_diffs=store_config_diffs,
         )
     else:
         # if for any argument x, the value of x is not the default value
@@ -261,6 +615,54 @@ def dysweep_run_resume(
             conf.goal = goal
         if mark_preempting is not None:
             conf.mark_preempting = mark_preempting
+        if backend is not None:
+            conf.backend = backend
+        if backend_dir is not None:
+            conf.backend_dir = backend_dir
+        if prefetch is not None:
+            conf.prefetch = prefetch
+        if max_parallel_runs is not None:
+            conf.max_parallel_runs = max_parallel_runs
+        if resources is not None:
+            conf.resources = resources
+        if run_cost is not None:
+            conf.run_cost = run_cost
+        if final_checkpoint_dir is not None:
+            conf.final_checkpoint_dir = final_checkpoint_dir
+        if finalize_workers is not None:
+            conf.finalize_workers = finalize_workers
+        if retention is not None:
+            conf.retention = retention
+        if sync_store is not None:
+            conf.sync_store = sync_store
+        if preemption_timeout is not None:
+            conf.preemption_timeout = preemption_timeout
+        if resume_policy is not None:
+            conf.resume_policy = resume_policy
+        if record_timings is not None:
+            conf.record_timings = record_timings
+        if log_timings is not None:
+            conf.log_timings = log_timings
+        if profile_function is not None:
+            conf.profile_function = profile_function
+        if post_run_cleanup is not None:
+            conf.post_run_cleanup = post_run_cleanup
+        if isolation is not None:
+            conf.isolation = isolation
+        if forkserver_preload is not None:
+            conf.forkserver_preload = forkserver_preload
+        if batch_size is not None:
+            conf.batch_size = batch_size
+        if batch_arrays is not None:
+            conf.batch_arrays = batch_arrays
+        if shard_index is not None:
+            conf.shard_index = shard_index
+        if num_shards is not None:
+            conf.num_shards = num_shards
+        if early_stopping is not None:
+            conf.early_stopping = early_stopping
+        if store_config_diffs is not None:
+            conf.store_config_diffs = store_config_diffs
         
         
     if conf.project is None:
@@ -268,6 +670,11 @@ def dysweep_run_resume(
     if function is None and sweep_id is not None:
         raise ValueError("function should be given to the dysweep run and resume when sweep_id is given.")
 
+    # resolve the backend that stores the sweeps and the runs
+    sweep_backend = resolve_backend(conf)
+    if conf.use_lightning_logger and not isinstance(sweep_backend, WandbBackend):
+        raise ValueError("use_lightning_logger is only supported with the wandb backend.")
+
     # turn run_name_changer into a callable
     if conf.run_name_changer is None:
         conf.run_name_changer = lambda conf, run_name: run_name
@@ -275,9 +682,27 @@ def dysweep_run_resume(
         conf.run_name_changer = dy.eval(conf.run_name_changer)
     elif isinstance(conf.run_name_changer, dict):
         conf.run_name_changer = dy.eval(**conf.run_name_changer)
-    else:
+    elif not callable(conf.run_name_changer):
         raise ValueError("run_name_changer should be either a string or a dictionary.")
 
+    # turn run_cost into a callable
+    if isinstance(conf.run_cost, str):
+        conf.run_cost = dy.eval(conf.run_cost)
+    elif isinstance(conf.run_cost, dict):
+        conf.run_cost = dy.eval(**conf.run_cost)
+    elif conf.run_cost is not None and not callable(conf.run_cost):
+        raise ValueError("run_cost should be either a string or a dictionary.")
+
+    if conf.isolation not in [None, 'none', 'forkserver']:
+        raise ValueError(f"Unknown isolation {conf.isolation}, it should be either `none` or `forkserver`.")
+    if conf.num_shards is not None or conf.shard_index is not None:
+        # these paths pull their configurations from the sweep server, which would run the whole sweep on every shard
+        if conf.batch_size is not None:
+            raise ValueError("Sharding (shard_index and num_shards) can not be combined with batch_size.")
+        if conf.isolation == 'forkserver':
+            raise ValueError(
+                "Sharding (shard_index and num_shards) can not be combined with the forkserver isolation.")
+
     if conf.sweep_id is not None:
         if conf.default_root_dir is None:
             conf.default_root_dir = './dysweep_logs'
@@ -297,14 +722,123 @@ def dysweep_run_resume(
         except FileExistsError as e:
             # ignore file exists error due to concurrency
             pass
+        # finished runs are moved to final_dir, or deleted, in the background
+        final_dir = Path(conf.final_checkpoint_dir) if conf.final_checkpoint_dir is not None else checkpoint_dir
+        os.makedirs(final_dir, exist_ok=True)
+        finalizer = Finalizer(checkpoint_dir, max_workers=conf.finalize_workers or 1)
+        # the runs of the checkpoint directory, so that policies do not have to walk it
+        index = CheckpointIndex(checkpoint_dir)
+        if index.created:
+            index.rebuild([checkpoint_dir, final_dir])
+        retention_policy = None
+        if conf.retention is not None:
+            retention_policy = RetentionPolicy(**conf.retention)
+            retention_policy.metric = retention_policy.metric or conf.metric or 'dysweep_default'
+            retention_policy.goal = retention_policy.goal or conf.goal or 'minimize'
+        store = CheckpointStore(conf.sync_store) if conf.sync_store is not None else None
+        early_stopping_policy = None
+        if conf.early_stopping is not None:
+            early_stopping_policy = EarlyStoppingPolicy(**conf.early_stopping)
+            early_stopping_policy.goal = early_stopping_policy.goal or conf.goal or 'minimize'
+            if early_stopping_policy.pause and early_stopping_policy.max_budget is None:
+                raise ValueError("early_stopping with pause needs a max_budget, where the runs are finished.")
+        # the runs are paused at their rungs and promoted later, instead of being stopped
+        pausing = early_stopping_policy is not None and early_stopping_policy.pause
+        resume_policy = ResumePolicy(**(conf.resume_policy or {}))
+        resume_policy.goal = resume_policy.goal or conf.goal or 'minimize'
+        # turn the custom priority into a callable
+        if isinstance(resume_policy.priority, str):
+            resume_policy.priority = dy.eval(resume_policy.priority)
+        elif isinstance(resume_policy.priority, dict):
+            resume_policy.priority = dy.eval(**resume_policy.priority)
         # Assume that function is well-formed.
         # in that case, modified_function will handle all the resumption
         # logic so that function can be run as if it was a normal function.
-        def modified_function(ran_from_sweep: bool = False):
+        def random_run_name():
+            # Change the run-name by adding something random to it
+            # if the conf.run_name is None just assign it to None
+            # and wandb will handle the rest.
+            r = RandomWords()
+            w = r.get_random_word()
+            if conf.run_name is not None:
+                return conf.run_name + '-' + w
+            return w
+
+        def config_base() -> dict:
+            # the base of the sweep that the run configurations are stored against
+            if conf.store_config_diffs is False or wandbX.base_config is None:
+                return {}
+            return {'base': wandbX.base_config, 'bases_dir': checkpoint_dir}
+
+        def prepare_run(claim: th.Optional[th.Callable[[], th.Optional[dict]]] = None) -> th.Optional[PreparedRun]:
+            """
+            Claims the next configuration of the sweep (or the one returned by `claim`) and
+            prepares everything that is needed for running it, without starting the run itself.
+            This is called by the prefetching agent in the background while the previous run
+            is executing.
+            """
+            # these phases overlap with the previous run, hence the prefix
+            timer = RunTimer(background=True)
+            if claim is None:
+                configs = sweep_backend.claim_configs(conf.sweep_id, 1)
+                raw_config = configs[0] if len(configs) > 0 else None
+            else:
+                raw_config = claim()
+            if raw_config is None:
+                return None
+            timer.lap('prefetch_claim')
+            sweep_config = hierarchical_config(raw_config)
+            run_name = conf.run_name_changer(sweep_config, random_run_name())
+            run_id = sweep_backend.generate_run_id()
+            timer.lap('prefetch_decode')
+
+            all_subdirs = [
+                d for d in checkpoint_dir.iterdir() if d.is_dir() and SPLIT in d.name]
+            new_checkpoint_dir = checkpoint_dir / f"{get_max(all_subdirs)+1}{SPLIT}{run_id}"
+            os.makedirs(new_checkpoint_dir)
+            timer.lap('prefetch_checkpoint_setup')
+            try:
+                # dump a json in checkpoint_dir/run_id containing the sweep config
+                write_run_config(new_checkpoint_dir / "run_config.json", sweep_config, **config_base())
+                timer.lap('prefetch_config_write')
+                # the configuration is claimed from now on, so the run should be resumable
+                # even if the agent stops before starting it
+                sweep_backend.register_run(conf.sweep_id, run_id, run_name, raw_config,
+                                           entity=conf.entity, project=conf.project)
+            except Exception as e:
+                shutil.rmtree(new_checkpoint_dir, ignore_errors=True)
+                raise e
+            timer.lap('prefetch_register')
+
+            return PreparedRun(
+                run_id=run_id,
+                run_name=run_name,
+                raw_config=raw_config,
+                sweep_config=sweep_config,
+                checkpoint_dir=new_checkpoint_dir,
+                timings=timer.phases,
+            )
+
+        def record_timings(timer: RunTimer, run_id: str, run_name: str, status: str, **extra):
+            # on by default, also when the field is left as None
+            if conf.record_timings is not False:
+                write_timings(checkpoint_dir, timer.record(
+                    run_id, run_name, status,
+                    sweep_id=conf.sweep_id,
+                    resumed=bool(conf.resume or conf.rerun_id),
+                    **extra,
+                ))
+
+        def modified_function(ran_from_sweep: bool = False, prepared: th.Optional[PreparedRun] = None,
+                              resume_dir: th.Optional[Path] = None, promote_to: th.Optional[int] = None):
             """
             This function handles extracting the logger, configuration, and checkpoint_dir
-            and calls `function` internally.
+            and calls `function` internally. If the run has been `prepared` ahead of time,
+            the run is only started. When resuming, `resume_dir` is the directory of the run
+            that has been claimed from the resume queue. When promoting, `resume_dir` is the
+            directory of a paused run and `promote_to` the rung that it goes on to.
             """
+            timer = RunTimer(prepared.timings if prepared is not None else None)
             try:
                 # list and sort all of the checkpoint subdirectories by the order
                 # they were created.
@@ -312,21 +846,37 @@ def dysweep_run_resume(
                     d for d in checkpoint_dir.iterdir() if d.is_dir() and SPLIT in d.name]
                 all_subdirs = sorted(
                     all_subdirs, key=lambda x: int(x.name.split(SPLIT)[0]))
+                timer.lap('scan')
 
-                
-
-                if conf.resume or conf.rerun_id:
-                    if not conf.rerun_id:
-                        # find the first run that contains checkpoints
-                        if len(all_subdirs) == 0:
+                if prepared is not None:
+                    run_ = sweep_backend.init_run(
+                        name=prepared.run_name,
+                        project=conf.project,
+                        entity=conf.entity,
+                        run_id=prepared.run_id,
+                        config=prepared.raw_config,
+                        sweep_id=conf.sweep_id,
+                    )
+                    experiment_id = run_.id
+                    run_name = prepared.run_name
+                    timer.lap('init')
+                    sweep_config = prepared.sweep_config
+                    new_checkpoint_dir = prepared.checkpoint_dir
+                elif resume_dir is not None or conf.resume or conf.rerun_id:
+                    if resume_dir is not None or not conf.rerun_id:
+                        # claim the run with the highest priority
+                        if resume_dir is None:
+                            resume_dir = pick_resumable(index, all_subdirs, resume_policy)
+                        if resume_dir is None:
                             raise ValueError(
-                                f"The checkpoint directory {checkpoint_dir} is empty, so you can't resume from it.")
+                                f"The checkpoint directory {checkpoint_dir} has no run that can be resumed right now.")
                         # get the name of the directory that we are trying to resume which
                         # contains the resume_id in its name.
-                        dir_name = all_subdirs[0].name
+                        dir_name = resume_dir.name
                         experiment_id = SPLIT.join(dir_name.split(SPLIT)[1:])
                     else:
                         experiment_id = conf.rerun_id
+                    timer.lap('resume_claim')
 
                     # Using experiment_id, either get the actual configuration
                     # from the running directory or from the stored json file
@@ -341,24 +891,45 @@ def dysweep_run_resume(
                                 old_dir_name = d.name
                                 config_dir = checkpoint_dir / d.name / "run_config.json"
 
-                    if not os.path.exists(config_dir):
-                        raise FileNotFoundError(f"{config_dir} not found! Make sure the rerun_id is actually ran before.")
-
                     new_dir_name = f"{get_max(all_subdirs) + 1}{SPLIT}{experiment_id}"
+                    # create a new checkpoint directory for the inner function
+                    new_checkpoint_dir = checkpoint_dir / new_dir_name
+
+                    pulled = False
+                    if config_dir is None and store is not None and store.has_run(experiment_id):
+                        # The run has been running on another node, only bring
+                        # over its checkpoints from the store
+                        store.pull(experiment_id, new_checkpoint_dir)
+                        config_dir = new_checkpoint_dir / "run_config.json"
+                        pulled = True
+
+                    if config_dir is None or not os.path.exists(config_dir):
+                        raise FileNotFoundError(
+                            f"The configuration of {experiment_id} not found! Make sure the rerun_id is actually ran before.")
 
                     # Load the configuration that was already used for running
                     # the function before.
-                    with open(config_dir, "r") as f:
-                        sweep_config = json.load(f)
-
-                    if old_dir_name is not None:
-                        # Change the name of the directory by pushing it to the end of the queue
-                        shutil.copytree(checkpoint_dir / old_dir_name,
-                                        checkpoint_dir / new_dir_name)
-                        shutil.rmtree(checkpoint_dir / old_dir_name)
+                    sweep_config = read_run_config(config_dir)
 
-                    # create a new checkpoint directory for the inner function
-                    new_checkpoint_dir = checkpoint_dir / new_dir_name
+                    if old_dir_name is not None and promote_to is not None:
+                        # a paused run goes on in its own directory, where it has left its state
+                        new_checkpoint_dir = checkpoint_dir / old_dir_name
+                    elif old_dir_name is not None:
+                        # Change the name of the directory by pushing it to the end of the queue,
+                        # renaming is instant whereas copying would take as long as the checkpoints are big.
+                        try:
+                            os.rename(checkpoint_dir / old_dir_name, new_checkpoint_dir)
+                        except OSError:
+                            shutil.copytree(checkpoint_dir / old_dir_name, new_checkpoint_dir)
+                            shutil.rmtree(checkpoint_dir / old_dir_name)
+                        if store is not None and store.has_run(experiment_id):
+                            # only transfers something if the run got further on another node
+                            store.pull(experiment_id, new_checkpoint_dir)
+                    elif not pulled:
+                        # The run has been completed before, start it over in a fresh directory
+                        os.makedirs(new_checkpoint_dir, exist_ok=True)
+                        copy_run_config(config_dir, new_checkpoint_dir / "run_config.json")
+                    timer.lap('checkpoint_setup')
 
                     # Retrieve the logger
                     if conf.use_lightning_logger:
@@ -369,227 +940,411 @@ def dysweep_run_resume(
                             entity=conf.entity,
                             id=experiment_id,
                         )
+                        run_name = logger.experiment.name
                     else:
-                        # Call the init function of wandb with the experiment_id
-                        import wandb
-                        wandb.init(
+                        # Initialize the run of the backend with the experiment_id
+                        run_ = sweep_backend.init_run(
                             project=conf.project,
                             entity=conf.entity,
-                            id=experiment_id,
+                            run_id=experiment_id,
                         )
                         if conf.mark_preempting:
-                            wandb.mark_preempting()
-
-                    run_name = wandb.run.name
+                            sweep_backend.mark_preempting()
+                        run_name = run_.name
+                    timer.lap('init')
                     
                 else:
-                    # Change the run-name by adding something random to it
-                    # if the conf.run_name is None just assign it to None
-                    # and wandb will handle the rest.
-                    r = RandomWords()
-                    w = r.get_random_word()
-                    if conf.run_name is not None:
-                        run_name = conf.run_name + '-' + w
-                    else:
-                        run_name = w
+                    run_name = random_run_name()
                     
-                    init_args = {
-                        'name': run_name,
-                    }
-                    if not ran_from_sweep:
-                        init_args['project'] = conf.project
-                        init_args['entity'] = conf.entity
                     # if the run_id doesn't exist, then create a new run
                     # and create the subdirectory
                     if conf.use_lightning_logger:
+                        init_args = {
+                            'name': run_name,
+                        }
+                        if not ran_from_sweep:
+                            init_args['project'] = conf.project
+                            init_args['entity'] = conf.entity
                         from lightning.pytorch.loggers import WandbLogger
                         logger = WandbLogger(**init_args)
                         experiment_id = logger.experiment.id
                         sweep_config = hierarchical_config(
                             logger.experiment.config)
-                        # Change the run_name according to the run_name_changer
-                        new_run_name = conf.run_name_changer(sweep_config, run_name)
-                        init_args['name'] = new_run_name
-                        logger = WandbLogger(**init_args)
-                        experiment_id = logger.experiment.id
-                        sweep_config = hierarchical_config(
-                            logger.experiment.config)
+                        # Change the run_name according to the run_name_changer,
+                        # renaming the run is cheaper than initializing it again.
+                        run_name = conf.run_name_changer(sweep_config, run_name)
+                        logger.experiment.name = run_name
+                        timer.lap('init')
                     else:
-                        import wandb
-                        
-                        run_ = wandb.init(**init_args)
+                        run_ = sweep_backend.init_run(
+                            name=run_name,
+                            project=conf.project,
+                            entity=conf.entity,
+                            from_sweep=ran_from_sweep,
+                        )
                         experiment_id = run_.id
-                        sweep_config = hierarchical_config(wandb.config)
+                        timer.lap('init')
+                        sweep_config = hierarchical_config(run_.config)
                         # Change the run_name according to the run_name_changer
-                        new_run_name = conf.run_name_changer(sweep_config, run_name)
-                        init_args['name'] = new_run_name
-                        wandb.finish()
-                        run_ = wandb.init(**init_args)
-                        experiment_id = run_.id
-                        sweep_config = hierarchical_config(wandb.config)
-                        
+                        run_name = conf.run_name_changer(sweep_config, run_name)
+                        timer.lap('decode')
+                        sweep_backend.rename_run(run_name)
+                        timer.lap('rename')
 
                     new_dir_name = f"{get_max(all_subdirs)+1}{SPLIT}{experiment_id}"
 
                     os.makedirs(checkpoint_dir / new_dir_name)
+                    timer.lap('checkpoint_setup')
 
                     # dump a json in checkpoint_dir/run_id containing the sweep config
-                    with open(checkpoint_dir / new_dir_name / "run_config.json", "w") as f:
-                        json.dump(sweep_config, f, indent=4, sort_keys=True)
+                    write_run_config(checkpoint_dir / new_dir_name / "run_config.json", sweep_config,
+                                     **config_base())
 
                     new_checkpoint_dir = checkpoint_dir / new_dir_name
+                    timer.lap('config_write')
             except Exception as e:
                 print(traceback.format_exc())
                 raise e
 
+            # check the function signature matches
+            # the one we expect.
+            # in which there are two arguments with the first one
+            # named config and the second one named checkpoint_dir
+            # (and a logger in between if use_lightning_logger is set)
+
+            # get the signature of the function
+            sig = inspect.signature(function)
+            # get the parameters of the function
+            params = sig.parameters
             if conf.use_lightning_logger:
-                # check the function signature matches
-                # the one we expect.
-                # in which there are two arguments with the first one
-                # named config and the second one named checkpoint_dir
-
-                # get the signature of the function
-                sig = inspect.signature(function)
-                # get the parameters of the function
-                params = sig.parameters
-                # check that the function has two parameters
                 if "config" not in params or "logger" not in params or "checkpoint_dir" not in params:
                     raise ValueError(
                         "the function passed to `dysweep_run_resume` should take the following parameters: (config, logger, checkpoint_dir)")
-                    
-                try:
-                    out_file = open(os.path.join(new_checkpoint_dir, 'stdout'), 'a')
-                    err_file = open(os.path.join(new_checkpoint_dir, 'stderr'), 'a')
-                    saved_stderr = sys.stderr
-                    saved_stdout = sys.stdout
-                    sys.stdout = Tee(
-                        primary_file=sys.stdout,
-                        secondary_file=out_file,
-                    )
-                    sys.stderr = Tee(
-                        primary_file=sys.stderr,
-                        secondary_file=err_file,
-                    )
-                    # TODO: make it so that the logged sweep also contains nested list and dictionary architectures
-                    wandb.config.update({'dy_config': sweep_config})
-                    ret = function(sweep_config, logger, new_checkpoint_dir)
-                except Exception as e:
-                    # write exception into an err-log.txt file in the checkpoint_dir
-                    sys.stderr.write("Exception while running function: ")
-                    sys.stderr.write(traceback.format_exc())
-                    raise e
-                finally:
-                    out_file.close()
-                    err_file.close()
-                    sys.stderr = saved_stderr
-                    sys.stdout = saved_stdout
-                    
+                function_args = (sweep_config, logger, new_checkpoint_dir)
             else:
-                # check the function signature matches
-                # the one we expect.
-                # in which there are two arguments with the first one
-                # named config and the second one named checkpoint_dir
-
-                # get the signature of the function
-                sig = inspect.signature(function)
-                # get the parameters of the function
-                params = sig.parameters
-                # check that the function has two parameters
                 if "config" not in params or "checkpoint_dir" not in params:
                     raise ValueError(
                         "the function passed to `dysweep_run_resume` should take the following parameters: (config, checkpoint_dir)")
-                try:
-                    out_file = open(os.path.join(new_checkpoint_dir, 'stdout'), 'a')
-                    err_file = open(os.path.join(new_checkpoint_dir, 'stderr'), 'a')
-                    saved_stderr = sys.stderr
-                    saved_stdout = sys.stdout
-                    sys.stdout = Tee(
-                        primary_file=sys.stdout,
-                        secondary_file=out_file,
-                    )
-                    sys.stderr = Tee(
-                        primary_file=sys.stderr,
-                        secondary_file=err_file,
-                    )
-                    wandb.config.update({'dy_config': sweep_config})
-                    ret = function(sweep_config, new_checkpoint_dir)
-                except Exception as e:
-                    # write exception into an err-log.txt file in the checkpoint_dir
-                    sys.stderr.write("Exception while running function: ")
-                    sys.stderr.write(traceback.format_exc())
-                    raise e
-                finally:
-                    out_file.close()
-                    err_file.close()
-                    sys.stderr = saved_stderr
-                    sys.stdout = saved_stdout
-                    
+                function_args = (sweep_config, new_checkpoint_dir)
+
+            rung, bracket = 0, 0
+            if pausing:
+                bracket = bracket_of(experiment_id, early_stopping_policy)
+                if promote_to is not None:
+                    rung = promote_to
+                else:
+                    # a run that has failed after a promotion goes on from the rung it was promoted to
+                    rung = index.run_rung(experiment_id) or 0
+            index.run_started(experiment_id, run_name, new_checkpoint_dir)
+            timer.lap('index')
+
+            def mark_preempted():
+                # the run stays in the checkpoint directory and is picked up by the next resume
+                index.run_preempted(experiment_id)
+                sweep_backend.mark_preempting()
+
+            # when the run is packed onto the node by a scheduler, wait
+            # until the node has the resources that this configuration needs
+            reservation = reserve_resources(conf.run_cost, sweep_config)
+            timer.lap('wait_resources')
+            out_file = open(os.path.join(new_checkpoint_dir, 'stdout'), 'a')
+            err_file = open(os.path.join(new_checkpoint_dir, 'stderr'), 'a')
+            saved_stderr = sys.stderr
+            saved_stdout = sys.stdout
+            preemption.begin_run(on_preempted=mark_preempted)
+            reporting.begin_run(index, experiment_id, early_stopping=early_stopping_policy,
+                                budget=rung_budget(early_stopping_policy, bracket, rung) if pausing else None)
+            status = 'failed'
+            try:
+                sys.stdout = Tee(
+                    primary_file=sys.stdout,
+                    secondary_file=out_file,
+                )
+                sys.stderr = Tee(
+                    primary_file=sys.stderr,
+                    secondary_file=err_file,
+                )
+                # TODO: make it so that the logged sweep also contains nested list and dictionary architectures
+                sweep_backend.update_config({'dy_config': sweep_config})
+                timer.lap('config_update')
+                with timer.phase('function'), profiling.profile_function(conf.profile_function, new_checkpoint_dir):
+                    ret = function(*function_args)
+                    while pausing and not is_last_rung(early_stopping_policy, bracket, rung) \
+                            and not preemption.preemption_requested():
+                        metric = reporting.last_metric()
+                        if metric is None:
+                            raise ValueError("with early_stopping pause, the function should report "
+                                             "its metric with `dysweep.report` before returning.")
+                        metrics = index.record_rung(experiment_id, bracket, rung, metric)
+                        if not in_top(metric, metrics, early_stopping_policy):
+                            status = 'paused'
+                            break
+                        # promote the run right away, without starting it over
+                        rung += 1
+                        index.run_promoted(experiment_id, rung)
+                        reporting.set_budget(rung_budget(early_stopping_policy, bracket, rung))
+                        ret = function(*function_args)
+                if status != 'paused':
+                    status = 'finished'
+                if preemption.preemption_requested():
+                    # the function has saved its state and returned early,
+                    # so the run is not finished yet
+                    raise preemption.Preempted()
+            except preemption.Preempted:
+                status = 'preempted'
+                # outside of the signal handler, mark the run as resumable and let it save its state
+                preemption.handle_preempted()
+                raise
+            except Exception as e:
+                status = 'failed'
+                # the run goes back to the resume queue, with a backoff
+                index.run_failed(experiment_id)
+                # write exception into an err-log.txt file in the checkpoint_dir
+                sys.stderr.write("Exception while running function: ")
+                sys.stderr.write(traceback.format_exc())
+                raise e
+            finally:
+                out_file.close()
+                err_file.close()
+                sys.stderr = saved_stderr
+                sys.stdout = saved_stdout
+                release_resources(reservation)
+                preemption.end_run()
+                reporting.end_run()
+                if store is not None and status != 'finished':
+                    # so that the run can be picked up on any node from where it stopped
+                    try:
+                        store.push(experiment_id, new_checkpoint_dir)
+                    except Exception:
+                        print("Exception while pushing the checkpoints to the store:")
+                        print(traceback.format_exc())
+                    timer.lap('sync')
+                if status != 'finished':
+                    record_timings(timer, experiment_id, run_name, status)
+
+            if status == 'paused':
+                # the run waits in its directory until it is promoted
+                index.run_paused(experiment_id, rung)
+                sweep_backend.finish_run()
+                if promote_to is None:
+                    promote_paused_runs()
+                return ret
             
             # >> Decommissioning the run
             
             # remove the entire new_checkpoint_dir if the function has finished
             # running.
-            shutil.copyfile(new_checkpoint_dir / "run_config.json",
+            copy_run_config(new_checkpoint_dir / "run_config.json",
                             checkpoint_dir / f"{experiment_id}-config.json")
+            metric_value = run_metric(sweep_backend.run_summary(), ret,
+                                      retention_policy.metric if retention_policy is not None else conf.metric)
+            # the finalizer only renames the directory here; moving it across
+            # filesystems or deleting it happens in the background.
             if not conf.delete_checkpoints:
                 # move the entire new_checkpoint_dir to the final directory
-                shutil.move(new_checkpoint_dir, checkpoint_dir / f"{wandb.run.name}_{experiment_id}_final")
+                final_run_dir = final_dir / f"{run_name}_{experiment_id}_final"
+                nbytes = tree_size(new_checkpoint_dir)
+                finalizer.finalize(new_checkpoint_dir, final_run_dir)
+                index.run_finished(experiment_id, run_name, final_run_dir, nbytes=nbytes, metric=metric_value)
             else:
+                finalizer.finalize(new_checkpoint_dir)
+                index.run_finished(experiment_id, run_name, None, metric=metric_value)
+            if retention_policy is not None:
+                # only the runs of the index are looked at, which is cheap enough to do after every run
+                apply_retention(index, retention_policy, finalizer.finalize)
+            if store is not None and store.has_run(experiment_id):
+                # the run will not be resumed anymore, free the chunks that only its checkpoints used
                 try:
-                    shutil.rmtree(new_checkpoint_dir)
-                except OSError as e:
-                    print("Make sure that you are not logging stderr or stdout in here!")
-                    raise e
-            # finish the wandb run so that later .init calls can resume different ones
-            wandb.finish()
-            torch.cuda.empty_cache()
-            gc.collect()
+                    store.remove(experiment_id)
+                    store.collect_garbage()
+                except Exception:
+                    print("Exception while removing the checkpoints from the store:")
+                    print(traceback.format_exc())
+            timer.lap('finalize')
+            if conf.log_timings:
+                sweep_backend.update_summary({f"dysweep/{name}": seconds for name, seconds in timer.phases.items()})
+            # finish the run so that later .init calls can resume different ones
+            sweep_backend.finish_run()
+            timer.lap('finish')
+            cleanup_after_run(conf.post_run_cleanup)
+            timer.lap('cleanup')
+            record_timings(timer, experiment_id, run_name, 'finished')
+            if pausing and promote_to is None:
+                promote_paused_runs()
             return ret
 
+        def promote_paused_runs():
+            """Promote the paused runs that have become good enough, one after the other."""
+            while True:
+                run = next_promotion(index, early_stopping_policy)
+                if run is None:
+                    return
+                try:
+                    modified_function(resume_dir=Path(run['path']), promote_to=run['rung'])
+                except preemption.Preempted:
+                    raise
+                except Exception:
+                    # the run is marked as failed, and is resumed from its rung later on
+                    print(traceback.format_exc())
+                    sweep_backend.finish_run(exit_code=1)
+
+        # the targets of the processes forked by the fork server; these processes
+        # exit right after their run, which frees everything
+        def isolated_agent_run():
+            results = []
 
-        if conf.resume and not conf.rerun_id:
-            # In this case, we will sequantially resume
-            # any run that is remaining with the limit of `count`
-            if conf.count > 1:
-                for _ in range(conf.count):
-                    if check_non_empty(checkpoint_dir):
-                        # run modified_function in a separate thread and wait for it to finish
-                        # before running the agent.
-                        # this is to ensure that the function is running before the agent
-                        # starts.
-                        modified_function_thread = threading.Thread(
-                            target=modified_function)
-                        modified_function_thread.start()
-                        modified_function_thread.join()
-                    else:
+            def run_once():
+                results.append(None)
+                results[-1] = modified_function(ran_from_sweep=True)
+
+            conf.post_run_cleanup = 'none'
+            try:
+                agent(conf.sweep_id, function=run_once, entity=conf.entity,
+                      project=conf.project, count=1, backend=sweep_backend)
+            finally:
+                finalizer.wait()
+            if len(results) == 0:
+                # tell the agent that the sweep had nothing left to hand out
+                sys.exit(EXIT_NO_CONFIGURATION)
+            return results[0]
+
+        def isolated_resume_run(resume_dir: Path):
+            conf.post_run_cleanup = 'none'
+            try:
+                return modified_function(resume_dir=resume_dir)
+            finally:
+                finalizer.wait()
+
+        def release_prepared(prepared):
+            # the run keeps its directory and is picked up by the next resume
+            print(f"The run {prepared.run_id} has been prepared but not started, "
+                  f"it can be resumed from {prepared.checkpoint_dir}.")
+
+        def execute_prepared(prepared):
+            try:
+                return modified_function(prepared=prepared)
+            except Exception as e:
+                # mark the run as failed, as the W&B agent would do
+                sweep_backend.finish_run(exit_code=1)
+                raise e
+
+        forkserver = None
+
+        def run_forked(name: str, *args) -> int:
+            nonlocal forkserver
+            if forkserver is None:
+                # started lazily, nothing has run in this process yet
+                forkserver = ForkServer({'agent': isolated_agent_run, 'resume': isolated_resume_run},
+                                        preload=conf.forkserver_preload)
+                forkserver.start()
+            exit_code, _ = forkserver.run(name, *args)
+            if exit_code == preemption.Preempted().code:
+                # the node is being preempted, do not start anything else
+                raise preemption.Preempted()
+            if exit_code not in [0, EXIT_NO_CONFIGURATION]:
+                warnings.warn(f"The process of a run has exited with {exit_code}, moving on to the next one.")
+            return exit_code
+
+        if conf.preemption_timeout is not None:
+            preemption.install(conf.preemption_timeout)
+        if conf.post_run_cleanup == 'subprocess' and (conf.resume or conf.rerun_id):
+            # only the runs of the agent are handed to the scheduler, the others run in this process
+            warnings.warn("Resumed runs and reruns do not run in their own process, "
+                          "post_run_cleanup 'subprocess' falls back to 'full' for them.")
+            conf.post_run_cleanup = 'full'
+        try:
+            if conf.resume and not conf.rerun_id:
+                # In this case, we will sequantially resume
+                # any run that is remaining with the limit of `count`
+                if conf.count > 1:
+                    for _ in range(conf.count):
+                        all_subdirs = [
+                            d for d in checkpoint_dir.iterdir() if d.is_dir() and SPLIT in d.name]
+                        # claim the run with the highest priority
+                        resume_dir = pick_resumable(index, all_subdirs, resume_policy)
+                        if resume_dir is None:
+                            break
+                        if conf.isolation == 'forkserver':
+                            run_forked('resume', resume_dir)
+                            continue
+                        # in the main thread, where the signals (e.g. a preemption) arrive
+                        try:
+                            modified_function(resume_dir=resume_dir)
+                        except Exception:
+                            # the run is marked as failed, move on to the next one
+                            print(traceback.format_exc())
+                else:
+                    # A single run is performed
+                    return modified_function()
+            elif conf.rerun_id:
+                return modified_function()
+            elif conf.batch_size is not None:
+                if not sweep_backend.supports_claims:
+                    raise ValueError(
+                        f"The {conf.backend or 'wandb'} backend hands out configurations through its own agent, "
+                        "so they can not be evaluated in batches; use the local backend for batch_size.")
+                run_batches(sweep_backend, conf.sweep_id, function, conf.batch_size, count=conf.count,
+                            arrays=bool(conf.batch_arrays), checkpoint_dir=checkpoint_dir,
+                            entity=conf.entity, project=conf.project, record_timings=record_timings)
+            elif (conf.max_parallel_runs is not None and conf.max_parallel_runs > 1) or \
+                    conf.post_run_cleanup == 'subprocess':
+                # pack several runs onto this node, or just isolate every run,
+                # each in its own process
+                scheduler = NodeScheduler(max(1, conf.max_parallel_runs or 1), resources=conf.resources)
+                scheduler.run(functools.partial(run_single_configuration, conf, function),
+                              count=conf.count)
+            elif conf.isolation == 'forkserver':
+                started = 0
+                while conf.count is None or started < conf.count:
+                    started += 1
+                    if run_forked('agent') == EXIT_NO_CONFIGURATION:
                         break
+            elif conf.num_shards is not None:
+                # run a fixed slice of the sweep without asking the sweep server for configurations
+                if conf.shard_index is None:
+                    raise ValueError("shard_index should be given together with num_shards.")
+                shard = Shard(sweep_backend.load_sweep_config(conf.sweep_id, entity=conf.entity, project=conf.project),
+                              conf.sweep_id, conf.shard_index, conf.num_shards)
+                load_hierarchical_metadata(conf.sweep_id, entity=conf.entity,
+                                           project=conf.project, backend=sweep_backend)
+
+                def claim_from_shard():
+                    position = index.claim_shard_position(conf.shard_index, conf.num_shards,
+                                                          size=len(shard) if shard.method == 'grid' else None)
+                    return None if position is None else shard.config(position)
+
+                def execute_from_shard(prepared):
+                    ret = execute_prepared(prepared)
+                    index.shard_run_finished(conf.shard_index, conf.num_shards)
+                    return ret
+
+                run_prefetching_agent(functools.partial(prepare_run, claim=claim_from_shard),
+                                      execute_from_shard, count=conf.count, release=release_prepared)
+            elif conf.prefetch and sweep_backend.supports_claims:
+                # load the metadata that hierarchical_config needs, then overlap
+                # the preparation of every run with the execution of the previous one.
+                load_hierarchical_metadata(conf.sweep_id, entity=conf.entity,
+                                           project=conf.project, backend=sweep_backend)
+                run_prefetching_agent(prepare_run, execute_prepared, count=conf.count, release=release_prepared)
             else:
-                # A single run is performed
-                return modified_function()
-        elif conf.rerun_id:
-            return modified_function()
-        else:
-            agent(conf.sweep_id, function=functools.partial(modified_function, ran_from_sweep=True),
-                  entity=conf.entity, project=conf.project, count=conf.count)
+                if conf.prefetch:
+                    warnings.warn(
+                        f"The {conf.backend or 'wandb'} backend hands out configurations through its own agent, "
+                        "so the next run can not be prefetched; running the normal agent instead.")
+                agent(conf.sweep_id, function=functools.partial(modified_function, ran_from_sweep=True),
+                      entity=conf.entity, project=conf.project, count=conf.count, backend=sweep_backend)
+        finally:
+            preemption.uninstall()
+            if forkserver is not None:
+                forkserver.close()
+            # do not leave before the finished runs have reached their final location
+            finalizer.wait()
     else:
-        # check if conf.sweep_configuration complies to the
-        # standard sweep format or not.
-        all_keys = list(conf.sweep_configuration.keys())
-        if 'method' not in all_keys or 'metric' not in all_keys or 'parameters' not in all_keys or 'name' not in all_keys:
-            # enter defaults
-            conf.sweep_configuration = {
-                'name': conf.sweep_name,
-                'method': conf.method,
-                'metric': {
-                    'name': conf.metric,
-                    'goal': conf.goal,
-                },
-                'parameters': conf.sweep_configuration
-            }
+        conf.sweep_configuration = complete_sweep_configuration(conf)
 
         try:
             sweep_id = sweep(conf.base_config, conf.sweep_configuration,
-                             entity=conf.entity, project=conf.project)
+                             entity=conf.entity, project=conf.project, backend=sweep_backend)
         except Exception as e:
             print("Exception at creation of sweep:")
             print(traceback.format_exc())
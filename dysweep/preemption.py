@@ -0,0 +1,207 @@
+"""
+Handling of preemption. When the cluster preempts a job it sends SIGTERM and
+kills the job a little later; dysweep turns that signal into a request to save
+the state of the run right away, so that resuming it does not redo the work since
+the last periodic checkpoint.
+
+Inside of `function`, either poll the request in the training loop:
+
+```python
+for step in range(num_steps):
+    ...
+    if dysweep.preemption_requested():
+        with dysweep.atomic_write(os.path.join(checkpoint_dir, 'model.pt')) as f:
+            torch.save(model.state_dict(), f)
+        return
+```
+
+or register a callback that saves the state once the run has been stopped:
+
+```python
+dysweep.on_preemption(lambda: save_checkpoint(model, checkpoint_dir))
+```
+
+When callbacks are registered, `Preempted` is raised in the main thread as soon as the
+signal arrives, and the callbacks get at most `flush_timeout` seconds once the function
+has been unwound. Otherwise, the function has that long to notice the request and
+return before `Preempted` is raised. Either way, the run is left in the checkpoint
+directory to be resumed.
+"""
+import typing as th
+import contextlib
+import math
+import os
+import signal
+import threading
+import traceback
+import warnings
+from pathlib import Path
+
+_requested = threading.Event()
+_callbacks: th.List[th.Callable[[], th.Any]] = []
+_flush_timeout: float = 30.0
+# called once when the active run is preempted, e.g. to mark it as resumable
+_on_preempted: th.Optional[th.Callable[[], th.Any]] = None
+_installed = False
+_previous_handler = None
+_alarm_set = False
+_previous_alarm_handler = None
+_active = False
+# whether the active run has already been marked as preempted and flushed
+_handled = False
+
+
+class Preempted(SystemExit):
+    """Raised in the main thread when the run has been preempted and had its chance to flush."""
+
+    def __init__(self):
+        # the exit status of a process that was terminated by SIGTERM
+        super().__init__(128 + signal.SIGTERM)
+
+
+def preemption_requested() -> bool:
+    """Whether the run has been asked to save its state and stop."""
+    return _requested.is_set()
+
+
+def preemption_event() -> threading.Event:
+    """The event that is set when the run is preempted, e.g. for waiting on it in another thread."""
+    return _requested
+
+
+def on_preemption(callback: th.Callable[[], th.Any]):
+    """Call `callback()` (once) when the active run gets preempted."""
+    _callbacks.append(callback)
+
+
+@contextlib.contextmanager
+def atomic_write(path: th.Union[Path, str], mode: str = 'wb'):
+    """
+    Open a temporary file next to `path` for writing, and move it to `path` once it is
+    completely written and flushed to disk. A run that is killed while saving a checkpoint
+    therefore leaves the previous checkpoint intact instead of a truncated one.
+    """
+    path = Path(path)
+    tmp = path.parent / f".{path.name}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        with open(tmp, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def _raise_preempted(signum, frame):
+    raise Preempted()
+
+
+def _flush():
+    for callback in list(_callbacks):
+        try:
+            callback()
+        except Exception:
+            print("Exception in a preemption callback:")
+            print(traceback.format_exc())
+
+
+def _handle_signal(signum, frame):
+    # the handler interrupts arbitrary code (possibly holding the lock of the index or of
+    # a thread), so it only records the request; the run is marked as preempted and
+    # flushed by `handle_preempted`, where `Preempted` is caught.
+    global _alarm_set, _previous_alarm_handler
+    if _requested.is_set():
+        # the signal has been sent more than once
+        return
+    _requested.set()
+    if not _active or len(_callbacks) > 0:
+        # between two runs there is nothing to save
+        raise Preempted()
+    # give the function the time to notice the request, and stop it afterwards
+    _previous_alarm_handler = signal.signal(signal.SIGALRM, _raise_preempted)
+    signal.alarm(max(1, math.ceil(_flush_timeout)))
+    _alarm_set = True
+
+
+def _cancel_alarm():
+    global _alarm_set
+    if not _alarm_set:
+        return
+    # the alarm can be cancelled from any thread, its handler only from the main thread
+    signal.alarm(0)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGALRM, _previous_alarm_handler or signal.SIG_DFL)
+        _alarm_set = False
+
+
+def handle_preempted():
+    """
+    Mark the active run as preempted and give the callbacks `flush_timeout` seconds to
+    save its state. Called where `Preempted` is caught, once per run.
+    """
+    global _handled
+    if not _active or _handled:
+        return
+    _handled = True
+    _cancel_alarm()
+    if _on_preempted is not None:
+        try:
+            _on_preempted()
+        except Exception:
+            print(traceback.format_exc())
+    if len(_callbacks) > 0:
+        # run the callbacks in a thread so that a stuck callback does not hold the
+        # process past the time that the cluster gives it.
+        flusher = threading.Thread(target=_flush, daemon=True)
+        flusher.start()
+        flusher.join(timeout=_flush_timeout)
+        if flusher.is_alive():
+            warnings.warn(f"The preemption callbacks did not finish within {_flush_timeout} seconds.")
+
+
+def install(flush_timeout: float = 30.0) -> bool:
+    """
+    Handle SIGTERM as a preemption. Signal handlers can only be installed from the
+    main thread; returns whether the handler has been installed.
+    """
+    global _flush_timeout, _installed, _previous_handler
+    _flush_timeout = flush_timeout
+    if threading.current_thread() is not threading.main_thread():
+        warnings.warn("Preemption can only be handled when dysweep runs in the main thread.")
+        return False
+    if not _installed:
+        _previous_handler = signal.signal(signal.SIGTERM, _handle_signal)
+        _installed = True
+    return True
+
+
+def uninstall():
+    """Restore the handler of SIGTERM that was there before `install`."""
+    global _installed, _previous_handler
+    if not _installed or threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGTERM, _previous_handler if _previous_handler is not None else signal.SIG_DFL)
+    _previous_handler = None
+    _installed = False
+
+
+def begin_run(on_preempted: th.Optional[th.Callable[[], th.Any]] = None):
+    """Reset the preemption state for a new run."""
+    global _on_preempted, _active, _handled
+    # an alarm that has been armed for an earlier run must not stop this one
+    _cancel_alarm()
+    _requested.clear()
+    _callbacks.clear()
+    _on_preempted = on_preempted
+    _active = True
+    _handled = False
+
+
+def end_run():
+    global _on_preempted, _active
+    _callbacks.clear()
+    _on_preempted = None
+    _active = False
+    _cancel_alarm()
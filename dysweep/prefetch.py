@@ -0,0 +1,86 @@
+"""
+An asyncio-based agent loop that prepares the next run while the current one is
+executing. Preparing a run (claiming a configuration, decoding it into a hierarchical
+configuration, picking a run name, creating the checkpoint directory and dumping the
+configuration) is I/O-bound and happens in a background thread, so for sweeps made of
+many short runs the gap between two consecutive runs approaches zero.
+
+The runs themselves are executed one at a time on the calling thread, so that signal
+handlers and CUDA contexts behave the same as with the normal agent.
+"""
+import typing as th
+import asyncio
+import concurrent.futures
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass
+class PreparedRun:
+    """Everything that is needed to start a run without talking to the sweep server."""
+    run_id: str
+    run_name: str
+    # the (standard, compressed) configuration handed out by the sweep
+    raw_config: dict
+    # the hierarchical configuration that is passed to the function
+    sweep_config: dict
+    checkpoint_dir: Path
+    # how long each step of the preparation took, in seconds
+    timings: th.Optional[th.Dict[str, float]] = None
+
+
+async def _agent_loop(
+    prepare: th.Callable[[], th.Optional[PreparedRun]],
+    execute: th.Callable[[PreparedRun], th.Any],
+    count: th.Optional[int],
+    release: th.Optional[th.Callable[[PreparedRun], th.Any]] = None,
+):
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        next_run = loop.run_in_executor(executor, prepare)
+        ran = 0
+        try:
+            while next_run is not None:
+                pending, next_run = next_run, None
+                prepared = await pending
+                if prepared is None:
+                    # the sweep has no configurations left
+                    break
+                ran += 1
+                # start preparing the next run before executing the current one
+                if count is None or ran < count:
+                    next_run = loop.run_in_executor(executor, prepare)
+                try:
+                    execute(prepared)
+                except Exception:
+                    # same as the W&B agent: report the failure and go on with the next run
+                    print(traceback.format_exc())
+                # give the event loop a chance to collect the finished preparation
+                await asyncio.sleep(0)
+        finally:
+            # the loop has stopped (preempted, or an exception) while the next run was
+            # being prepared: its configuration is claimed, so hand it back
+            if next_run is not None:
+                try:
+                    prepared = await next_run
+                except Exception:
+                    print(traceback.format_exc())
+                    prepared = None
+                if prepared is not None and release is not None:
+                    release(prepared)
+
+
+def run_prefetching_agent(
+    prepare: th.Callable[[], th.Optional[PreparedRun]],
+    execute: th.Callable[[PreparedRun], th.Any],
+    count: th.Optional[int] = None,
+    release: th.Optional[th.Callable[[PreparedRun], th.Any]] = None,
+):
+    """
+    Run at most `count` runs (or until `prepare` returns None). While `execute` is
+    running on a prepared run, the next run is being prepared in the background.
+    If the loop stops before a prepared run could be executed, that run is passed
+    to `release`.
+    """
+    asyncio.run(_agent_loop(prepare, execute, count, release))
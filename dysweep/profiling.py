@@ -0,0 +1,156 @@
+"""
+Timing of the phases of every run (fetching the configuration, initializing the
+run, preparing its directory, the function itself, finalization, ...) and its peak
+memory, so that it is clear what limits the throughput of a sweep.
+
+Every attempt of a run appends one line to `<checkpoint_dir>/<run_id>-timings.jsonl`
+(next to `<run_id>-config.json`, so that it survives the finalization of the run
+directory). `dysweep_report` aggregates these files over a whole checkpoint root.
+"""
+import typing as th
+import contextlib
+import json
+import os
+import socket
+import time
+from pathlib import Path
+
+TIMINGS_SUFFIX = "-timings.jsonl"
+
+# phases that happen outside of a run (e.g. loading the metadata of the sweep when
+# the agent starts); they are attributed to the next run of this process.
+_pending: th.Dict[str, float] = {}
+
+
+def add_pending(phase: str, seconds: float):
+    _pending[phase] = _pending.get(phase, 0.0) + seconds
+
+
+def reset_peak_rss():
+    """Reset the peak memory of this process (Linux only), so that it can be measured per run."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> th.Optional[float]:
+    """
+    The peak resident memory of this process in MB, since the last `reset_peak_rss`
+    where it is supported and since the process has started otherwise.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # in bytes on macOS, in KB elsewhere
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+    except (ImportError, OSError):
+        return None
+
+
+class RunTimer:
+    """
+    Collects the durations of the phases of a run. `lap(name)` attributes the time
+    since the previous lap to the phase `name`; `phase(name)` times a block.
+
+    A `background` timer (e.g. for preparing a run in another thread) does not take
+    over the pending phases of the process and does not reset its peak memory.
+    """
+
+    def __init__(self, phases: th.Optional[th.Dict[str, float]] = None, background: bool = False):
+        self.started = time.time()
+        self.phases: th.Dict[str, float] = {}
+        if not background:
+            self.phases.update(_pending)
+            _pending.clear()
+            reset_peak_rss()
+        for name, seconds in (phases or {}).items():
+            self.add(name, seconds)
+        self._last = time.perf_counter()
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def lap(self, name: str):
+        now = time.perf_counter()
+        self.add(name, now - self._last)
+        self._last = now
+
+    def skip(self):
+        """Do not attribute the time since the previous lap to any phase."""
+        self._last = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._last = time.perf_counter()
+            self.add(name, self._last - start)
+
+    def record(self, run_id: str, run_name: th.Optional[str], status: str, **extra) -> dict:
+        return {
+            'run_id': run_id,
+            'run_name': run_name,
+            'status': status,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'start': self.started,
+            'end': time.time(),
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'peak_rss_mb': peak_rss_mb(),
+            **extra,
+        }
+
+
+def write_timings(checkpoint_dir: th.Union[Path, str], record: dict):
+    """Append the timings of an attempt of a run to its timings file."""
+    path = Path(checkpoint_dir) / f"{record['run_id']}{TIMINGS_SUFFIX}"
+    # a single write of a short line in append mode, so concurrent writers do not interleave
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+
+@contextlib.contextmanager
+def profile_function(kind: th.Optional[str], out_dir: th.Union[Path, str]):
+    """
+    Profile the block with cProfile (`kind='cprofile'`, saved as `profile.prof`) or
+    pyinstrument (`kind='pyinstrument'`, saved as `profile.html`) into `out_dir`.
+    """
+    if kind is None:
+        yield
+        return
+    if kind == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(out_dir, 'profile.prof'))
+    elif kind == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("pyinstrument should be installed for profiling with it: pip install pyinstrument")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(os.path.join(out_dir, 'profile.html'), 'w') as f:
+                f.write(profiler.output_html())
+    else:
+        raise ValueError(f"Unknown profiler {kind}, it should be either `cprofile` or `pyinstrument`.")
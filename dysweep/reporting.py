@@ -0,0 +1,123 @@
+"""
+Reporting of intermediate results from inside of `function`. What a run reports is
+kept in the checkpoint index, where the resume queue (and other policies) can use it:
+
+```python
+for epoch in range(num_epochs):
+    ...
+    dysweep.report(metric=val_loss, progress=(epoch + 1) / num_epochs)
+```
+
+With early stopping (check `early_stopping`), the run also reports the budget that it
+has used, and stops when `should_stop()` says so.
+"""
+import typing as th
+import time
+from .index import CheckpointIndex
+from .early_stopping import EarlyStoppingPolicy, bracket_of, rung_of, should_continue
+
+# the index and identifier of the run that is active in this process
+_active: th.Optional[th.Tuple[CheckpointIndex, str]] = None
+# reports are written to the index at most this often (in seconds), the last one is
+# always written when the run ends.
+_min_interval = 5.0
+_pending: th.Dict[str, float] = {}
+_last_write = 0.0
+# the early stopping of the active run: the policy, the bracket of the run, and the
+# last rung that has been decided
+_early_stopping: th.Optional[EarlyStoppingPolicy] = None
+_bracket = 0
+_rung = -1
+_stop = False
+# the budget that the active run may use, when the runs are paused and promoted
+_budget: th.Optional[float] = None
+_last_metric: th.Optional[float] = None
+
+
+def _write():
+    global _last_write
+    if _active is not None and len(_pending) > 0:
+        index, run_id = _active
+        index.run_reported(run_id, metric=_pending.get('metric'), progress=_pending.get('progress'))
+    _pending.clear()
+    _last_write = time.time()
+
+
+def _check_rungs(metric: float, budget: float):
+    global _rung, _stop
+    rung = rung_of(budget, _early_stopping, _bracket)
+    if rung is None or rung <= _rung:
+        return
+    index, run_id = _active
+    # a report can jump past several rungs, the run is compared at every one of them
+    for crossed in range(_rung + 1, rung + 1):
+        _rung = crossed
+        if not should_continue(index, _early_stopping, run_id, _bracket, crossed, metric):
+            print(f"The run is among the worst at budget {budget} (rung {crossed}), it should stop.")
+            _stop = True
+            return
+
+
+def report(metric: th.Optional[float] = None, progress: th.Optional[float] = None,
+           budget: th.Optional[float] = None):
+    """
+    Report the last value of the metric of the run and/or its progress (a fraction
+    between 0 and 1), and the budget that the run has used so far for early stopping
+    (the progress is used when it is not given). Outside of a dysweep run, this does nothing.
+    """
+    global _last_metric
+    if _active is None:
+        return
+    if metric is not None:
+        _pending['metric'] = _last_metric = float(metric)
+    if progress is not None:
+        _pending['progress'] = min(1.0, max(0.0, float(progress)))
+    if _early_stopping is not None and not _early_stopping.pause and metric is not None and not _stop:
+        budget = budget if budget is not None else progress
+        if budget is not None:
+            _check_rungs(float(metric), float(budget))
+    if time.time() - _last_write >= _min_interval:
+        _write()
+
+
+def should_stop() -> bool:
+    """Whether the early stopping has decided that the run is not worth going on with."""
+    return _stop
+
+
+def budget() -> th.Optional[float]:
+    """
+    The budget up to which the run should go before returning, when the runs are paused
+    and promoted (check `early_stopping`); None otherwise.
+    """
+    return _budget
+
+
+def set_budget(value: th.Optional[float]):
+    global _budget
+    _budget = value
+
+
+def last_metric() -> th.Optional[float]:
+    """The last metric that the active run has reported."""
+    return _last_metric
+
+
+def begin_run(index: CheckpointIndex, run_id: str, early_stopping: th.Optional[EarlyStoppingPolicy] = None,
+              budget: th.Optional[float] = None):
+    global _active, _last_write, _early_stopping, _bracket, _rung, _stop, _budget, _last_metric
+    _active = (index, run_id)
+    _pending.clear()
+    _last_write = 0.0
+    _early_stopping = early_stopping
+    _bracket = bracket_of(run_id, early_stopping) if early_stopping is not None else 0
+    _rung = -1
+    _stop = False
+    _budget = budget
+    _last_metric = None
+
+
+def end_run():
+    global _active
+    _write()
+    _active = None
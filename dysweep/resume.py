@@ -0,0 +1,138 @@
+"""
+The queue of runs to resume. With `resume=True` (and no `rerun_id`), the runs that
+are left in the checkpoint directory are resumed by priority instead of in the
+order in which their directories were created, so a run that keeps crashing does
+not hold back the runs that are likely to finish.
+
+The priority of a run is computed from what the checkpoint index knows about it:
+how many times it has failed, the progress and metric that it has last reported
+(check `dysweep.report`), and when it failed last. Runs that have failed repeatedly
+are held back with an exponential backoff. The queue itself lives in the index on
+disk, so all the agents that share the checkpoint directory see the same queue, and
+a run is claimed atomically by exactly one of them.
+
+The policy is given as the `resume_policy` field of `ResumableSweepConfig`, e.g.
+
+```yaml
+resume_policy:
+  retry_penalty: 1.0
+  backoff_base: 300
+  max_retries: 5
+```
+
+A custom priority can be given as a dypy callable (the same way as `run_name_changer`)
+that takes the dictionary of a run (check `resume_candidates`) and returns a number;
+runs with a higher priority are resumed first.
+"""
+import typing as th
+import math
+import socket
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from .index import CheckpointIndex
+from .finalize import _pid_alive
+
+# the separator of the run directories, the same as in `parallel`
+SPLIT = '_-_-_-_'
+
+
+@dataclass
+class ResumePolicy:
+    # the weight of the last reported progress (a fraction in [0, 1])
+    progress_weight: float = 1.0
+    # the weight of the rank of the last reported metric among the runs (1 for the best)
+    metric_weight: float = 1.0
+    # subtracted from the priority for every time the run has failed
+    retry_penalty: float = 0.5
+    # a run that has failed n > 1 times is not resumed for backoff_base * 2^(n-2) seconds
+    # after its last failure (a run that has failed once can be resumed right away)
+    backoff_base: float = 60.0
+    backoff_max: float = 3600.0
+    # runs that have failed more than this many times are not resumed anymore
+    max_retries: th.Optional[int] = None
+    goal: th.Optional[str] = None
+    # a callable that takes the dictionary of a run and returns its priority
+    priority: th.Optional[th.Callable[[dict], float]] = None
+
+
+def default_priority(run: dict, policy: ResumePolicy) -> float:
+    return policy.progress_weight * (run['progress'] or 0.0) + \
+        policy.metric_weight * (run['metric_rank'] or 0.0) - \
+        policy.retry_penalty * (run['retries'] or 0)
+
+
+def backoff(run: dict, policy: ResumePolicy) -> float:
+    """The number of seconds that the run has to wait after its last failure."""
+    if run['retries'] < 2 or run['last_failure'] is None:
+        return 0.0
+    return min(policy.backoff_max, policy.backoff_base * 2 ** (run['retries'] - 2))
+
+
+def resume_candidates(index: CheckpointIndex, subdirs: th.List[Path], policy: ResumePolicy,
+                      now: th.Optional[float] = None) -> th.List[dict]:
+    """
+    The runs of `subdirs` (the run directories of the checkpoint directory) that can be
+    resumed right now, highest priority first. Every run is a dictionary with its `id`,
+    `dir`, `order` (the prefix of its directory), `state`, `retries`, `progress`,
+    `metric`, `metric_rank`, `last_failure`, `started`, `elsewhere` and `priority`.
+    """
+    now = time.time() if now is None else now
+    host = socket.gethostname()
+    by_id = {SPLIT.join(d.name.split(SPLIT)[1:]): d for d in subdirs}
+    rows = index.unfinished_runs(list(by_id.keys()))
+    runs = []
+    for run_id, run_dir in by_id.items():
+        row = rows.get(run_id, {})
+        run = {
+            'id': run_id,
+            'dir': run_dir,
+            'order': int(run_dir.name.split(SPLIT)[0]),
+            'state': row.get('state'),
+            'retries': row.get('retries') or 0,
+            'progress': row.get('progress'),
+            'metric': row.get('metric'),
+            'metric_rank': None,
+            'last_failure': row.get('last_failure'),
+            'started': row.get('started'),
+            # whether an agent on another node may still be running it
+            'elsewhere': row.get('state') == 'running' and row.get('host') != host,
+        }
+        if run['state'] == 'running' and row.get('host') == host and _pid_alive(row['pid']):
+            # an agent on this node is running it right now
+            continue
+        if run['state'] == 'paused':
+            # it waits for its promotion (check `early_stopping`)
+            continue
+        if policy.max_retries is not None and run['retries'] > policy.max_retries:
+            continue
+        if run['last_failure'] is not None and now < run['last_failure'] + backoff(run, policy):
+            continue
+        runs.append(run)
+
+    # rank the metrics, so that they are comparable with the other terms of the priority
+    with_metric = [run for run in runs if run['metric'] is not None and not math.isnan(run['metric'])]
+    with_metric.sort(key=lambda run: run['metric'], reverse=policy.goal == 'maximize')
+    for i, run in enumerate(with_metric):
+        # 1 for the best run, 0 for the worst one
+        run['metric_rank'] = 1.0 - i / max(1, len(with_metric) - 1) if len(with_metric) > 1 else 1.0
+
+    for run in runs:
+        run['priority'] = float(policy.priority(run) if policy.priority is not None
+                                else default_priority(run, policy))
+    # the runs that may be running elsewhere go last (there is no way to tell whether
+    # their agent is still alive), and ties are broken by the order of the queue
+    runs.sort(key=lambda run: (run['elsewhere'], -run['priority'], run['order']))
+    return runs
+
+
+def pick_resumable(index: CheckpointIndex, subdirs: th.List[Path],
+                   policy: ResumePolicy) -> th.Optional[Path]:
+    """
+    Claim the run with the highest priority and return its directory, or None if no run
+    can be resumed right now.
+    """
+    for run in resume_candidates(index, subdirs, policy):
+        if index.claim_resume(run['id'], run['started'], run['dir']):
+            return run['dir']
+    return None
@@ -0,0 +1,124 @@
+"""
+Retention of the checkpoints of finished runs. Without it, the checkpoint directory
+of a long sweep keeps one `*_final` directory per run forever; with it, the
+checkpoints of the runs that are not worth keeping are deleted as the sweep goes.
+
+The policy is given as the `retention` field of `ResumableSweepConfig`, e.g.
+
+```yaml
+retention:
+  keep_top_k: 5          # the 5 best runs according to the metric
+  keep_last_n: 2         # and the 2 most recent ones
+  max_total_bytes: 200000000000
+  max_age: 604800        # in seconds
+```
+
+The policy is applied after every run that finishes, using the `CheckpointIndex`
+of the checkpoint directory rather than walking the directory. Only the checkpoint
+directories are deleted; the `<run_id>-config.json` files are kept (they are tiny),
+so that any run can still be re-run using `rerun_id`.
+"""
+import typing as th
+import math
+import time
+import warnings
+from dataclasses import dataclass
+from .index import CheckpointIndex
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Which checkpoints of finished runs to keep. When `keep_top_k` or `keep_last_n`
+    is set, the checkpoints of every other run are deleted; the runs that they
+    keep are never deleted by `max_age` or `max_total_bytes` either.
+    """
+    # keep the checkpoints of the k best runs according to `metric`
+    keep_top_k: th.Optional[int] = None
+    # keep the checkpoints of the n runs that have finished last
+    keep_last_n: th.Optional[int] = None
+    # delete the oldest checkpoints until all of them fit in this many bytes
+    max_total_bytes: th.Optional[int] = None
+    # delete the checkpoints of runs that have finished more than this many seconds ago
+    max_age: th.Optional[float] = None
+    # the metric that ranks the runs for `keep_top_k`, defaults to the metric of the sweep
+    metric: th.Optional[str] = None
+    goal: th.Optional[str] = None
+
+
+def run_metric(summary: th.Optional[dict], returned: th.Any, metric: th.Optional[str]) -> th.Optional[float]:
+    """
+    The metric of a finished run: the value of `metric` in the summary of the run on
+    the backend, or else in what the function has returned (either the metric itself,
+    or a dictionary that contains it).
+    """
+    if summary is not None and metric in summary:
+        value = summary[metric]
+    elif isinstance(returned, dict):
+        value = returned.get(metric)
+    else:
+        value = returned
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def select_for_deletion(runs: th.List[dict], policy: RetentionPolicy,
+                        now: th.Optional[float] = None) -> th.List[dict]:
+    """
+    Returns the runs (as given by `CheckpointIndex.finished_runs`, oldest first)
+    whose checkpoints should be deleted according to `policy`.
+    """
+    now = time.time() if now is None else now
+    protected = set()
+    if policy.keep_last_n:
+        protected.update(run['id'] for run in runs[-policy.keep_last_n:])
+    if policy.keep_top_k:
+        sign = -1 if policy.goal == 'maximize' else 1
+        # runs without a metric are ranked last
+        ranked = sorted(
+            runs,
+            key=lambda run: sign * run['metric'] if run['metric'] is not None and
+            not math.isnan(run['metric']) else math.inf)
+        protected.update(run['id'] for run in ranked[:policy.keep_top_k])
+
+    candidates = [run for run in runs if run['id'] not in protected]
+    if policy.keep_top_k is not None or policy.keep_last_n is not None:
+        return candidates
+
+    delete = []
+    if policy.max_age is not None:
+        delete = [run for run in candidates
+                  if run['finished'] is not None and now - run['finished'] > policy.max_age]
+    if policy.max_total_bytes is not None:
+        total = sum(run['bytes'] or 0 for run in runs) - sum(run['bytes'] or 0 for run in delete)
+        for run in candidates:
+            if total <= policy.max_total_bytes:
+                break
+            if run in delete:
+                continue
+            delete.append(run)
+            total -= run['bytes'] or 0
+        if total > policy.max_total_bytes:
+            warnings.warn(
+                f"The checkpoints that the retention policy keeps take {total} bytes, "
+                f"more than max_total_bytes={policy.max_total_bytes}.")
+    return delete
+
+
+def apply_retention(index: CheckpointIndex, policy: RetentionPolicy,
+                    delete: th.Callable[[str], th.Any]) -> th.List[str]:
+    """
+    Delete the checkpoints of the runs that `policy` does not keep by calling
+    `delete(path)` on their directories; returns the identifiers of these runs.
+    """
+    runs = index.finished_runs()
+    claimed = index.claim_deletion([run['id'] for run in select_for_deletion(runs, policy)])
+    for run in claimed:
+        if run['path'] is not None:
+            try:
+                delete(run['path'])
+            except FileNotFoundError:
+                # the directory has already been removed by hand
+                pass
+    return [run['id'] for run in claimed]
@@ -0,0 +1,235 @@
+"""
+A local scheduler that packs several runs of a sweep onto one machine. Every run
+is executed in its own process; once a run has received its configuration, it
+reserves the resources it needs (CPU cores, RAM in GB, or any other user-declared
+resource) from the node and waits until they are available. New runs are started
+whenever resources free up, so small configurations no longer leave most of a big
+node idle.
+
+The cost of a run is computed from its hierarchical configuration using a callable
+(a dypy expression, the same way as `run_name_changer`) that returns a dictionary of
+resource amounts, e.g.
+
+```yaml
+run_cost:
+  expression: |
+    def cost(config):
+        return {'cpus': config['data']['num_workers'] + 1, 'memory': 4}
+  function_of_interest: cost
+```
+"""
+import typing as th
+import copy
+import functools
+import multiprocessing
+import os
+import sys
+import warnings
+
+# the exit code of a run process that did not get any configuration from the sweep
+EXIT_NO_CONFIGURATION = 3
+
+# the gate of the scheduler that has started this process (if any), and the slot of the process
+_gate: th.Optional["ResourceGate"] = None
+_slot: th.Optional[int] = None
+
+
+def node_resources() -> th.Dict[str, float]:
+    """The default resources of the node: all the CPU cores and all the RAM (in GB)."""
+    resources = {'cpus': float(os.cpu_count() or 1)}
+    try:
+        resources['memory'] = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2 ** 30
+    except (ValueError, OSError, AttributeError):
+        pass
+    return resources
+
+
+class ResourceGate:
+    """
+    Book-keeping of the resources of the node that is shared between the scheduler
+    and the run processes that it forks. Every process has a slot where its reservation
+    (and whether it is waiting for one) is recorded, so that the scheduler can give the
+    resources back when a process dies without releasing them (killed, OOM, segfault).
+    """
+
+    def __init__(self, resources: th.Dict[str, float], ctx, slots: int = 1):
+        self.names = sorted(resources.keys())
+        self.capacity = [float(resources[name]) for name in self.names]
+        self.used = ctx.Array('d', len(self.names))
+        self.waiting = ctx.Value('i', 0)
+        self.condition = ctx.Condition()
+        self.slots = slots
+        self.slot_used = ctx.Array('d', slots * len(self.names))
+        self.slot_waiting = ctx.Array('i', slots)
+
+    def _vector(self, cost: th.Dict[str, float]) -> th.List[float]:
+        unknown = [name for name in cost.keys() if name not in self.names]
+        if len(unknown) > 0:
+            raise ValueError(f"The run cost uses resources {unknown} that the node does not declare.")
+        vector = []
+        for name, capacity in zip(self.names, self.capacity):
+            amount = float(cost.get(name, 0.0))
+            if amount > capacity:
+                warnings.warn(
+                    f"A run needs {amount} of {name} but the node only has {capacity}; "
+                    "it will run alone.")
+                amount = capacity
+            vector.append(amount)
+        return vector
+
+    def _fits(self, vector: th.List[float]) -> bool:
+        return all(used + amount <= capacity + 1e-9
+                   for used, amount, capacity in zip(self.used, vector, self.capacity))
+
+    def has_free_capacity(self) -> bool:
+        return any(used < capacity for used, capacity in zip(self.used, self.capacity))
+
+    def reserve(self, cost: th.Dict[str, float], slot: th.Optional[int] = None) -> th.List[float]:
+        """Block until the resources in `cost` are available and take them."""
+        vector = self._vector(cost)
+        offset = None if slot is None else slot * len(self.names)
+        with self.condition:
+            self.waiting.value += 1
+            if slot is not None:
+                self.slot_waiting[slot] = 1
+            self.condition.wait_for(lambda: self._fits(vector))
+            self.waiting.value -= 1
+            if slot is not None:
+                self.slot_waiting[slot] = 0
+            for i, amount in enumerate(vector):
+                self.used[i] += amount
+                if offset is not None:
+                    self.slot_used[offset + i] += amount
+        return vector
+
+    def release(self, vector: th.List[float], slot: th.Optional[int] = None):
+        offset = None if slot is None else slot * len(self.names)
+        with self.condition:
+            for i, amount in enumerate(vector):
+                self.used[i] -= amount
+                if offset is not None:
+                    self.slot_used[offset + i] -= amount
+            self.condition.notify_all()
+
+    def release_slot(self, slot: int):
+        """Give back whatever the (dead) process of the slot still holds, and clear the slot."""
+        offset = slot * len(self.names)
+        with self.condition:
+            if self.slot_waiting[slot]:
+                self.waiting.value -= 1
+                self.slot_waiting[slot] = 0
+            for i in range(len(self.names)):
+                self.used[i] = max(0.0, self.used[i] - self.slot_used[offset + i])
+                self.slot_used[offset + i] = 0.0
+            self.condition.notify_all()
+
+
+def reserve_resources(cost_function: th.Optional[th.Callable], sweep_config: dict) -> th.Optional[th.List[float]]:
+    """
+    Called by a run once its configuration is known; a no-op when the process
+    has not been started by a `NodeScheduler`.
+    """
+    if _gate is None:
+        return None
+    cost = cost_function(sweep_config) if cost_function is not None else {'cpus': 1}
+    if not isinstance(cost, dict):
+        # a single number is the number of CPU cores
+        cost = {'cpus': cost}
+    return _gate.reserve(cost, _slot)
+
+
+def release_resources(reservation: th.Optional[th.List[float]]):
+    if _gate is not None and reservation is not None:
+        _gate.release(reservation, _slot)
+
+
+def _run_process(gate: ResourceGate, slot: int, target: th.Callable[[], int]):
+    global _gate, _slot
+    _gate = gate
+    _slot = slot
+    sys.exit(target())
+
+
+class NodeScheduler:
+    """
+    Runs up to `max_parallel_runs` runs at the same time, each in its own (forked)
+    process, as long as the node has free resources.
+    """
+
+    def __init__(self, max_parallel_runs: int, resources: th.Optional[th.Dict[str, float]] = None,
+                 poll_interval: float = 1.0):
+        self.ctx = multiprocessing.get_context('fork')
+        self.max_parallel_runs = max_parallel_runs
+        self.gate = ResourceGate(resources if resources is not None else node_resources(), self.ctx,
+                                 slots=max(1, max_parallel_runs))
+        self.poll_interval = poll_interval
+
+    def run(self, target: th.Callable[[], int], count: th.Optional[int] = None) -> int:
+        """
+        Keep starting processes that call `target` (which runs a single configuration
+        and returns 0, or EXIT_NO_CONFIGURATION if the sweep had nothing to hand out)
+        until `count` processes have been started or the sweep is exhausted.
+
+        Returns the number of runs that have finished successfully.
+        """
+        running = []
+        # the slot of the gate of every running process
+        slots = {}
+        started, succeeded = 0, 0
+        exhausted = False
+        while True:
+            for process in [p for p in running if not p.is_alive()]:
+                process.join()
+                running.remove(process)
+                slot = slots.pop(process.pid)
+                if process.exitcode != 0:
+                    # the process may have died without releasing its resources
+                    self.gate.release_slot(slot)
+                if process.exitcode == 0:
+                    succeeded += 1
+                elif process.exitcode == EXIT_NO_CONFIGURATION:
+                    exhausted = True
+
+            can_start = not exhausted and (count is None or started < count)
+            if not can_start and len(running) == 0:
+                break
+            # only start a new run when no other run is still waiting for
+            # resources, otherwise we would keep fetching configurations that
+            # can not run yet.
+            if can_start and len(running) < self.max_parallel_runs and \
+                    self.gate.waiting.value == 0 and self.gate.has_free_capacity():
+                slot = min(set(range(self.gate.slots)) - set(slots.values()))
+                process = self.ctx.Process(target=_run_process, args=(self.gate, slot, target))
+                process.start()
+                slots[process.pid] = slot
+                running.append(process)
+                started += 1
+                continue
+            with self.gate.condition:
+                self.gate.condition.wait(timeout=self.poll_interval)
+        return succeeded
+
+
+def run_single_configuration(conf, function: th.Callable) -> int:
+    """
+    The target of the run processes: runs the agent for exactly one configuration and
+    tells the scheduler whether the sweep had a configuration to hand out.
+    """
+    from .parallel import dysweep_run_resume
+
+    ran = 0
+
+    @functools.wraps(function)
+    def counted_function(*args, **kwargs):
+        nonlocal ran
+        ran += 1
+        return function(*args, **kwargs)
+
+    run_conf = copy.copy(conf)
+    run_conf.count = 1
+    run_conf.max_parallel_runs = None
+    if run_conf.post_run_cleanup == 'subprocess':
+        # the process exits right after the run, which frees everything
+        run_conf.post_run_cleanup = 'none'
+    dysweep_run_resume(run_conf, counted_function)
+    return 0 if ran > 0 else EXIT_NO_CONFIGURATION
@@ -0,0 +1,168 @@
+"""
+Serialization of configurations, for everything that dysweep writes to disk or to the
+local backend. The configurations of big sweeps are large documents that are dumped and
+loaded for every single run, so the fastest JSON library that is installed is used:
+
+- `orjson` (pip install orjson),
+- `msgspec` (pip install msgspec),
+- the `json` module of the standard library otherwise.
+
+All of them write the same JSON, indented with 4 spaces and with non-ASCII characters
+as they are (up to the notation of some floats, e.g. 1e-05 and 0.00001, and NaN, which
+the fast ones write as null), and read what the others have written, so the serializer
+can change from one agent to the other. `set_serializer` forces one of them. For compact
+binary files, `packb` and `unpackb` use MessagePack (through msgspec or msgpack).
+"""
+import typing as th
+import json
+import re
+from pathlib import Path
+
+SERIALIZERS = ['orjson', 'msgspec', 'json']
+
+_serializer: th.Optional[str] = None
+
+# the indentation at the start of every line; JSON strings can not hold a raw newline
+_LEADING_SPACES = re.compile(rb'^( +)', re.MULTILINE)
+
+
+def _available(name: str) -> bool:
+    if name == 'json':
+        return True
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+
+def available_serializers() -> th.List[str]:
+    """The serializers that can be used here, the fastest first."""
+    return [name for name in SERIALIZERS if _available(name)]
+
+
+def set_serializer(name: th.Optional[str] = None):
+    """Use the serializer `name`, or the fastest one that is installed if it is None."""
+    global _serializer
+    if name is not None and name not in SERIALIZERS:
+        raise ValueError(f"Unknown serializer {name}, it should be one of {SERIALIZERS}.")
+    if name is not None and not _available(name):
+        raise ImportError(f"{name} should be installed for this serializer: pip install {name}")
+    _serializer = name
+
+
+def serializer() -> str:
+    """The name of the serializer in use."""
+    global _serializer
+    if _serializer is None:
+        _serializer = available_serializers()[0]
+    return _serializer
+
+
+def _dumps_json(obj, pretty: bool, sort_keys: bool, default: th.Optional[th.Callable]) -> bytes:
+    if pretty:
+        text = json.dumps(obj, indent=4, sort_keys=sort_keys, default=default, ensure_ascii=False)
+    else:
+        text = json.dumps(obj, separators=(',', ':'), sort_keys=sort_keys, default=default, ensure_ascii=False)
+    return text.encode('utf-8')
+
+
+def _indent_4(data: bytes) -> bytes:
+    """Turn the 2-space indentation of orjson into the 4 spaces of the other serializers."""
+    return _LEADING_SPACES.sub(lambda match: match.group(1) * 2, data)
+
+
+def dumps(obj, pretty: bool = False, sort_keys: bool = False,
+          default: th.Optional[th.Callable] = None) -> bytes:
+    """
+    Serialize `obj` into JSON bytes, indented if `pretty`. `default` is called on the
+    objects that can not be serialized otherwise, as with `json.dumps`.
+    """
+    name = serializer()
+    if name == 'orjson':
+        import orjson
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            data = orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            # e.g. integers that do not fit into 64 bits, which the standard library handles
+            return _dumps_json(obj, pretty, sort_keys, default)
+        return _indent_4(data) if pretty else data
+    if name == 'msgspec':
+        import msgspec
+        try:
+            data = msgspec.json.encode(obj, enc_hook=default, order='sorted' if sort_keys else None)
+        except (TypeError, OverflowError, msgspec.EncodeError):
+            return _dumps_json(obj, pretty, sort_keys, default)
+        return msgspec.json.format(data, indent=4) if pretty else data
+    return _dumps_json(obj, pretty, sort_keys, default)
+
+
+def loads(data: th.Union[bytes, str]):
+    """Deserialize JSON, written by any of the serializers."""
+    name = serializer()
+    # on failure, e.g. NaN and Infinity which only the standard library reads, fall back to it
+    if name == 'orjson':
+        import orjson
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    elif name == 'msgspec':
+        import msgspec
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError:
+            pass
+    return json.loads(data)
+
+
+def dump(obj, path: th.Union[Path, str], pretty: bool = False, sort_keys: bool = False,
+         default: th.Optional[th.Callable] = None):
+    """Serialize `obj` into the file `path`."""
+    with open(path, 'wb') as f:
+        f.write(dumps(obj, pretty=pretty, sort_keys=sort_keys, default=default))
+
+
+def load(path: th.Union[Path, str]):
+    """Deserialize the JSON file `path`."""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def _msgpack():
+    try:
+        import msgspec
+        return msgspec.msgpack.encode, msgspec.msgpack.decode
+    except ImportError:
+        pass
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return (lambda obj: msgpack.packb(obj, use_bin_type=True),
+            lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False))
+
+
+def has_msgpack() -> bool:
+    return _msgpack() is not None
+
+
+def packb(obj) -> bytes:
+    """Serialize `obj` into MessagePack, a compact binary format."""
+    codec = _msgpack()
+    if codec is None:
+        raise ImportError("msgspec or msgpack should be installed for binary serialization: pip install msgspec")
+    return codec[0](obj)
+
+
+def unpackb(data: th.Union[bytes, memoryview]):
+    """Deserialize MessagePack, written by `packb`."""
+    codec = _msgpack()
+    if codec is None:
+        raise ImportError("msgspec or msgpack should be installed for binary serialization: pip install msgspec")
+    return codec[1](data)
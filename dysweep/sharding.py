@@ -0,0 +1,55 @@
+"""
+Static sharding of a sweep: instead of pulling configurations from the sweep server
+one at a time, every agent is given a `shard_index` out of `num_shards` (e.g. the
+index of the task in a job array) and runs its own deterministic slice of the sweep,
+without talking to the server at all.
+
+A grid sweep is split into `num_shards` contiguous ranges of grid indices (check
+`GridIndex`); a random sweep is split into interleaved streams of seeded samples, the
+shard `k` taking the samples `k, k + num_shards, k + 2 * num_shards, ...`. The
+position of every shard is kept in the checkpoint index, so a shard that is started
+again continues where it stopped, and several agents can share a shard.
+"""
+import typing as th
+import random
+import zlib
+from .grid import GridIndex
+
+
+def shard_range(size: int, shard_index: int, num_shards: int) -> th.Tuple[int, int]:
+    """The range [start, stop) of the items of shard `shard_index`, the shards differ by at most one item."""
+    return size * shard_index // num_shards, size * (shard_index + 1) // num_shards
+
+
+class Shard:
+    """The configurations of the shard `shard_index` of a (standardized) sweep, by position."""
+
+    def __init__(self, sweep_standard: dict, sweep_id: str, shard_index: int, num_shards: int):
+        if num_shards < 1 or not 0 <= shard_index < num_shards:
+            raise ValueError(f"shard_index should be in [0, num_shards), got {shard_index} out of {num_shards}.")
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.method = sweep_standard.get('method') or 'grid'
+        self.parameters = sweep_standard.get('parameters', {})
+        if self.method == 'grid':
+            self.grid = GridIndex(self.parameters)
+            self.start, self.stop = shard_range(self.grid.size, shard_index, num_shards)
+        elif self.method == 'random':
+            # the same samples for every agent of the sweep
+            self.seed = zlib.crc32(sweep_id.encode('utf-8'))
+        else:
+            raise ValueError(f"Only grid and random sweeps can be sharded, got {self.method}.")
+
+    def __len__(self) -> int:
+        if self.method != 'grid':
+            raise TypeError("A shard of a random sweep has no end.")
+        return self.stop - self.start
+
+    def config(self, position: int) -> th.Optional[dict]:
+        """The (standard) configuration at `position` of the shard, or None if the shard is done."""
+        if self.method == 'grid':
+            i = self.start + position
+            return self.grid.config(i) if i < self.stop else None
+        from .backend import _sample_parameter
+        rng = random.Random(f"{self.seed}-{self.shard_index + position * self.num_shards}")
+        return {key: _sample_parameter(spec, rng) for key, spec in sorted(self.parameters.items())}
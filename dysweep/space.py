@@ -0,0 +1,239 @@
+"""
+A columnar view of the parameter space of a sweep, for sampling configurations in
+the process instead of asking the sweep server for them one at a time. Every swept
+parameter of the standardized sweep (the output of `flatten_sweep_config` after the
+keys have been compressed) becomes a column:
+
+- parameters with `values` (or a single `value`) are categorical, and are drawn as
+  integer codes into the array of their values (aliases from `sweep_alias` stay
+  aliases, so a code never has to carry a whole sub-configuration);
+- parameters with a distribution are drawn as floats (or integers) from it.
+
+Random samples, Sobol and Latin hypercube designs are all drawn as points of the
+unit cube (one dimension per parameter) and mapped onto the domain of every
+parameter with vectorized inverse CDFs; a grid is a range of mixed-radix indices over
+the categorical parameters. Nothing is decoded until a configuration is actually
+needed:
+
+```python
+space = ParameterSpace.from_sweep_config(sweep_configuration, base_config)
+samples = space.lhs(10000, seed=0)
+samples.columns['lr']       # an array of 10000 learning rates
+samples[42]                 # the hierarchical config of the 43rd sample
+```
+
+numpy is needed for this module, and scipy for Sobol designs: `pip install dysweep[space]`.
+"""
+import typing as th
+import copy
+import math
+from .utils import destandardize_sweep_config, upsert_config
+
+CATEGORICAL = 'categorical'
+DISTRIBUTIONS = ['uniform', 'int_uniform', 'q_uniform', 'log_uniform', 'log_uniform_values', 'normal']
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy should be installed for sampling a parameter space: pip install dysweep[space]")
+    return numpy
+
+
+def infer_distribution(spec: dict) -> th.Optional[str]:
+    """The distribution of a parameter, with the same defaults as W&B when it is not given."""
+    distribution = spec.get('distribution')
+    if distribution is None:
+        # integer bounds mean an integer uniform distribution
+        if 'min' in spec and 'max' in spec:
+            distribution = 'int_uniform' if isinstance(spec['min'], int) and \
+                isinstance(spec['max'], int) else 'uniform'
+        elif 'mu' in spec or 'sigma' in spec:
+            distribution = 'normal'
+    return distribution
+
+
+def _norm_ppf(u):
+    """The inverse CDF of the standard normal distribution."""
+    np = _numpy()
+    try:
+        from scipy.special import ndtri
+        return ndtri(u)
+    except ImportError:
+        from statistics import NormalDist
+        return np.vectorize(NormalDist().inv_cdf, otypes=[float])(u)
+
+
+class Samples:
+    """
+    Configurations drawn from a `ParameterSpace`, stored by column: `columns` maps
+    every parameter to an array (of codes for the categorical ones). Indexing decodes a
+    single sample into its hierarchical configuration.
+    """
+
+    def __init__(self, space: "ParameterSpace", columns: th.Dict[str, th.Any]):
+        self.space = space
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if len(self.columns) > 0 else 0
+
+    def raw(self, i: int) -> dict:
+        """The standard (compressed) configuration of sample `i`, as the sweep server would hand it out."""
+        return self.space.decode_raw({name: column[i] for name, column in self.columns.items()})
+
+    def __getitem__(self, i: int) -> dict:
+        return self.space.hierarchical_config(self.raw(i))
+
+    def __iter__(self) -> th.Iterator[dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ParameterSpace:
+    """
+    The domains of the parameters of a standardized sweep, by column.
+
+    Args:
+        parameters:
+            The `parameters` of the standardized sweep configuration.
+        compression:
+            The compression maps of the sweep (the metadata that is stored with it),
+            needed for decoding samples into hierarchical configurations.
+        base_config:
+            The base configuration that the samples are upserted onto.
+    """
+
+    def __init__(self, parameters: dict, compression: th.Optional[dict] = None,
+                 base_config: th.Optional[dict] = None):
+        np = _numpy()
+        self.compression = compression
+        self.base_config = base_config
+        self.names: th.List[str] = sorted(parameters.keys())
+        self.kinds: th.Dict[str, str] = {}
+        # the values of the categorical parameters, in the order of their codes
+        self.categories: th.Dict[str, th.Any] = {}
+        self.specs: th.Dict[str, dict] = {}
+        for name in self.names:
+            spec = parameters[name]
+            if 'values' in spec or 'value' in spec:
+                values = spec['values'] if 'values' in spec else [spec['value']]
+                if len(values) == 0:
+                    raise ValueError(f"The parameter {name} has no values.")
+                categories = np.empty(len(values), dtype=object)
+                categories[:] = values
+                self.kinds[name] = CATEGORICAL
+                self.categories[name] = categories
+            else:
+                distribution = infer_distribution(spec)
+                if distribution not in DISTRIBUTIONS:
+                    raise ValueError(f"The distribution {distribution} of {name} can not be sampled locally.")
+                self.kinds[name] = distribution
+            self.specs[name] = spec
+
+    @classmethod
+    def from_sweep_config(cls, sweep_configuration: dict,
+                          base_config: th.Optional[dict] = None) -> "ParameterSpace":
+        """The parameter space of a hierarchical sweep configuration (with its `parameters`)."""
+        from .wandbX import standardize_isolated
+        sweep_standard, compression = standardize_isolated(sweep_configuration)
+        return cls(sweep_standard.get('parameters', {}), compression, base_config)
+
+    @property
+    def dimension(self) -> int:
+        return len(self.names)
+
+    @property
+    def grid_shape(self) -> th.Tuple[int, ...]:
+        """The number of values of every parameter, for a grid over all of them."""
+        continuous = [name for name in self.names if self.kinds[name] != CATEGORICAL]
+        if len(continuous) > 0:
+            raise ValueError(f"The parameters {continuous} have no values, so they can not be part of a grid.")
+        return tuple(len(self.categories[name]) for name in self.names)
+
+    @property
+    def grid_size(self) -> int:
+        return math.prod(self.grid_shape)
+
+    def from_unit(self, u) -> Samples:
+        """
+        Map points of the unit cube (an array of shape (n, dimension)) onto the
+        parameter space, one column per parameter.
+        """
+        np = _numpy()
+        u = np.asarray(u, dtype=float)
+        columns = {}
+        for j, name in enumerate(self.names):
+            kind, spec, x = self.kinds[name], self.specs[name], u[:, j]
+            if kind == CATEGORICAL:
+                k = len(self.categories[name])
+                columns[name] = np.minimum((x * k).astype(np.int64), k - 1)
+            elif kind == 'uniform':
+                columns[name] = spec['min'] + x * (spec['max'] - spec['min'])
+            elif kind == 'int_uniform':
+                width = spec['max'] - spec['min'] + 1
+                columns[name] = spec['min'] + np.minimum((x * width).astype(np.int64), width - 1)
+            elif kind == 'q_uniform':
+                q = spec.get('q', 1)
+                columns[name] = np.round((spec['min'] + x * (spec['max'] - spec['min'])) / q) * q
+            elif kind == 'log_uniform':
+                columns[name] = np.exp(spec['min'] + x * (spec['max'] - spec['min']))
+            elif kind == 'log_uniform_values':
+                low, high = math.log(spec['min']), math.log(spec['max'])
+                columns[name] = np.exp(low + x * (high - low))
+            elif kind == 'normal':
+                # keep away from 0 and 1, where the inverse CDF is infinite
+                x = np.clip(x, 1e-12, 1 - 1e-12)
+                columns[name] = spec.get('mu', 0.0) + spec.get('sigma', 1.0) * _norm_ppf(x)
+        return Samples(self, columns)
+
+    def sample(self, n: int, seed: th.Optional[int] = None) -> Samples:
+        """`n` independent random samples."""
+        np = _numpy()
+        return self.from_unit(np.random.default_rng(seed).random((n, self.dimension)))
+
+    def lhs(self, n: int, seed: th.Optional[int] = None) -> Samples:
+        """A Latin hypercube design of `n` samples: every parameter is stratified into `n` bins."""
+        np = _numpy()
+        rng = np.random.default_rng(seed)
+        # a random permutation of the bins for every parameter, and a random point in every bin
+        bins = np.argsort(rng.random((n, self.dimension)), axis=0)
+        return self.from_unit((bins + rng.random((n, self.dimension))) / n)
+
+    def sobol(self, n: int, seed: th.Optional[int] = None, scramble: bool = True) -> Samples:
+        """The first `n` points of a (scrambled) Sobol sequence; `n` should be a power of 2."""
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ImportError("scipy should be installed for Sobol designs: pip install dysweep[space]")
+        sampler = qmc.Sobol(d=self.dimension, scramble=scramble, seed=seed)
+        return self.from_unit(sampler.random(n))
+
+    def grid(self, start: int = 0, stop: th.Optional[int] = None) -> Samples:
+        """
+        The grid configurations with indices in [start, stop), in the same order as a grid
+        sweep hands them out (the last parameter varies the fastest).
+        """
+        np = _numpy()
+        shape = self.grid_shape
+        stop = self.grid_size if stop is None else min(stop, self.grid_size)
+        codes = np.unravel_index(np.arange(start, max(start, stop)), shape)
+        return Samples(self, dict(zip(self.names, codes)))
+
+    def decode_raw(self, row: th.Dict[str, th.Any]) -> dict:
+        """The standard configuration of a single row of samples (codes for the categorical parameters)."""
+        raw = {}
+        for name, value in row.items():
+            if self.kinds[name] == CATEGORICAL:
+                value = self.categories[name][int(value)]
+            raw[name] = value.item() if hasattr(value, 'item') else value
+        return raw
+
+    def hierarchical_config(self, raw: dict) -> dict:
+        """Upsert a standard configuration onto the base configuration."""
+        if self.compression is None:
+            return raw
+        # the values of aliases are shared between the samples, and upserting modifies them
+        config = copy.deepcopy(destandardize_sweep_config(raw, self.compression))
+        return upsert_config(copy.deepcopy(self.base_config or {}), config)
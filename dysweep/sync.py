@@ -0,0 +1,233 @@
+"""
+Synchronization of run directories with a shared store, so that a run can be resumed
+(using `rerun_id`) on a node that does not have its checkpoint directory.
+
+Files are split into fixed-size chunks that are stored by their content hash, and
+every run has a manifest that lists the chunks of each of its files:
+
+```
+<store>/chunks/<first two hex digits>/<sha256>
+<store>/runs/<run_id>/manifest.json
+```
+
+Only the chunks that the other side does not have are transferred: pushing a run
+directory uploads the chunks that are not in the store yet, and pulling it rebuilds
+the files from the chunks that are already in the local directory, reading only the
+missing ones from the store. A copy of the manifest of the last synchronization is
+kept in the run directory (`.dysweep-manifest.json`), so files that have not been
+modified since are not hashed again.
+
+The store is a plain directory (e.g. on a shared filesystem); every write to it is
+atomic, so several nodes can push to it at the same time.
+"""
+import typing as th
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+CHUNK_SIZE = 4 * 1024 * 1024
+LOCAL_MANIFEST = ".dysweep-manifest.json"
+
+
+def _atomic_write(path: Path, data: bytes):
+    tmp = path.parent / f".{path.name}.tmp-{os.getpid()}-{time.time_ns()}"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _hash_chunks(path: Path, chunk_size: int) -> th.Iterator[th.Tuple[str, bytes]]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            yield hashlib.sha256(chunk).hexdigest(), chunk
+
+
+class CheckpointStore:
+    """
+    A content-addressed store of run directories under `root`.
+
+    Args:
+        root:
+            The directory of the store, usually on a filesystem that all the nodes share.
+        chunk_size:
+            The size of the chunks that files are split into; only the chunks that
+            changed are transferred.
+    """
+
+    def __init__(self, root: th.Union[Path, str], chunk_size: int = CHUNK_SIZE):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        os.makedirs(self.root / 'chunks', exist_ok=True)
+        os.makedirs(self.root / 'runs', exist_ok=True)
+
+    def _chunk_path(self, digest: str) -> Path:
+        return self.root / 'chunks' / digest[:2] / digest
+
+    def _manifest_path(self, run_id: str) -> Path:
+        return self.root / 'runs' / run_id / 'manifest.json'
+
+    def manifest(self, run_id: str) -> th.Optional[dict]:
+        """The manifest of the run in the store, or None if the run has never been pushed."""
+        try:
+            with open(self._manifest_path(run_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def has_run(self, run_id: str) -> bool:
+        return self._manifest_path(run_id).exists()
+
+    @staticmethod
+    def _local_manifest(run_dir: Path) -> dict:
+        try:
+            with open(run_dir / LOCAL_MANIFEST) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'files': {}, 'updated': None}
+
+    @staticmethod
+    def _write_local_manifest(run_dir: Path, manifest: dict):
+        _atomic_write(run_dir / LOCAL_MANIFEST, json.dumps(manifest).encode('utf-8'))
+
+    def push(self, run_id: str, run_dir: th.Union[Path, str]) -> int:
+        """
+        Upload the run directory `run_dir` as the run `run_id`; returns the number of
+        bytes that were actually written to the store.
+        """
+        run_dir = Path(run_dir)
+        previous = self._local_manifest(run_dir)['files']
+        files = {}
+        uploaded = 0
+        for root, dirs, names in os.walk(run_dir):
+            for name in names:
+                path = Path(root) / name
+                rel = str(path.relative_to(run_dir))
+                if rel == LOCAL_MANIFEST or name.startswith(f".{LOCAL_MANIFEST}.tmp"):
+                    continue
+                stat = path.lstat()
+                if path.is_symlink():
+                    files[rel] = {'link': os.readlink(path)}
+                    continue
+                old = previous.get(rel)
+                if old is not None and old.get('size') == stat.st_size and \
+                        old.get('mtime_ns') == stat.st_mtime_ns and self._has_chunks(old['chunks']):
+                    # not modified since the last synchronization
+                    files[rel] = old
+                    continue
+                chunks = []
+                for digest, chunk in _hash_chunks(path, self.chunk_size):
+                    chunk_path = self._chunk_path(digest)
+                    if not chunk_path.exists():
+                        os.makedirs(chunk_path.parent, exist_ok=True)
+                        _atomic_write(chunk_path, chunk)
+                        uploaded += len(chunk)
+                    chunks.append(digest)
+                files[rel] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                              'mode': stat.st_mode & 0o777, 'chunks': chunks}
+        manifest = {'run_id': run_id, 'chunk_size': self.chunk_size,
+                    'updated': time.time(), 'files': files}
+        os.makedirs(self._manifest_path(run_id).parent, exist_ok=True)
+        _atomic_write(self._manifest_path(run_id), json.dumps(manifest).encode('utf-8'))
+        self._write_local_manifest(run_dir, manifest)
+        return uploaded
+
+    def _has_chunks(self, chunks: th.List[str]) -> bool:
+        return all(self._chunk_path(digest).exists() for digest in chunks)
+
+    def pull(self, run_id: str, run_dir: th.Union[Path, str], force: bool = False) -> int:
+        """
+        Bring the run directory `run_dir` up to date with the run `run_id` of the store;
+        returns the number of bytes that were actually read from the store. Nothing is
+        done if the local directory is already as recent as the store, unless `force`
+        is set.
+        """
+        run_dir = Path(run_dir)
+        manifest = self.manifest(run_id)
+        if manifest is None:
+            raise FileNotFoundError(f"The run {run_id} is not in the checkpoint store at {self.root}")
+        local = self._local_manifest(run_dir)
+        if not force and local['updated'] is not None and local['updated'] >= manifest['updated']:
+            return 0
+
+        os.makedirs(run_dir, exist_ok=True)
+        chunk_size = manifest['chunk_size']
+        downloaded = 0
+        for rel, entry in manifest['files'].items():
+            path = run_dir / rel
+            os.makedirs(path.parent, exist_ok=True)
+            if 'link' in entry:
+                if path.is_symlink() or path.exists():
+                    path.unlink()
+                os.symlink(entry['link'], path)
+                continue
+            old = local['files'].get(rel)
+            if old is not None and old.get('chunks') == entry['chunks'] and path.exists() and \
+                    path.stat().st_size == entry['size']:
+                continue
+            # the chunks that the local version of the file already has, by hash
+            local_chunks = {}
+            if path.exists() and not path.is_symlink():
+                offset = 0
+                for digest, chunk in _hash_chunks(path, chunk_size):
+                    local_chunks.setdefault(digest, offset)
+                    offset += len(chunk)
+            tmp = path.parent / f".{path.name}.tmp-{os.getpid()}"
+            with open(tmp, 'wb') as out:
+                src = open(path, 'rb') if len(local_chunks) > 0 else None
+                try:
+                    for digest in entry['chunks']:
+                        if digest in local_chunks:
+                            src.seek(local_chunks[digest])
+                            out.write(src.read(chunk_size))
+                        else:
+                            with open(self._chunk_path(digest), 'rb') as f:
+                                data = f.read()
+                            out.write(data)
+                            downloaded += len(data)
+                finally:
+                    if src is not None:
+                        src.close()
+            os.chmod(tmp, entry.get('mode', 0o644))
+            os.replace(tmp, path)
+            os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+
+        # remove the files that are not part of the run anymore
+        for root, dirs, names in os.walk(run_dir):
+            for name in names:
+                rel = str((Path(root) / name).relative_to(run_dir))
+                if rel != LOCAL_MANIFEST and rel not in manifest['files']:
+                    os.remove(Path(root) / name)
+        self._write_local_manifest(run_dir, manifest)
+        return downloaded
+
+    def remove(self, run_id: str):
+        """Forget the run; the chunks are left for `collect_garbage`."""
+        shutil.rmtree(self.root / 'runs' / run_id, ignore_errors=True)
+
+    def collect_garbage(self, min_age: float = 3600.0) -> int:
+        """
+        Remove the chunks that no manifest refers to and that are older than `min_age`
+        seconds (so that the chunks of a push in progress are left alone); returns the
+        number of bytes that were freed.
+        """
+        referenced = set()
+        for manifest_path in (self.root / 'runs').glob('*/manifest.json'):
+            with open(manifest_path) as f:
+                for entry in json.load(f)['files'].values():
+                    referenced.update(entry.get('chunks', []))
+        freed = 0
+        now = time.time()
+        for chunk_path in (self.root / 'chunks').glob('*/*'):
+            if chunk_path.name in referenced or chunk_path.name.startswith('.'):
+                continue
+            stat = chunk_path.stat()
+            if now - stat.st_mtime > min_age:
+                chunk_path.unlink(missing_ok=True)
+                freed += stat.st_size
+        return freed
@@ -0,0 +1,180 @@
+"""
+Aggregation of the timings of runs (check `profiling`) over a checkpoint root, i.e.
+a `default_root_dir` with one `checkpoints-<sweep_id>` directory per sweep, or a
+single checkpoint directory. It answers how fast a sweep goes and where its time
+is lost: runs per hour, the setup overhead of a run, how often runs fail and are
+resumed, how much compute went into attempts that did not finish, and how long the
+agents sit idle between two runs.
+
+The timings files only ever grow, so the lines that have been read are kept in a
+cache (`.dysweep-report-cache.json` in the root) and only the new lines of every
+file are read the next time.
+"""
+import typing as th
+import csv
+import io
+import json
+import os
+import statistics
+from pathlib import Path
+from .profiling import TIMINGS_SUFFIX
+
+CACHE_NAME = ".dysweep-report-cache.json"
+
+# the phases that are not part of the overhead of a run: the function itself, and
+# the preparation of the prefetching agent that overlaps with the previous run.
+_NOT_OVERHEAD_PREFIX = 'prefetch_'
+_FUNCTION_PHASE = 'function'
+
+
+def _timings_files(root: Path) -> th.Iterator[th.Tuple[str, os.DirEntry]]:
+    """The timings files of the root (at its top level or one level below), with their sweep."""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(TIMINGS_SUFFIX):
+                yield root.name, entry
+            elif entry.is_dir() and not entry.name.startswith('.'):
+                with os.scandir(entry.path) as sub_entries:
+                    for sub_entry in sub_entries:
+                        if sub_entry.is_file() and sub_entry.name.endswith(TIMINGS_SUFFIX):
+                            yield entry.name, sub_entry
+
+
+def _compact(record: dict) -> dict:
+    """Only keep what the report needs, so that the cache stays small."""
+    phases = record.get('phases', {})
+    return {
+        'run_id': record.get('run_id'),
+        'status': record.get('status'),
+        'resumed': bool(record.get('resumed')),
+        'agent': f"{record.get('host')}:{record.get('pid')}",
+        'host': record.get('host'),
+        'start': record.get('start'),
+        'end': record.get('end'),
+        'function': phases.get(_FUNCTION_PHASE, 0.0),
+        'overhead': sum(seconds for name, seconds in phases.items()
+                        if name != _FUNCTION_PHASE and not name.startswith(_NOT_OVERHEAD_PREFIX)),
+        'peak_rss_mb': record.get('peak_rss_mb'),
+        # the number of configurations of an attempt that has evaluated a whole batch
+        'batch': record.get('batch', 1),
+    }
+
+
+def load_records(root: th.Union[Path, str], use_cache: bool = True) -> th.Dict[str, th.List[dict]]:
+    """
+    Read the timings of all the attempts of runs under `root`, by sweep. Only the lines
+    that have been appended since the last call are read when `use_cache` is set.
+    """
+    root = Path(root).resolve()
+    cache_path = root / CACHE_NAME
+    cache = {}
+    if use_cache and cache_path.exists():
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except json.JSONDecodeError:
+            cache = {}
+
+    new_cache = {}
+    for sweep, entry in _timings_files(root):
+        stat = entry.stat()
+        cached = cache.get(entry.path)
+        if cached is not None and cached['size'] > stat.st_size:
+            # the file has been replaced, read it again
+            cached = None
+        if cached is not None and cached['size'] == stat.st_size:
+            new_cache[entry.path] = cached
+            continue
+        offset = cached['offset'] if cached is not None else 0
+        records = list(cached['records']) if cached is not None else []
+        with open(entry.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # a line that is still being written
+                    break
+                offset += len(line)
+                try:
+                    records.append(_compact(json.loads(line)))
+                except json.JSONDecodeError:
+                    continue
+        new_cache[entry.path] = {'sweep': sweep, 'size': offset, 'offset': offset, 'records': records}
+
+    if use_cache:
+        tmp_path = root / f".{CACHE_NAME}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(new_cache, f)
+        os.replace(tmp_path, cache_path)
+
+    by_sweep: th.Dict[str, th.List[dict]] = {}
+    for cached in new_cache.values():
+        by_sweep.setdefault(cached['sweep'], []).extend(cached['records'])
+    return by_sweep
+
+
+def summarize(records: th.List[dict]) -> dict:
+    """The throughput statistics of a list of attempts (check the module docstring)."""
+    if len(records) == 0:
+        return {'attempts': 0}
+    records = sorted(records, key=lambda r: r['start'] or 0.0)
+    finished = [r for r in records if r['status'] == 'finished']
+    span = max(r['end'] for r in records) - min(r['start'] for r in records)
+    function_seconds = sum(r['function'] for r in records)
+
+    # the time between the end of a run and the start of the next one on the same agent
+    gaps = []
+    busy, agent_spans = 0.0, 0.0
+    by_agent: th.Dict[str, th.List[dict]] = {}
+    for r in records:
+        by_agent.setdefault(r['agent'], []).append(r)
+    for attempts in by_agent.values():
+        for previous, current in zip(attempts, attempts[1:]):
+            gaps.append(max(0.0, current['start'] - previous['end']))
+        agent_spans += attempts[-1]['end'] - attempts[0]['start']
+        busy += sum(r['function'] for r in attempts)
+
+    rss = [r['peak_rss_mb'] for r in records if r['peak_rss_mb'] is not None]
+    return {
+        'attempts': len(records),
+        'runs': len({r['run_id'] for r in records}),
+        'finished_runs': len({r['run_id'] for r in finished}),
+        'agents': len(by_agent),
+        'hosts': len({r['host'] for r in records}),
+        'wall_clock_hours': span / 3600,
+        'runs_per_hour': sum(r.get('batch', 1) for r in finished) / (span / 3600) if span > 0 else None,
+        'median_setup_overhead_seconds': statistics.median(r['overhead'] for r in records),
+        'median_function_seconds': statistics.median(r['function'] for r in records),
+        'failure_rate': sum(r['status'] == 'failed' for r in records) / len(records),
+        'preemption_rate': sum(r['status'] == 'preempted' for r in records) / len(records),
+        'resume_rate': sum(r['resumed'] for r in records) / len(records),
+        # the compute of the attempts that did not finish, which (at least partly)
+        # has to be done again when the run is resumed
+        'wasted_function_hours': sum(r['function'] for r in records if r['status'] != 'finished') / 3600,
+        'wasted_fraction': (sum(r['function'] for r in records if r['status'] != 'finished') /
+                            function_seconds if function_seconds > 0 else 0.0),
+        'median_gap_between_runs_seconds': statistics.median(gaps) if len(gaps) > 0 else None,
+        # the fraction of the lifetime of the agents that was not spent in the function
+        'agent_idle_fraction': 1 - busy / agent_spans if agent_spans > 0 else None,
+        'max_peak_rss_mb': max(rss) if len(rss) > 0 else None,
+    }
+
+
+def sweep_report(root: th.Union[Path, str], use_cache: bool = True) -> dict:
+    """The statistics of every sweep under `root`, and of all of them together under `total`."""
+    by_sweep = load_records(root, use_cache=use_cache)
+    report = {sweep: summarize(records) for sweep, records in sorted(by_sweep.items())}
+    report['total'] = summarize([r for records in by_sweep.values() for r in records])
+    return report
+
+
+def to_csv(report: dict) -> str:
+    """One row per sweep (and one for the total), with a column per statistic."""
+    columns = []
+    for stats in report.values():
+        columns.extend(key for key in stats.keys() if key not in columns)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['sweep'] + columns)
+    for sweep, stats in report.items():
+        writer.writerow([sweep] + [stats.get(key) for key in columns])
+    return out.getvalue()
@@ -2,8 +2,8 @@ import typing as th
 import re
 import dypy as dy
 import traceback
-from pprint import pprint
-import json
+from pprint import pprint, pformat
+from . import serialization
 import copy
 
 SEPARATOR = "__CUSTOM_SEPERATOR__"
@@ -22,7 +22,6 @@ DY_LIST_OVERWRITE = "dy__overwrite"
 DY_EVAL = "dy__eval"
 
 SPLIT = "-"
-EXCEPTION_OCCURED = False
 
 SPECIAL_KEYS = [
     SWEEP_INDICATION,
@@ -227,6 +226,34 @@ def sanity_check_special_keys(conf: th.Union[dict, list], current_path: list):
             if isinstance(val, dict) or isinstance(val, list):
                 sanity_check_special_keys(val, current_path + [str(idx)])
 
+
+class UpsertContext:
+    """
+    Where an exception has happened in `upsert_config`: the path of keys and the part of
+    the sweep configuration that was being upserted there. It is attached to the exception
+    (in `args` and as `upsert_context`) and only formatted when the exception is displayed,
+    so code that catches the exception, e.g. for validating many configurations, does
+    not pay for serializing the configuration.
+    """
+
+    def __init__(self, path: th.List[str], sweep_config):
+        self.path = list(path)
+        self.sweep_config = sweep_config
+        self._formatted: th.Optional[str] = None
+
+    def __repr__(self) -> str:
+        if self._formatted is None:
+            try:
+                fragment = serialization.dumps(self.sweep_config, pretty=True, default=str).decode('utf-8')
+            except Exception:
+                fragment = pformat(self.sweep_config)
+            self._formatted = f"Configuration path trying to upsert: {self.path}\n" \
+                              f"Configuration to upsert: {fragment}"
+        return self._formatted
+
+    __str__ = __repr__
+
+
 # TODO: this is the result of incremental and backwards compatible changes
 # it should be cleaned up: overwrite args recursively
 def upsert_config(args: th.Union[th.Dict, th.List],
@@ -477,17 +504,16 @@ def upsert_config(args: th.Union[th.Dict, th.List],
             sanity_check_special_keys(args, current_path=current_path)
 
     except Exception as e:
-        global EXCEPTION_OCCURED
-        if not EXCEPTION_OCCURED:
-            EXCEPTION_OCCURED = True
-            # update e so that it has the current path
-            e.args += ("Configuration path trying to upsert: " +
-                       str(current_path),)
-            # update e so that it has the sweep_config
-            # format sweep_config in a nice string using pprint
-
-            e.args += ("Configuration to upsert: " +
-                       json.dumps(sweep_config, indent=2),)
+        # only the innermost call knows where it has failed, the outer ones leave the context as it is
+        # (exceptions that do not take attributes only carry it in their args)
+        if getattr(e, 'upsert_context', None) is None and \
+                not any(isinstance(arg, UpsertContext) for arg in e.args):
+            context = UpsertContext(current_path, sweep_config)
+            try:
+                e.upsert_context = context
+            except AttributeError:
+                pass
+            e.args += (context,)
         raise e
     # Change all the __IDX__ arguments to a list
     # if that is the case here
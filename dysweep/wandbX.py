@@ -2,15 +2,24 @@
 import typing as th
 import wandb
 from pprint import pprint
-import os
 from .utils import standardize_sweep_config, destandardize_sweep_config, upsert_config
+from .backend import SweepBackend, WandbBackend, METADATA_RUN_NAME_PREFIX
+from . import profiling
 from wandb.sdk.wandb_run import Run, _run_decorator
 from wandb.sdk import wandb_config
 import warnings
 import copy
+import pickle
+import time
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
 from pprint import pprint
 
-METADATA_RUN_NAME_PREFIX = "HIERARCHICAL_SWEEP_"
+__all__ = [
+    # defined in `.backend` since the metadata runs are created there, and kept here for compatibility
+    'METADATA_RUN_NAME_PREFIX',
+    'hierarchical_config', 'standardize_isolated', 'sweep', 'sweep_batch', 'load_hierarchical_metadata', 'agent',
+]
 
 base_config: th.Optional[dict] = None
 compression: th.Optional[dict] = None
@@ -23,11 +32,29 @@ def hierarchical_config(conf):
     return upsert_config(copy.deepcopy(base_config), destandardize_sweep_config(conf, compression))
 
 
+def standardize_isolated(sweep_config: dict) -> th.Tuple[dict, dict]:
+    """
+    Standardize a single hierarchical sweep configuration starting from
+    a clean compression state. The compression maps in `.utils` are module
+    globals, so they are reset before and copied after the standardization;
+    that way, this function can be called many times in the same process
+    (or in a pool of worker processes) without sweeps leaking aliases into
+    each other.
+    """
+    from . import utils
+    utils.compression_mapping.clear()
+    utils.value_compression_mapping.clear()
+    utils.remaining_bunch.clear()
+    sweep_standard, compression = standardize_sweep_config(sweep_config)
+    return copy.deepcopy(sweep_standard), copy.deepcopy(compression)
+
+
 def sweep(
     base_config: dict,
     sweep_config: dict,
     entity: th.Optional[str] = None,
     project: th.Optional[str] = None,
+    backend: th.Optional[SweepBackend] = None,
 ) -> str:
     """
     Create a run under the current project and entity, and save the
@@ -37,75 +64,98 @@ def sweep(
 
     I ended up with this implementation, because wandb has not yet released the
     Public API, so I had to use the artifacts capability for it to work.
+
+    The sweep is registered on the given `backend` (W&B by default).
     """
-    # import these three variables from .utils: 
-    # compression_mapping = {}
-    # value_compression_mapping = {}
-    # remaining_bunch = {}
-    from .utils import compression_mapping, value_compression_mapping, remaining_bunch
-    compression_mapping.clear()
-    value_compression_mapping.clear()
-    remaining_bunch.clear()
-    
+    if backend is None:
+        backend = WandbBackend()
     # (1) change the sweep_config to a standard sweep_config
-    sweep_standard, compression = standardize_sweep_config(sweep_config)
+    sweep_standard, compression = standardize_isolated(sweep_config)
+    # (2) create the sweep and store its metadata
     sweep_metadata = {'base_config': base_config, 'compression': compression}
-    sweep_id = wandb.sweep(sweep_standard, entity=entity, project=project)
+    return backend.create_sweep(sweep_standard, sweep_metadata,
+                                entity=entity, project=project)
 
-    # (2) create a run and save the base_config as an artifact
-    wandb.init(entity=entity, project=project,
-               name=f"{METADATA_RUN_NAME_PREFIX}{sweep_id}",
-               config=sweep_metadata,
-               notes="This run contains the metadata for the sweep."
-               "\nDrawn from the hierarchical sweep package, at:"
-               "\n\thttps://github.com/HamidrezaKmK/hierarchical-sweep",
-               tags=["hierarchical_sweep"])
 
-    wandb.finish()
+def sweep_batch(
+    items: th.List[th.Dict[str, th.Any]],
+    max_workers: th.Optional[int] = None,
+    backend: th.Optional[SweepBackend] = None,
+) -> th.List[str]:
+    """
+    Create many sweeps at once. Every item is a dictionary with the keys
+    `base_config`, `sweep_config`, `entity` and `project` (the same arguments
+    as `sweep`).
 
-    return sweep_id
+    All the sweep configurations are standardized in parallel using a pool of
+    processes (the compression state is global, so threads would not do), and then
+    they are registered one after the other from this process. This saves the
+    interpreter startup and the imports that one would pay when calling
+    `dysweep_create` once per sweep; every sweep still gets its own metadata run.
 
+    Returns the list of sweep identifiers in the same order as `items`.
+    """
+    sweep_configs = [item['sweep_config'] for item in items]
+
+    standardized = []
+    if max_workers != 1 and len(items) > 1:
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for result in executor.map(standardize_isolated, sweep_configs):
+                    standardized.append(result)
+        except (pickle.PicklingError, AttributeError, TypeError, BrokenProcessPool) as e:
+            # sweep configurations that contain local functions or lambdas
+            # (e.g. as dy__eval expressions) can not be sent to other processes,
+            # and a worker can die (e.g. killed for its memory).
+            warnings.warn(
+                f"Could not standardize the sweeps in parallel ({e}), "
+                "falling back to sequential standardization for the remaining ones.")
+    standardized += [standardize_isolated(s) for s in sweep_configs[len(standardized):]]
+
+    if backend is None:
+        backend = WandbBackend()
+        # set up the W&B service once instead of with the first metadata run
+        wandb.setup()
+    sweep_ids = []
+    for item, (sweep_standard, compression) in zip(items, standardized):
+        sweep_metadata = {'base_config': item['base_config'], 'compression': compression}
+        sweep_ids.append(
+            backend.create_sweep(sweep_standard, sweep_metadata,
+                                 entity=item.get('entity'), project=item.get('project'))
+        )
+    return sweep_ids
 
-def agent(sweep_id, function=None, entity=None, project=None, count=None):
+
+def load_hierarchical_metadata(sweep_id, entity=None, project=None, backend=None):
+    """
+    Load the metadata of the sweep from the backend, so that `hierarchical_config`
+    can decode the configurations of that sweep.
+    """
+    if backend is None:
+        backend = WandbBackend()
+    global base_config, compression
+    start = time.perf_counter()
+    sweep_metadata = backend.load_metadata(sweep_id, entity=entity, project=project)
+    # attributed to the first run of the agent
+    profiling.add_pending('metadata', time.perf_counter() - start)
+    base_config = sweep_metadata['base_config']
+    compression = sweep_metadata['compression']
+
+
+def agent(sweep_id, function=None, entity=None, project=None, count=None, backend=None):
     """
     First, run the agent on the sweep_id. 
     Then call the same run that contains the artifact and use it for decompression
     of the sweep configuration. Then, decorate the function so that 
     when getting the sweep_configuration from the server, it will first
     decompress it and then do whatever it did with the config.
-    """
-    # (1) get the artfact from the run based on the run_name
-    # iterate over all the runs
-    # if the run_name starts with METADATA_RUN_NAME_PREFIX
-    # then get the artifact from that run
-    # and save it in the mapping_run_id_to_sweep_id
-
-    # get the run_path from entity and project
-    run_path = ""
-    if entity is not None:
-        run_path = os.path.join(run_path, entity)
-    if project is not None:
-        run_path = os.path.join(run_path, project)
-
-    # List all the runs in the project
-    all_runs = wandb.Api().runs(path=run_path)
-
-    # find the run with the metadata for the sweep we are looking for
-    sweep_run = None
-    for run in all_runs:
-        if run.name.startswith(METADATA_RUN_NAME_PREFIX) and \
-                run.name[len(METADATA_RUN_NAME_PREFIX):] == sweep_id:
-            sweep_run = run
-            break
-
-    if sweep_run is None:
-        raise ValueError(
-            f"Could not find the run with artifacts associated with: {sweep_id}\n"
-            "Make sure you have the id correct!")
 
-    global base_config, compression
-    base_config = sweep_run.config['base_config']
-    compression = sweep_run.config['compression']
+    The agent runs on the given `backend` (W&B by default).
+    """
+    if backend is None:
+        backend = WandbBackend()
+    # (1) get the metadata of the sweep from the backend
+    load_hierarchical_metadata(sweep_id, entity=entity, project=project, backend=backend)
 
     try:
         wandb.sdk.wandb_run.Run.hierarchical_config = property(
@@ -116,5 +166,5 @@ def agent(sweep_id, function=None, entity=None, project=None, count=None):
             "Could not set the hierarchical_config property on wandb_run.Run\n"
             "Use the hierarchical_config function instead.")
 
-    return wandb.agent(sweep_id, function=function,
-                       entity=entity, project=project, count=count)
+    return backend.agent(sweep_id, function=function,
+                         entity=entity, project=project, count=count)
@@ -0,0 +1,122 @@
+"""
+A long-lived worker that keeps the user function (and everything it has imported)
+in memory and pulls successive configurations from the sweep. Objects that are
+expensive to build and can be shared between runs (datasets, tokenizers, ...)
+can be cached in the worker process using `shared_state`, so that the startup cost
+is paid once per worker rather than once per run.
+"""
+import typing as th
+import copy
+import functools
+import time
+import traceback
+
+_shared_state: th.Dict[str, th.Any] = {}
+
+
+def shared_state(key: str, factory: th.Optional[th.Callable[[], th.Any]] = None):
+    """
+    Returns the object cached under `key` in this process. If there is no such
+    object, it is created by calling `factory()` and cached for the next runs.
+
+    For example, inside of your function:
+
+    ```python
+    train_set = dysweep.shared_state(
+        f"train-{config['data']['dataset_class']}",
+        lambda: load_dataset(config['data']),
+    )
+    ```
+    """
+    if key not in _shared_state:
+        if factory is None:
+            raise KeyError(f"There is no shared state under {key} and no factory to create it.")
+        _shared_state[key] = factory()
+    return _shared_state[key]
+
+
+def clear_shared_state(key: th.Optional[str] = None):
+    """Remove the object cached under `key`, or all of the objects if no key is given."""
+    if key is None:
+        _shared_state.clear()
+    else:
+        _shared_state.pop(key, None)
+
+
+def run_worker(
+    conf,
+    function: th.Callable,
+    setup: th.Optional[th.Callable[[], th.Any]] = None,
+    max_runs: th.Optional[int] = None,
+    idle_timeout: th.Optional[float] = None,
+    poll_interval: float = 30.0,
+) -> int:
+    """
+    Keep running configurations of the sweep `conf.sweep_id` in this process.
+
+    The agent is (re)started in rounds of `conf.count` runs (or until the sweep has no
+    configurations left); when a round does not run anything, the worker waits for
+    `poll_interval` seconds and asks again, until `idle_timeout` seconds have passed
+    without any run. Errors of the agent itself (e.g. network hiccups) do not stop the
+    worker.
+
+    Args:
+        conf:
+            A ResumableSweepConfig (or the namespace parsed from the command-line) with
+            `sweep_id` set.
+        function:
+            The function that is passed to `dysweep_run_resume`.
+        setup: optional(callable)
+            Called once when the worker starts, e.g. to warm up `shared_state`.
+        max_runs: optional(int)
+            The worker stops after running this many configurations.
+        idle_timeout: optional(float)
+            The worker stops after this many seconds without any configuration to run;
+            when it is not given, the worker stops as soon as a round runs nothing.
+        poll_interval: float
+            The number of seconds to wait before asking an idle sweep for more configurations.
+    Returns:
+        The number of configurations that have been run.
+    """
+    from .parallel import dysweep_run_resume
+
+    if conf.sweep_id is None:
+        raise ValueError("sweep_id should be given to the worker.")
+    if setup is not None:
+        setup()
+
+    ran = 0
+
+    @functools.wraps(function)
+    def counted_function(*args, **kwargs):
+        nonlocal ran
+        ran += 1
+        return function(*args, **kwargs)
+
+    idle_since = None
+    while max_runs is None or ran < max_runs:
+        # dysweep_run_resume resolves some of the fields of the configuration
+        # in place, so every round gets a fresh copy.
+        round_conf = copy.copy(conf)
+        if max_runs is not None:
+            remaining = max_runs - ran
+            round_conf.count = remaining if conf.count is None else min(conf.count, remaining)
+        ran_before = ran
+        try:
+            dysweep_run_resume(round_conf, counted_function)
+        except Exception:
+            print("Exception in the worker agent:")
+            print(traceback.format_exc())
+
+        if ran > ran_before:
+            idle_since = None
+            continue
+        if idle_timeout is None:
+            break
+        if idle_since is None:
+            idle_since = time.time()
+        if time.time() - idle_since >= idle_timeout:
+            break
+        time.sleep(poll_interval)
+
+    return ran
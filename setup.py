@@ -18,7 +18,9 @@ setup(
     entry_points={
         'console_scripts' : [
             'dysweep_create = dysweep.console:create_sweep',
-            'dysweep_run_resume = dysweep.console:run_resume_sweep'
+            'dysweep_run_resume = dysweep.console:run_resume_sweep',
+            'dysweep_worker = dysweep.console:worker',
+            'dysweep_report = dysweep.console:report',
         ]
     },
     keywords=[
@@ -46,4 +48,14 @@ setup(
         "Topic :: Utilities",
     ],
     python_requires=">=3.8",
+    install_requires=[
+        # read the sweep files of `dysweep_create --batch`
+        "PyYAML",
+    ],
+    extras_require={
+        # smaller sweep metadata files, with DYSWEEP_METADATA_CODEC=msgpack-zstd
+        "compact": ["msgspec", "zstandard"],
+        # ParameterSpace, Sobol designs and batch_arrays
+        "space": ["numpy", "scipy"],
+    },
 )
@@ -0,0 +1,84 @@
+"""
+Compare the serializers of dysweep on large configurations, the way they are written
+for every run (indented, with sorted keys) and read back when resuming.
+
+    python bench_serialization.py [--layers 2000] [--repeat 20]
+"""
+import sys
+sys.path.append("../")
+import argparse
+import json
+import random
+import time
+from dysweep import serialization
+
+
+def large_config(layers: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {
+        'model': {
+            'class_path': 'models.ResNet',
+            'layers': [
+                {
+                    'class_path': rng.choice(['torch.nn.Conv2d', 'torch.nn.Linear', 'torch.nn.BatchNorm2d']),
+                    'init_args': {'in_channels': rng.randint(1, 512), 'out_channels': rng.randint(1, 512),
+                                  'kernel_size': [3, 3], 'bias': rng.random() < 0.5},
+                    'dropout': rng.random(),
+                    'name': f"layer_{i}",
+                }
+                for i in range(layers)
+            ],
+        },
+        'data': {
+            'mean': [rng.random() for _ in range(layers)],
+            'classes': {f"class_{i}": i for i in range(layers)},
+        },
+        'trainer': {'max_epochs': 100, 'lr': 1e-3, 'precision': '16-mixed', 'callbacks': None},
+    }
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--layers', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    config = large_config(args.layers)
+    baseline_text = json.dumps(config, indent=4, sort_keys=True)
+    print(f"configuration of {len(baseline_text) / 1e6:.2f} MB (indented)")
+
+    # what dysweep did before the serialization layer
+    baseline_dump = best_of(lambda: json.dumps(config, indent=4, sort_keys=True), args.repeat)
+    baseline_load = best_of(lambda: json.loads(baseline_text), args.repeat)
+
+    print(f"{'serializer':<12}{'dump (ms)':>12}{'load (ms)':>12}{'size (KB)':>12}{'speedup':>10}")
+    print(f"{'stdlib':<12}{baseline_dump * 1e3:>12.2f}{baseline_load * 1e3:>12.2f}"
+          f"{len(baseline_text) / 1e3:>12.1f}{1.0:>10.1f}")
+    for name in serialization.available_serializers():
+        serialization.set_serializer(name)
+        data = serialization.dumps(config, pretty=True, sort_keys=True)
+        assert serialization.loads(data) == config
+        dump = best_of(lambda: serialization.dumps(config, pretty=True, sort_keys=True), args.repeat)
+        load = best_of(lambda: serialization.loads(data), args.repeat)
+        speedup = (baseline_dump + baseline_load) / (dump + load)
+        print(f"{name:<12}{dump * 1e3:>12.2f}{load * 1e3:>12.2f}{len(data) / 1e3:>12.1f}{speedup:>10.1f}")
+    if serialization.has_msgpack():
+        data = serialization.packb(config)
+        dump = best_of(lambda: serialization.packb(config), args.repeat)
+        load = best_of(lambda: serialization.unpackb(data), args.repeat)
+        speedup = (baseline_dump + baseline_load) / (dump + load)
+        print(f"{'msgpack':<12}{dump * 1e3:>12.2f}{load * 1e3:>12.2f}{len(data) / 1e3:>12.1f}{speedup:>10.1f}")
+    serialization.set_serializer(None)
+
+
+if __name__ == "__main__":
+    main()
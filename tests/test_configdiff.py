@@ -0,0 +1,59 @@
+import json
+import pytest
+from dysweep import serialization
+from dysweep.configdiff import (config_diff, apply_config_diff, write_run_config, read_run_config,
+                                copy_run_config, DIFF_KEY)
+
+BASE = {
+    'model': {'lr': 0.1, 'layers': [64, 64], 'bn': True, 'head': {'dropout': 0.5, 'bias': True}},
+    'data': {'batch_size': 32},
+    'seed': 0,
+}
+
+
+@pytest.mark.parametrize('config', [
+    BASE,
+    # bool and int compare equal in Python, but not once they are written
+    {**BASE, 'seed': False, 'model': {**BASE['model'], 'bn': 1}},
+    # lists are replaced as a whole
+    {**BASE, 'model': {**BASE['model'], 'layers': [64]}},
+    {**BASE, 'model': {**BASE['model'], 'layers': [64, 64, {'kind': 'attention'}]}},
+    # nested keys are unset, and new ones are set
+    {**BASE, 'model': {**BASE['model'], 'head': {'bias': True}}, 'optimizer': {'name': 'adam'}},
+    {'data': {'batch_size': 32}},
+    {'model': None},
+])
+def test_round_trip(config):
+    diff = config_diff(BASE, config)
+    result = apply_config_diff(BASE, diff)
+    assert result == config
+    assert json.dumps(result, sort_keys=True) == json.dumps(config, sort_keys=True)
+
+
+def test_bool_and_int_are_different_values():
+    diff = config_diff({'a': 1, 'b': True}, {'a': True, 'b': 1})
+    assert sorted(path for path, _ in diff['set']) == [['a'], ['b']]
+
+
+def test_nested_unset_and_the_base_is_left_alone():
+    config = {**BASE, 'model': {**BASE['model'], 'head': {'bias': True}}}
+    diff = config_diff(BASE, config)
+    assert diff == {'set': [], 'unset': [['model', 'head', 'dropout']]}
+    apply_config_diff(BASE, diff)
+    assert BASE['model']['head']['dropout'] == 0.5
+
+
+def test_files_with_a_base(tmp_path):
+    config = {**BASE, 'model': {**BASE['model'], 'lr': 0.01}}
+    run_dir, final_dir = tmp_path / 'run', tmp_path / 'final'
+    run_dir.mkdir()
+    final_dir.mkdir()
+    write_run_config(run_dir / 'run_config.json', config, base=BASE, bases_dir=tmp_path)
+    assert DIFF_KEY in serialization.load(run_dir / 'run_config.json')
+    assert read_run_config(run_dir / 'run_config.json') == config
+    # the copy can be read without the directory it came from
+    copy_run_config(run_dir / 'run_config.json', final_dir / 'config.json')
+    assert read_run_config(final_dir / 'config.json') == config
+    # full configurations are read as they are
+    write_run_config(run_dir / 'full.json', config)
+    assert read_run_config(run_dir / 'full.json') == config
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+from dysweep.datacache import SharedDatasetCache
+
+
+def test_builds_of_dead_processes_are_removed(tmp_path):
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    stale = tmp_path / f".abc.tmp-{dead.pid}"
+    running = tmp_path / f".def.tmp-{os.getpid()}"
+    for entry in [stale, running]:
+        os.makedirs(entry / 'refs')
+        (entry / 'x.npy').write_bytes(b'0' * 100)
+
+    cache = SharedDatasetCache(tmp_path)
+    assert not stale.exists()
+    assert running.exists()
+    cache.evict()
+    assert running.exists()
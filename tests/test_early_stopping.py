@@ -0,0 +1,79 @@
+from dysweep.early_stopping import EarlyStoppingPolicy, rung_of, rung_budget, is_last_rung, in_top, \
+    should_continue, next_promotion
+from dysweep.index import CheckpointIndex
+from dysweep import reporting
+
+
+def test_rungs_of_the_budgets():
+    policy = EarlyStoppingPolicy(min_budget=1, reduction_factor=3, max_budget=27)
+    assert [rung_of(b, policy, 0) for b in [0.5, 1, 2, 3, 8.9, 9, 26, 27, 100]] == \
+        [None, 0, 0, 1, 1, 2, 2, 2, 2]
+    # the first rung of the bracket s is min_budget * reduction_factor ** s
+    assert rung_of(2, policy, 1) is None
+    assert rung_of(3, policy, 1) == 0
+    assert [rung_budget(policy, 0, r) for r in range(4)] == [1, 3, 9, 27]
+    assert is_last_rung(policy, 0, 3) and not is_last_rung(policy, 0, 2)
+
+
+def test_in_top():
+    policy = EarlyStoppingPolicy(reduction_factor=2, goal='minimize')
+    assert in_top(1.0, [1.0, 2.0, 3.0, 4.0], policy)
+    assert in_top(2.0, [1.0, 2.0, 3.0, 4.0], policy)
+    assert not in_top(3.0, [1.0, 2.0, 3.0, 4.0], policy)
+    # too few runs to be among the best half
+    assert not in_top(1.0, [1.0], policy)
+    policy.goal = 'maximize'
+    assert in_top(4.0, [1.0, 2.0, 3.0, 4.0], policy)
+    assert not in_top(2.0, [1.0, 2.0, 3.0, 4.0], policy)
+
+
+def test_decisions_at_a_rung(tmp_path):
+    index = CheckpointIndex(tmp_path)
+    policy = EarlyStoppingPolicy(min_budget=1, reduction_factor=2, goal='minimize')
+    # with fewer than reduction_factor runs at the rung, every run goes on
+    assert should_continue(index, policy, 'a', 0, 0, 5.0)
+    assert not should_continue(index, policy, 'b', 0, 0, 6.0)
+    assert should_continue(index, policy, 'c', 0, 0, 1.0)
+    assert not should_continue(index, policy, 'd', 0, 0, 7.0)
+    # the metric of an earlier attempt stays
+    should_continue(index, policy, 'b', 0, 0, 0.0)
+    assert index.rung_metrics(0, 0) == {'a': 5.0, 'b': 6.0, 'c': 1.0, 'd': 7.0}
+    # other rungs and brackets are compared separately
+    assert should_continue(index, policy, 'b', 1, 0, 6.0)
+
+
+def test_paused_runs_are_promoted_once(tmp_path):
+    index = CheckpointIndex(tmp_path)
+    policy = EarlyStoppingPolicy(min_budget=1, reduction_factor=2, max_budget=8, goal='minimize', pause=True)
+    for run_id, metric in [('a', 3.0), ('b', 1.0)]:
+        index.run_started(run_id, run_id, tmp_path / run_id)
+        index.record_rung(run_id, 0, 0, metric)
+        index.run_paused(run_id, 0)
+    promoted = next_promotion(index, policy)
+    assert promoted['id'] == 'b' and promoted['rung'] == 1
+    assert index.run_rung('b') == 1
+    # 'a' is not among the best half, and 'b' is not paused anymore
+    assert next_promotion(index, policy) is None
+
+
+def test_a_report_is_recorded_at_every_rung_it_crosses(tmp_path):
+    index = CheckpointIndex(tmp_path)
+    policy = EarlyStoppingPolicy(min_budget=1, reduction_factor=3, goal='minimize')
+    reporting.begin_run(index, 'a', early_stopping=policy)
+    try:
+        # rungs at 1, 3 and 9
+        reporting.report(metric=2.0, budget=10)
+    finally:
+        reporting.end_run()
+    assert [index.rung_metrics(0, rung) for rung in range(4)] == [{'a': 2.0}, {'a': 2.0}, {'a': 2.0}, {}]
+
+    for run_id, metric in [('b', 1.0), ('c', 0.5)]:
+        index.record_rung(run_id, 0, 0, metric)
+    reporting.begin_run(index, 'd', early_stopping=policy)
+    try:
+        reporting.report(metric=3.0, budget=10)
+        # falls behind at the first rung, and is not recorded at the others
+        assert reporting.should_stop()
+    finally:
+        reporting.end_run()
+    assert 'd' in index.rung_metrics(0, 0) and 'd' not in index.rung_metrics(0, 1)
@@ -0,0 +1,45 @@
+import itertools
+import pytest
+from dysweep.grid import GridIndex
+
+PARAMETERS = {
+    'lr': {'values': [0.1, 0.01, 0.001]},
+    'arch': {'values': [[1, 2], {'depth': 3}, 'mlp']},
+    'seed': {'value': 7},
+    'bn': {'values': [True, False]},
+}
+
+
+def enumerate_grid(parameters: dict):
+    # how the grid used to be enumerated: sorted keys, the last key varying the fastest
+    keys = sorted(parameters.keys())
+    all_values = [parameters[key]['values'] if 'values' in parameters[key] else [parameters[key]['value']]
+                  for key in keys]
+    return [dict(zip(keys, combination)) for combination in itertools.product(*all_values)]
+
+
+def test_the_order_is_the_one_of_the_enumeration():
+    grid = GridIndex(PARAMETERS)
+    expected = enumerate_grid(PARAMETERS)
+    assert len(grid) == len(expected) == 18
+    assert [grid.config(i) for i in range(len(grid))] == expected
+    assert list(grid.configs(4, 9)) == expected[4:9]
+    assert grid.config(-1) == expected[-1]
+
+
+def test_index_is_the_inverse_of_config():
+    grid = GridIndex(PARAMETERS)
+    for i in range(len(grid)):
+        assert grid.index(grid.config(i)) == i
+
+
+def test_out_of_range_and_unknown_values():
+    grid = GridIndex(PARAMETERS)
+    with pytest.raises(IndexError):
+        grid.config(len(grid))
+    with pytest.raises(ValueError):
+        grid.index({**grid.config(0), 'lr': 1.0})
+    with pytest.raises(KeyError):
+        grid.index({'lr': 0.1})
+    with pytest.raises(ValueError):
+        GridIndex({'lr': {'min': 0, 'max': 1}})
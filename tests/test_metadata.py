@@ -0,0 +1,18 @@
+import pytest
+from dysweep.metadata import encode_metadata, decode_metadata, MAGIC, CODEC_JSON_ZLIB
+
+METADATA = {'base_config': {'model': {'lr': 0.1, 'layers': [64, 64]}}, 'compression': {'a': 'model.lr'}}
+
+
+def test_json_zlib_is_the_default_codec(monkeypatch):
+    # whatever is installed on this node, every agent can read the file
+    monkeypatch.delenv('DYSWEEP_METADATA_CODEC', raising=False)
+    data = encode_metadata(METADATA)
+    assert data[len(MAGIC) + 1] == CODEC_JSON_ZLIB
+    assert decode_metadata(data) == METADATA
+
+
+def test_unknown_codec(monkeypatch):
+    monkeypatch.setenv('DYSWEEP_METADATA_CODEC', 'pickle')
+    with pytest.raises(ValueError):
+        encode_metadata(METADATA)
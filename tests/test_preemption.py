@@ -0,0 +1,78 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import pytest
+from dysweep import preemption
+
+
+def test_signal_only_stops_the_run_and_the_flush_happens_afterwards():
+    previous = signal.getsignal(signal.SIGTERM)
+    calls = []
+    assert preemption.install(flush_timeout=5)
+    try:
+        preemption.begin_run(on_preempted=lambda: calls.append('marked'))
+        preemption.on_preemption(lambda: calls.append('flushed'))
+        with pytest.raises(preemption.Preempted):
+            os.kill(os.getpid(), signal.SIGTERM)
+        # nothing but the request happens inside of the handler
+        assert preemption.preemption_requested()
+        assert calls == []
+        preemption.handle_preempted()
+        preemption.handle_preempted()
+        assert calls == ['marked', 'flushed']
+    finally:
+        preemption.end_run()
+        preemption.uninstall()
+    assert signal.getsignal(signal.SIGTERM) is previous
+
+
+RUN_SCRIPT = """
+import os, signal, sys, threading, time
+import dysweep
+from dysweep.parallel import dysweep_run_resume
+root, mode = sys.argv[1], sys.argv[2]
+common = dict(project='p', backend='local', backend_dir=os.path.join(root, 'backend'),
+              default_root_dir=os.path.join(root, 'logs'), preemption_timeout=1)
+if mode == 'create':
+    print(dysweep_run_resume(**common, base_config={'a': 1},
+                             sweep_configuration={'lr': {'sweep': True, 'values': [1, 2, 3]}}))
+    sys.exit(0)
+
+def function(config, checkpoint_dir):
+    with open(os.path.join(root, 'calls'), 'a') as f:
+        print(checkpoint_dir, file=f)
+    threading.Timer(0.2, lambda: os.kill(os.getpid(), signal.SIGTERM)).start()
+    for _ in range(50):
+        if dysweep.preemption_requested():
+            # saves its state and returns early
+            return
+        time.sleep(0.1)
+
+if mode == 'run':
+    dysweep_run_resume(**common, sweep_id=sys.argv[3], function=function, count=1)
+else:
+    dysweep_run_resume(**common, sweep_id=sys.argv[3], function=function, resume=True, count=3)
+"""
+
+
+def test_sigterm_stops_a_run_resumed_with_a_count(tmp_path):
+    def run(*args):
+        return subprocess.run([sys.executable, '-c', RUN_SCRIPT, str(tmp_path), *args],
+                              capture_output=True, text=True, timeout=60)
+
+    sweep_id = run('create').stdout.strip().splitlines()[-1]
+    # two runs that are preempted and left to be resumed
+    for _ in range(2):
+        assert run('run', sweep_id).returncode == 143
+    (tmp_path / 'calls').unlink()
+
+    result = run('resume', sweep_id)
+    assert result.returncode == 143, result.stderr
+    # the agent stops with the first resumed run, instead of starting the next one
+    assert len((tmp_path / 'calls').read_text().splitlines()) == 1
+    checkpoint_dir = next((tmp_path / 'logs').glob('checkpoints-*'))
+    states = sqlite3.connect(checkpoint_dir / '.dysweep-index.sqlite').execute(
+        "SELECT state FROM runs").fetchall()
+    assert sorted(states) == [('preempted',), ('preempted',)]
@@ -0,0 +1,29 @@
+import os
+import signal
+import threading
+from dysweep.scheduler import NodeScheduler, reserve_resources, release_resources
+
+
+def test_killed_run_gives_its_resources_back(tmp_path):
+    marker = tmp_path / "killed"
+
+    def target():
+        reservation = reserve_resources(None, {})
+        if not marker.exists():
+            marker.touch()
+            # dies while holding the only CPU of the node
+            os.kill(os.getpid(), signal.SIGKILL)
+        release_resources(reservation)
+        return 0
+
+    scheduler = NodeScheduler(2, resources={'cpus': 1}, poll_interval=0.1)
+    succeeded = []
+    thread = threading.Thread(target=lambda: succeeded.append(scheduler.run(target, count=3)), daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    # the scheduler would otherwise wait forever for the CPU of the killed run
+    assert not thread.is_alive()
+    assert succeeded == [2]
+    assert marker.exists()
+    assert list(scheduler.gate.used) == [0.0]
+    assert scheduler.gate.waiting.value == 0
@@ -0,0 +1,23 @@
+import pytest
+from dysweep import serialization
+
+CONFIG = {
+    'model': {'class_path': 'models.ResNet', 'layers': [64, {'kind': 'attention', 'heads': 8}], 'bias': True},
+    'data': {'name': 'café', 'classes': {}, 'augment': [], 'note': 'a\n  b'},
+    'seed': None,
+}
+
+
+@pytest.fixture(params=serialization.available_serializers())
+def serializer(request):
+    serialization.set_serializer(request.param)
+    yield request.param
+    serialization.set_serializer(None)
+
+
+@pytest.mark.parametrize('pretty', [False, True])
+def test_every_serializer_writes_the_same_json(serializer, pretty):
+    data = serialization.dumps(CONFIG, pretty=pretty, sort_keys=True)
+    serialization.set_serializer('json')
+    assert data == serialization.dumps(CONFIG, pretty=pretty, sort_keys=True)
+    assert serialization.loads(data) == CONFIG
@@ -0,0 +1,48 @@
+import pytest
+from dysweep.grid import GridIndex
+from dysweep.sharding import shard_range, Shard
+
+SWEEP = {
+    'method': 'grid',
+    'parameters': {'a': {'values': [1, 2, 3]}, 'b': {'values': ['x', 'y']}, 'c': {'values': [0, 1, 2, 3, 4]}},
+}
+
+
+@pytest.mark.parametrize('size', [0, 1, 7, 30, 101])
+@pytest.mark.parametrize('num_shards', [1, 2, 3, 8, 40])
+def test_ranges_are_disjoint_and_complete(size, num_shards):
+    ranges = [shard_range(size, k, num_shards) for k in range(num_shards)]
+    covered = [i for start, stop in ranges for i in range(start, stop)]
+    assert covered == list(range(size))
+    lengths = [stop - start for start, stop in ranges]
+    assert max(lengths) - min(lengths) <= 1
+
+
+@pytest.mark.parametrize('num_shards', [1, 4, 7, 30, 45])
+def test_grid_shards_cover_the_grid_once(num_shards):
+    configs = []
+    for k in range(num_shards):
+        shard = Shard(SWEEP, 'sweep', k, num_shards)
+        position = 0
+        while (config := shard.config(position)) is not None:
+            configs.append(config)
+            position += 1
+        assert position == len(shard)
+    grid = GridIndex(SWEEP['parameters'])
+    assert configs == list(grid.configs())
+
+
+def test_random_shards_interleave_the_same_samples():
+    sweep = {'method': 'random', 'parameters': {'lr': {'min': 0.0, 'max': 1.0}, 'n': {'values': [1, 2, 3]}}}
+    shards = [Shard(sweep, 'sweep', k, 3) for k in range(3)]
+    samples = [shards[i % 3].config(i // 3) for i in range(12)]
+    # the same samples for every agent, and no two streams alike
+    assert samples == [Shard(sweep, 'sweep', i % 3, 3).config(i // 3) for i in range(12)]
+    assert len({s['lr'] for s in samples}) == 12
+
+
+def test_invalid_shards():
+    with pytest.raises(ValueError):
+        Shard(SWEEP, 'sweep', 2, 2)
+    with pytest.raises(ValueError):
+        Shard({**SWEEP, 'method': 'bayes'}, 'sweep', 0, 2)
@@ -0,0 +1,23 @@
+import pytest
+from dysweep import utils
+from dysweep.utils import upsert_config, UpsertContext
+
+
+class FrozenError(Exception):
+    # an exception that does not take new attributes
+    def __setattr__(self, name, value):
+        if name != 'args':
+            raise AttributeError(name)
+        super().__setattr__(name, value)
+
+
+def test_the_context_of_a_failed_upsert_is_attached_once(monkeypatch):
+    def fail(root_args):
+        raise FrozenError("fail")
+
+    monkeypatch.setattr(utils.dy, 'eval', lambda *args, **kwargs: fail)
+    with pytest.raises(FrozenError) as info:
+        upsert_config({'a': {'c': 1}}, {'a': {'b': {'dy__eval': {'expression': 'fail'}}}})
+    contexts = [arg for arg in info.value.args if isinstance(arg, UpsertContext)]
+    assert len(contexts) == 1
+    assert contexts[0].path == ['a']